@@ -0,0 +1,110 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, asdict
+from threading import Lock
+from typing import Optional
+
+from .actions_registry import get_registered_action, register_all
+from .constants import ACTION_TIMEOUT, ACTION_RETRIES
+from .events import EventPublisher, NullEventPublisher
+from .utils.http_session import request_timeout
+from .utils.metrics import Stage, record_stage
+
+
+@dataclass
+class ActionMetrics:
+    calls: int = 0
+    successes: int = 0
+    failures: int = 0
+    retries: int = 0
+    dropped: int = 0
+    total_latency: float = 0.0
+    max_latency: float = 0.0
+
+
+class ActionExecutor:
+    """
+    Runs actions on a pool of worker threads so the vision loop never waits
+    on them. Each action gets a request timeout and a number of retries,
+    which can be overridden per action when registering it.
+    """
+    def __init__(
+        self,
+        num_workers: int = 2,
+        max_pending: int = 8,
+        timeout: float = ACTION_TIMEOUT,
+        retries: int = ACTION_RETRIES,
+        backoff: float = 0.25,
+        event_publisher: Optional[EventPublisher] = None
+    ):
+        self.pool = ThreadPoolExecutor(num_workers, thread_name_prefix="action")
+        self.max_pending = max_pending
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.event_publisher = event_publisher or NullEventPublisher()
+        self.pending = 0
+        self.action_metrics: dict[str, ActionMetrics] = {}
+        self.lock = Lock()
+        register_all()
+
+    def submit(self, function: str):
+        with self.lock:
+            metrics = self.action_metrics.setdefault(function, ActionMetrics())
+            metrics.calls += 1
+            try:
+                get_registered_action(function)
+            except KeyError:
+                metrics.failures += 1
+                print(f"unknown action {function}")
+                return
+            if self.pending >= self.max_pending:
+                metrics.dropped += 1
+                print(f"dropping action {function}, too many pending actions")
+                return
+            self.pending += 1
+        self.pool.submit(self.run, function)
+
+    def run(self, function: str):
+        action, options = get_registered_action(function)
+        timeout = options.get("timeout") or self.timeout
+        retries = options.get("retries")
+        retries = self.retries if retries is None else retries
+        request_timeout.set(timeout)
+
+        start = time.perf_counter()
+        error = None
+        for attempt in range(retries + 1):
+            if attempt > 0:
+                time.sleep(self.backoff * 2 ** (attempt - 1))
+            try:
+                action()
+                error = None
+                break
+            except Exception as e:
+                error = e
+        latency = time.perf_counter() - start
+        record_stage(Stage.ACTION, latency)
+
+        with self.lock:
+            self.pending -= 1
+            metrics = self.action_metrics[function]
+            metrics.retries += attempt
+            metrics.total_latency += latency
+            metrics.max_latency = max(metrics.max_latency, latency)
+            if error is None:
+                metrics.successes += 1
+            else:
+                metrics.failures += 1
+        if error is not None:
+            print(f"action {function} failed after {attempt + 1} attempt(s): {error}")
+        self.event_publisher.action(
+            function, error is None, latency, None if error is None else str(error)
+        )
+
+    def metrics(self) -> dict[str, dict]:
+        with self.lock:
+            return {name: asdict(m) for name, m in self.action_metrics.items()}
+
+    def shutdown(self, wait: bool = True):
+        self.pool.shutdown(wait=wait, cancel_futures=not wait)
@@ -1,7 +1,5 @@
-from dotenv import dotenv_values
-from requests import post
-
 from spellcaster.actions_registry import register
+from spellcaster.utils.http_session import get_env_values, post
 
 
 @register("log something")
@@ -11,7 +9,7 @@ def log_something(something: str):
 
 @register("turn on office light")
 def turn_on_light():
-    api_key = dotenv_values(".env")["HOMEASSISTANT_API_KEY"]
+    api_key = get_env_values()["HOMEASSISTANT_API_KEY"]
     url = "http://homeassistant.local:8123/api/services/light/turn_on"
     headers = {"Authorization": f"Bearer {api_key}"}
     data = {"entity_id": "light.office_fan"}
@@ -25,7 +23,7 @@ def turn_on_light():
 
 @register("turn on office fan")
 def turn_on_fan():
-    api_key = dotenv_values(".env")["HOMEASSISTANT_API_KEY"]
+    api_key = get_env_values()["HOMEASSISTANT_API_KEY"]
     url = "http://homeassistant.local:8123/api/services/fan/turn_on"
     headers = {"Authorization": f"Bearer {api_key}"}
     data = {"entity_id": "fan.office_fan"}
@@ -1,18 +1,30 @@
 from importlib import import_module
 
 actions = {}
+action_options = {}
 
 
-def register(action_name):
+def register(action_name, timeout=None, retries=None):
     def decorator(func):
         actions[action_name] = func
+        action_options[action_name] = {"timeout": timeout, "retries": retries}
         return func
     return decorator
 
 
+_registered = False
+
+
 def register_all():
+    global _registered
+    if _registered:
+        return
+    _registered = True
     module = import_module("spellcaster.actions")
     for submodule in module.__all__:
         import_module(f"spellcaster.actions.{submodule}")
 
-register_all()
\ No newline at end of file
+
+def get_registered_action(action_name):
+    register_all()
+    return actions[action_name], action_options[action_name]
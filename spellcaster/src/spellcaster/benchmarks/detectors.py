@@ -0,0 +1,81 @@
+import math
+import time
+from pathlib import Path
+
+import cv2
+import numpy as np
+
+from spellcaster.utils.blob_detector import BlobDetectorType, get_blob_detector
+
+
+def load_frames(recording: str, grayscale: bool = True):
+    """
+    Loads frames from a video file or a directory of images.
+    """
+    path = Path(recording)
+    frames = []
+    if path.is_dir():
+        for image_path in sorted(path.iterdir()):
+            frame = cv2.imread(
+                str(image_path), cv2.IMREAD_GRAYSCALE if grayscale else cv2.IMREAD_COLOR
+            )
+            if frame is not None:
+                frames.append(frame)
+    else:
+        cap = cv2.VideoCapture(str(path))
+        while True:
+            ret, frame = cap.read()
+            if not ret:
+                break
+            frames.append(cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY) if grayscale else frame)
+        cap.release()
+
+    if len(frames) == 0:
+        raise ValueError(f"No frames found in {recording}")
+    return frames
+
+
+def time_detector(detector, frames):
+    keypoints = []
+    latencies = []
+    for frame in frames:
+        start = time.perf_counter()
+        keypoints.append(detector.detect(frame))
+        latencies.append(time.perf_counter() - start)
+    return keypoints, np.array(latencies) * 1000
+
+
+def benchmark_detectors(recording: str, scale: float = 1.0, max_dist: float = 5.0):
+    """
+    Compares the latency of each blob detector on recorded frames, and the
+    recall of each against the SimpleBlobDetector keypoints.
+    """
+    frames = load_frames(recording)
+    if scale != 1.0:
+        frames = [
+            cv2.resize(f, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+            for f in frames
+        ]
+
+    results = {
+        detector: time_detector(get_blob_detector(scale, detector), frames)
+        for detector in BlobDetectorType
+    }
+    reference, _ = results[BlobDetectorType.SIMPLE]
+    num_reference = sum(len(k) for k in reference)
+
+    print(f"{len(frames)} frames of shape {frames[0].shape}")
+    for detector, (keypoints, latencies) in results.items():
+        matched = 0
+        for ref_keypoints, det_keypoints in zip(reference, keypoints):
+            for ref in ref_keypoints:
+                if any(math.dist(ref.pt, k.pt) <= max_dist for k in det_keypoints):
+                    matched += 1
+        recall = matched / num_reference if num_reference > 0 else float("nan")
+        print(
+            f"{detector:>10}: "
+            f"mean {latencies.mean():.3f} ms, "
+            f"p50 {np.percentile(latencies, 50):.3f} ms, "
+            f"p99 {np.percentile(latencies, 99):.3f} ms, "
+            f"recall {recall:.3f}"
+        )
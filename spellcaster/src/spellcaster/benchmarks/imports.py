@@ -0,0 +1,33 @@
+import statistics
+import subprocess
+import sys
+import time
+
+# modules to time, from what management commands need up to the full
+# inference stack
+MODULES = [
+    "spellcaster.spellcaster",
+    "spellcaster.db",
+    "spellcaster.server.server",
+    "spellcaster.wand_tracker",
+    "spellcaster.spell_handler",
+    "spellcaster.modeling.train",
+]
+
+
+def time_import(module: str) -> float:
+    start = time.perf_counter()
+    subprocess.run([sys.executable, "-c", f"import {module}"], check=True)
+    return time.perf_counter() - start
+
+
+def benchmark_imports(repeat: int = 5):
+    """
+    Times importing each module in a fresh interpreter, including interpreter
+    startup.
+    """
+    baseline = statistics.median([time_import("sys") for _ in range(repeat)]) * 1000
+    print(f"{'interpreter startup':>28}: {baseline:.0f} ms")
+    for module in MODULES:
+        latency = statistics.median([time_import(module) for _ in range(repeat)]) * 1000
+        print(f"{module:>28}: {latency:.0f} ms")
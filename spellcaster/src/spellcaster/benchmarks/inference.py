@@ -0,0 +1,122 @@
+import multiprocessing
+import time
+from functools import partial
+from typing import Optional
+
+import numpy as np
+
+from spellcaster.benchmarks.rasterizer import random_wand_paths
+from spellcaster.constants import MODEL_PATH
+from spellcaster.inference_worker import InferenceClient, InferenceWorker
+from spellcaster.modeling.runtime import load_spell_classifier
+from spellcaster.utils.metrics import (
+    COUNT,
+    STAGE_INDICES,
+    Stage,
+    StageHistograms,
+    get_metrics_name,
+    share_stage_metrics
+)
+from spellcaster.utils.wand_path_rasterizer import rasterize_wand_path
+
+# clients and workers load torch themselves, forking a process that has run
+# the model could leave them with a copy of a held OpenMP lock
+context = multiprocessing.get_context("forkserver")
+METRICS_NAME = get_metrics_name("benchmark_inference")
+
+
+def make_model_client(model_path: str, client_id: int):
+    return load_spell_classifier(model_path)
+
+
+def make_worker_client(request_queue, response_queues: dict, client_id: int):
+    return InferenceClient(request_queue, response_queues[client_id], client_id, timeout=10.0)
+
+
+def run_client(make_classifier, client_id: int, images: np.ndarray, results):
+    classifier = make_classifier(client_id)
+    latencies = []
+    start = time.monotonic()
+    for image in images:
+        request_start = time.perf_counter()
+        classifier.predict(image[None])
+        latencies.append(time.perf_counter() - request_start)
+    results.put((start, time.monotonic(), latencies))
+
+
+def run_clients(make_classifier, num_clients: int, images: np.ndarray) -> tuple[float, np.ndarray]:
+    """
+    Runs num_clients processes classifying images one at a time, like
+    trackers of different cameras, and returns the wall time they took
+    together and every request's latency.
+    """
+    results = context.Queue()
+    clients = [
+        context.Process(target=run_client, args=(make_classifier, i, images, results))
+        for i in range(num_clients)
+    ]
+    for client in clients:
+        client.start()
+    starts, ends, latencies = zip(*[results.get() for _ in clients])
+    for client in clients:
+        client.join()
+    return max(ends) - min(starts), np.concatenate(latencies)
+
+
+def serve(worker: InferenceWorker):
+    share_stage_metrics(METRICS_NAME)
+    worker.serve()
+
+
+def print_results(
+    name: str,
+    num_requests: int,
+    elapsed: float,
+    latencies: np.ndarray,
+    batches: Optional[float] = None
+):
+    latencies = latencies * 1000
+    print(
+        f"{name:>24}: "
+        f"{num_requests / elapsed:8.0f} paths/s, "
+        f"p50 {np.percentile(latencies, 50):.3f} ms, "
+        f"p99 {np.percentile(latencies, 99):.3f} ms"
+        + (f", {num_requests / batches:.1f} paths per batch" if batches else "")
+    )
+
+
+def benchmark_inference(
+    num_clients: int = 4,
+    num_requests: int = 200,
+    model_path: str = MODEL_PATH,
+    batch_window_ms: float = 2.0
+):
+    """
+    Compares clients classifying wand paths with a model of their own with
+    clients sharing an inference worker, with and without a batch window.
+    """
+    images = np.stack([rasterize_wand_path(path) for path in random_wand_paths(num_requests, 60)])[:, None]
+    num_paths = num_clients * num_requests
+
+    elapsed, latencies = run_clients(partial(make_model_client, model_path), num_clients, images)
+    print_results("model per client", num_paths, elapsed, latencies)
+
+    for batch_window_ms in sorted({0.0, batch_window_ms}):
+        request_queue = context.Queue()
+        response_queues = {i: context.Queue() for i in range(num_clients)}
+        worker = InferenceWorker(request_queue, response_queues, model_path, batch_window_ms / 1000)
+        worker_process = context.Process(target=serve, args=(worker,))
+        worker_process.start()
+        elapsed, latencies = run_clients(
+            partial(make_worker_client, request_queue, response_queues),
+            num_clients,
+            images
+        )
+        histograms = StageHistograms.attach(METRICS_NAME)
+        batches = histograms.snapshot()[0][STAGE_INDICES[Stage.INFERENCE_BATCH], COUNT]
+        # the terminated worker leaves its metrics behind
+        histograms.shm.unlink()
+        histograms.close()
+        worker_process.terminate()
+        worker_process.join()
+        print_results(f"shared, {batch_window_ms:g} ms window", num_paths, elapsed, latencies, batches)
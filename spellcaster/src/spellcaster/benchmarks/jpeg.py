@@ -0,0 +1,59 @@
+import time
+from typing import Optional
+
+import cv2
+import numpy as np
+
+from spellcaster.constants import FRAME_SHAPE, STREAM_TIERS
+from spellcaster.utils.jpeg_encoder import JpegBackend, get_jpeg_encoder
+from .detectors import load_frames
+
+
+def synthetic_frames(num_frames: int, seed: int = 0):
+    """
+    Dark, noisy frames with a bright moving dot, roughly what the camera sees.
+    """
+    rng = np.random.default_rng(seed)
+    height, width = FRAME_SHAPE[:2]
+    gradient = np.linspace(10, 60, width, dtype=np.float32)[None, :, None]
+    frames = []
+    for i in range(num_frames):
+        noise = rng.normal(0, 4, FRAME_SHAPE).astype(np.float32)
+        frame = np.clip(gradient + noise, 0, 255).astype(np.uint8)
+        cv2.circle(frame, (50 + 9 * i % (width - 100), height // 2), 6, (255, 255, 255), -1)
+        frames.append(frame)
+    return frames
+
+
+def benchmark_jpeg(recording: Optional[str] = None, num_frames: int = 100, quality: int = 80):
+    """
+    Reports encoded frames per second and bytes per frame of every available
+    JPEG backend at every stream tier.
+    """
+    if recording is not None:
+        frames = load_frames(recording, grayscale=False)
+    else:
+        frames = synthetic_frames(num_frames)
+
+    for backend in JpegBackend:
+        try:
+            encoder = get_jpeg_encoder(backend, quality)
+        except (ImportError, RuntimeError, OSError) as e:
+            print(f"{backend:>10}: unavailable ({e})")
+            continue
+
+        for tier, resolution in STREAM_TIERS.items():
+            tier_frames = frames if resolution is None else [
+                cv2.resize(f, resolution, interpolation=cv2.INTER_AREA) for f in frames
+            ]
+            encoder.encode(tier_frames[0])
+            sizes = []
+            start = time.perf_counter()
+            for frame in tier_frames:
+                sizes.append(len(encoder.encode(frame)))
+            elapsed = time.perf_counter() - start
+            print(
+                f"{backend:>10} {tier:>6}: "
+                f"{len(tier_frames) / elapsed:.0f} fps, "
+                f"{np.mean(sizes) / 1024:.1f} KiB/frame"
+            )
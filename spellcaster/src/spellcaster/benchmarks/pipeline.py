@@ -0,0 +1,215 @@
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from typing import Optional
+
+import numpy as np
+
+from spellcaster.constants import EARLY_SPELL_CONFIDENCE_THRESHOLD, MODEL_PATH, SPELL_CONFIDENCE_THRESHOLD
+from spellcaster.spell_handler import InferenceSpellHandler, SpellPrediction
+from spellcaster.utils.blob_detector import get_blob_detector
+from spellcaster.utils.replay import ReplayCamera, SpellLabel
+from spellcaster.wand_tracker import WandTracker
+
+
+class StageTimes:
+    def __init__(self):
+        self.times: dict[str, list[float]] = defaultdict(list)
+
+    @contextmanager
+    def time(self, stage: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.times[stage].append(time.perf_counter() - start)
+
+    def merge(self, other: "StageTimes"):
+        for stage, times in other.times.items():
+            self.times[stage].extend(times)
+
+
+class TimedWandTracker(WandTracker):
+    def __init__(self, stage_times: StageTimes, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.stage_times = stage_times
+
+    def detect_keypoints(self, frame) -> np.ndarray:
+        with self.stage_times.time("detection"):
+            return super().detect_keypoints(frame)
+
+    def get_wand_keypoint(self, keypoints: np.ndarray):
+        with self.stage_times.time("association"):
+            return super().get_wand_keypoint(keypoints)
+
+
+class ReplaySpellHandler(InferenceSpellHandler):
+    """
+    Records accepted predictions with the frame they were made on. Actions
+    are looked up but only executed with execute_actions, so replaying
+    doesn't have real world side effects.
+    """
+    def __init__(
+        self,
+        stage_times: StageTimes,
+        model_path: str,
+        confidence_threshold: float,
+        execute_actions: bool = False
+    ):
+        super().__init__(model_path=model_path, confidence_threshold=confidence_threshold)
+        self.stage_times = stage_times
+        self.execute_actions = execute_actions
+        self.frame_index = 0
+        self.predictions: list[tuple[int, SpellPrediction]] = []
+
+    def classify(self, wand_path: list[tuple[int, int]]) -> Optional[SpellPrediction]:
+        with self.stage_times.time("inference"):
+            return super().classify(wand_path)
+
+    def handle_prediction(self, prediction: Optional[SpellPrediction]):
+        if prediction is None or not prediction.accepted:
+            return
+        self.predictions.append((self.frame_index, prediction))
+        with self.stage_times.time("action"):
+            action = self.spell_action_cache.get_action(prediction.spell_name)
+            if action is not None and self.execute_actions:
+                self.action_executor.submit(action.function)
+
+
+def score_predictions(
+    predictions: list[tuple[int, SpellPrediction]],
+    labels: list[SpellLabel],
+    tolerance: int
+) -> dict:
+    """
+    Matches every prediction to the first unmatched gesture it was made
+    during, or at most tolerance frames after.
+    """
+    matched = set()
+    scores = {"correct": 0, "wrong": 0, "false_positives": 0, "delays": []}
+    for frame_index, prediction in predictions:
+        label = next((
+            i for i, label in enumerate(labels)
+            if i not in matched and label.start <= frame_index <= label.end + tolerance
+        ), None)
+        if label is None:
+            scores["false_positives"] += 1
+            continue
+        matched.add(label)
+        if prediction.spell_name == labels[label].spell:
+            scores["correct"] += 1
+            # negative when the spell was recognized before the gesture ended
+            scores["delays"].append(frame_index - labels[label].end)
+        else:
+            scores["wrong"] += 1
+    scores["missed"] = len(labels) - len(matched)
+    return scores
+
+
+def replay(recording: str, spell_handler: ReplaySpellHandler, tracker_kwargs: dict):
+    stage_times = spell_handler.stage_times
+    tracker = TimedWandTracker(stage_times, spell_handler=spell_handler, **tracker_kwargs)
+    camera = ReplayCamera(recording, trailing_blank_frames=tracker.patience + 1)
+    spell_handler.predictions = []
+
+    frames = iter(camera.stream())
+    start = time.perf_counter()
+    while True:
+        with stage_times.time("capture"):
+            frame = next(frames, None)
+        if frame is None:
+            break
+        spell_handler.frame_index = camera.frame_index
+        with stage_times.time("frame"):
+            tracker.process_frame(frame)
+    elapsed = time.perf_counter() - start
+    return camera, camera.frame_index + 1, elapsed
+
+
+def print_stage_times(stage_times: StageTimes):
+    for stage in ["capture", "detection", "association", "inference", "action", "frame"]:
+        times = np.array(stage_times.times.get(stage, [])) * 1000
+        if len(times) == 0:
+            continue
+        print(
+            f"{stage:>12}: "
+            f"n {len(times):>6}, "
+            f"p50 {np.percentile(times, 50):.3f} ms, "
+            f"p90 {np.percentile(times, 90):.3f} ms, "
+            f"p99 {np.percentile(times, 99):.3f} ms, "
+            f"max {times.max():.3f} ms"
+        )
+
+
+def print_scores(scores: dict, num_labels: int, frame_rate: float):
+    if num_labels == 0:
+        print(f"no labelled spells, {scores['false_positives']} spells recognized")
+        return
+    print(
+        f"accuracy {scores['correct'] / num_labels:.1%} "
+        f"({scores['correct']} correct, {scores['wrong']} wrong, "
+        f"{scores['missed']} missed, {scores['false_positives']} false positives)"
+    )
+    if len(scores["delays"]) > 0:
+        delays = np.array(scores["delays"]) / frame_rate * 1000
+        print(f"recognized {np.mean(delays):+.0f} ms after the gesture ended on average")
+
+
+def benchmark_pipeline(
+    *recordings: str,
+    model_path: str = MODEL_PATH,
+    confidence_threshold: float = SPELL_CONFIDENCE_THRESHOLD,
+    roi_radius: Optional[int] = 120,
+    detection_scale: float = 0.5,
+    detector: str = "simple",
+    early_recognition_interval: Optional[int] = None,
+    early_confidence_threshold: float = EARLY_SPELL_CONFIDENCE_THRESHOLD,
+    execute_actions: bool = False
+):
+    """
+    Replays recordings through the wand tracker and spell handler as fast as
+    they run, and reports per stage latency percentiles, FPS, and the
+    recognition accuracy against the recordings' labels.
+    """
+    total_times = StageTimes()
+    total_frames = 0
+    total_elapsed = 0.0
+    total_scores = defaultdict(int, delays=[])
+    total_labels = 0
+    frame_rates = []
+    for recording in recordings:
+        stage_times = StageTimes()
+        spell_handler = ReplaySpellHandler(
+            stage_times, model_path, confidence_threshold, execute_actions
+        )
+        tracker_kwargs = {
+            "blob_detector": get_blob_detector(detection_scale, detector),
+            "roi_radius": roi_radius,
+            "detection_scale": detection_scale,
+            "early_recognition_interval": early_recognition_interval,
+            "early_confidence_threshold": early_confidence_threshold,
+        }
+        camera, num_frames, elapsed = replay(recording, spell_handler, tracker_kwargs)
+        spell_handler.close()
+        labels = camera.recording.spells
+        scores = score_predictions(
+            spell_handler.predictions, labels, tolerance=camera.trailing_blank_frames + 5
+        )
+
+        print(f"{recording}: {num_frames} frames, {num_frames / elapsed:.1f} fps")
+        print_stage_times(stage_times)
+        print_scores(scores, len(labels), camera.recording.frame_rate)
+        print()
+
+        total_times.merge(stage_times)
+        total_frames += num_frames
+        total_elapsed += elapsed
+        total_labels += len(labels)
+        frame_rates.append(camera.recording.frame_rate)
+        for key, value in scores.items():
+            total_scores[key] += value
+
+    if len(recordings) > 1:
+        print(f"all recordings: {total_frames} frames, {total_frames / total_elapsed:.1f} fps")
+        print_stage_times(total_times)
+        print_scores(total_scores, total_labels, np.mean(frame_rates))
@@ -0,0 +1,72 @@
+import time
+
+import numpy as np
+import torch
+
+from spellcaster.constants import FRAME_SHAPE, MODEL_INPUT_SIZE
+from spellcaster.modeling.data_loader import CropWandPath
+from spellcaster.spell_handler import SpellHandler
+from spellcaster.utils.wand_path_rasterizer import rasterize_wand_path
+
+
+def full_frame_rasterize(wand_path):
+    """
+    The original rasterization: draw on a full frame, resize, crop and resize
+    again to the model input size.
+    """
+    wand_path_img = SpellHandler.draw_wand_path(wand_path)
+    cropped_wand_path_img = CropWandPath()(wand_path_img)
+    wand_path_img_tensor = torch.tensor(cropped_wand_path_img)[None, None, ...].float()
+    return torch.nn.functional.interpolate(
+        wand_path_img_tensor, size=(MODEL_INPUT_SIZE, MODEL_INPUT_SIZE)
+    )[0, 0].numpy()
+
+
+def random_wand_paths(num_paths, path_len, seed=0):
+    rng = np.random.default_rng(seed)
+    height, width = FRAME_SHAPE[:2]
+    paths = []
+    for _ in range(num_paths):
+        steps = rng.normal(0, 15, size=(path_len, 2))
+        start = rng.uniform((width * 0.25, height * 0.25), (width * 0.75, height * 0.75))
+        path = np.clip(start + np.cumsum(steps, axis=0), 0, (width - 1, height - 1))
+        paths.append([tuple(p) for p in path.astype(int).tolist()])
+    return paths
+
+
+def benchmark_rasterizer(num_paths: int = 200, path_len: int = 60):
+    """
+    Compares the latency of the original full frame rasterization with
+    rasterize_wand_path, and checks that they draw the same images.
+    """
+    paths = random_wand_paths(num_paths, path_len)
+
+    results = {}
+    for name, rasterize in [
+        ("full_frame", full_frame_rasterize),
+        ("direct", rasterize_wand_path),
+    ]:
+        images = []
+        latencies = []
+        for path in paths:
+            start = time.perf_counter()
+            images.append(rasterize(path))
+            latencies.append(time.perf_counter() - start)
+        results[name] = (images, np.array(latencies) * 1000)
+
+    ious = []
+    identical = 0
+    for old, new in zip(results["full_frame"][0], results["direct"][0]):
+        union = ((old > 0) | (new > 0)).sum()
+        ious.append(((old > 0) & (new > 0)).sum() / union if union > 0 else 1.0)
+        identical += np.array_equal(old, new)
+
+    print(f"{num_paths} paths of {path_len} points")
+    for name, (_, latencies) in results.items():
+        print(
+            f"{name:>10}: "
+            f"mean {latencies.mean():.3f} ms, "
+            f"p50 {np.percentile(latencies, 50):.3f} ms, "
+            f"p99 {np.percentile(latencies, 99):.3f} ms"
+        )
+    print(f"mean IoU of drawn pixels: {np.mean(ious):.3f}, identical images: {identical}/{num_paths}")
@@ -0,0 +1,142 @@
+import multiprocessing
+import os
+import shutil
+import tempfile
+import time
+
+import numpy as np
+
+from spellcaster.benchmarks.rasterizer import random_wand_paths
+from spellcaster.constants import FRAME_RATE, MODEL_PATH
+from spellcaster.inference_worker import InferenceClient, InferenceError, InferenceWorker
+from spellcaster.modeling.runtime import resolve_model_path
+from spellcaster.utils.metrics import (
+    COUNT,
+    STAGE_INDICES,
+    SUM,
+    Stage,
+    StageHistograms,
+    get_metrics_name,
+    share_stage_metrics
+)
+from spellcaster.utils.wand_path_rasterizer import rasterize_wand_path
+
+context = multiprocessing.get_context("forkserver")
+METRICS_NAME = get_metrics_name("benchmark_reload")
+
+
+def serve(worker: InferenceWorker):
+    share_stage_metrics(METRICS_NAME)
+    worker.serve()
+
+
+def run_tracker(client: InferenceClient, images: np.ndarray, frame_rate: float, duration: float, results):
+    """
+    Classifies a wand path every frame, like a tracker recognizing spells
+    early, and reports when each frame started, how long it took and whether
+    it was classified.
+    """
+    frame_interval = 1 / frame_rate
+    frames = []
+    next_frame = time.monotonic()
+    end = next_frame + duration
+    while next_frame < end:
+        start = time.monotonic()
+        try:
+            client.predict(images[len(frames) % len(images)][None])
+            classified = True
+        except (TimeoutError, ConnectionError, InferenceError):
+            classified = False
+        frames.append((start, time.monotonic() - start, classified))
+        next_frame += frame_interval
+        time.sleep(max(0.0, next_frame - time.monotonic()))
+    results.put(frames)
+
+
+def get_reloads(histograms: StageHistograms) -> tuple[int, float]:
+    stage = histograms.snapshot()[0][STAGE_INDICES[Stage.MODEL_RELOAD]]
+    return int(stage[COUNT]), stage[SUM]
+
+
+def print_frames(name: str, frames: list[tuple[float, float, bool]], frame_interval: float):
+    if len(frames) == 0:
+        print(f"{name:>8}: no frames")
+        return
+    latencies = np.array([latency for _, latency, _ in frames]) * 1000
+    late = sum(latency > frame_interval for _, latency, _ in frames)
+    failed = sum(not classified for _, _, classified in frames)
+    print(
+        f"{name:>8}: {len(frames)} frames, "
+        f"p50 {np.percentile(latencies, 50):.3f} ms, "
+        f"p99 {np.percentile(latencies, 99):.3f} ms, "
+        f"max {latencies.max():.3f} ms, "
+        f"{late} over the frame interval, {failed} unclassified"
+    )
+
+
+def benchmark_reload(
+    model_path: str = MODEL_PATH,
+    num_reloads: int = 3,
+    reload_interval: float = 5.0,
+    frame_rate: float = FRAME_RATE
+):
+    """
+    Has a tracker classify a wand path every frame through the inference
+    worker while new versions of the model are written, and compares the
+    frames classified while the worker loaded a version with the rest.
+    """
+    images = np.stack([rasterize_wand_path(path) for path in random_wand_paths(100, 60)])[:, None]
+    model_path = resolve_model_path(model_path)
+    with tempfile.TemporaryDirectory() as model_dir:
+        watched_path = os.path.join(model_dir, os.path.basename(model_path))
+        shutil.copy(model_path, watched_path)
+
+        request_queue = context.Queue()
+        response_queue = context.Queue()
+        heartbeat = context.Value("d", 0.0, lock=False)
+        worker = InferenceWorker(request_queue, {0: response_queue}, watched_path, heartbeat=heartbeat)
+        worker_process = context.Process(target=serve, args=(worker,))
+        worker_process.start()
+        while heartbeat.value == 0.0:
+            time.sleep(0.1)
+        histograms = StageHistograms.attach(METRICS_NAME)
+
+        results = context.Queue()
+        client = InferenceClient(request_queue, response_queue, 0, heartbeat)
+        duration = (num_reloads + 1) * reload_interval
+        tracker_process = context.Process(
+            target=run_tracker, args=(client, images, frame_rate, duration, results)
+        )
+        tracker_process.start()
+
+        reload_windows = []
+        for _ in range(num_reloads):
+            time.sleep(reload_interval)
+            reloads, reload_seconds = get_reloads(histograms)
+            # written aside and moved into place, like train_model does
+            shutil.copy(model_path, watched_path + ".tmp")
+            os.replace(watched_path + ".tmp", watched_path)
+            while get_reloads(histograms)[0] == reloads:
+                time.sleep(0.01)
+            # the worker loads the version once it has stopped changing,
+            # the window covers the load itself
+            end = time.monotonic()
+            reload_windows.append((end - (get_reloads(histograms)[1] - reload_seconds), end))
+
+        frames = results.get()
+        tracker_process.join()
+        reloads, reload_seconds = get_reloads(histograms)
+        # the terminated worker leaves its metrics behind
+        histograms.shm.unlink()
+        histograms.close()
+        worker_process.terminate()
+        worker_process.join()
+
+    def is_reloading(frame: tuple[float, float, bool]) -> bool:
+        frame_start, latency, _ = frame
+        return any(frame_start <= end and start <= frame_start + latency for start, end in reload_windows)
+
+    frame_interval = 1 / frame_rate
+    print(f"{reloads} reloads, {reload_seconds / max(reloads, 1) * 1000:.1f} ms to load and warm up each")
+    print_frames("steady", [frame for frame in frames if not is_reloading(frame)], frame_interval)
+    print_frames("reload", [frame for frame in frames if is_reloading(frame)], frame_interval)
@@ -0,0 +1,81 @@
+import time
+from typing import Optional
+
+import torch
+from torch import nn
+
+from spellcaster.constants import MODEL_INPUT_SIZE
+from spellcaster.modeling.device import configure_threads, get_device, prepare_model
+from spellcaster.modeling.net import FewShotClassifier
+from spellcaster.modeling.train import get_grad_scaler, train_step
+
+
+def random_episodes(num_episodes, nway=5, nshot=5, nquery=10, seed=0):
+    """
+    Episodes shaped like the Omniglot ones, so training speed can be measured
+    without downloading or decoding the dataset.
+    """
+    generator = torch.Generator().manual_seed(seed)
+    labels = torch.arange(nway)
+    episodes = []
+    for _ in range(num_episodes):
+        episodes.append((
+            torch.rand(nway * nshot, 1, MODEL_INPUT_SIZE, MODEL_INPUT_SIZE, generator=generator),
+            labels.repeat_interleave(nshot),
+            torch.rand(nway * nquery, 1, MODEL_INPUT_SIZE, MODEL_INPUT_SIZE, generator=generator),
+            labels.repeat_interleave(nquery),
+        ))
+    return episodes
+
+
+def time_training(episodes, device, num_warmup, channels_last=False, compile=False, mixed_precision=False):
+    model = prepare_model(FewShotClassifier(), device, channels_last, compile).train()
+    optimizer = torch.optim.Adam(model.parameters(), lr=0.001)
+    criterion = nn.CrossEntropyLoss()
+    scaler = get_grad_scaler(device, mixed_precision)
+
+    def run(episodes):
+        for episode in episodes:
+            train_step(
+                model, optimizer, criterion, scaler, *episode, device, channels_last, mixed_precision
+            )
+        if device.type == "cuda":
+            torch.cuda.synchronize()
+
+    # the first episodes include compilation and allocator warm up
+    run(episodes[:num_warmup])
+    start = time.perf_counter()
+    run(episodes[num_warmup:])
+    return (len(episodes) - num_warmup) / (time.perf_counter() - start)
+
+
+def benchmark_training(
+    num_episodes: int = 100,
+    device: Optional[str] = None,
+    num_threads: Optional[int] = None,
+    num_warmup: int = 10
+):
+    """
+    Reports training throughput in episodes per second with each of the
+    optimizations the training loop supports.
+    """
+    device = get_device(device)
+    threads = configure_threads(device, num_threads)
+    episodes = random_episodes(num_episodes + num_warmup)
+    print(f"{num_episodes} episodes on {device} with {threads} threads")
+
+    configs = {
+        "eager": {},
+        "channels_last": {"channels_last": True},
+        "mixed_precision": {"mixed_precision": True},
+        "compile": {"compile": True},
+    }
+    for name, config in configs.items():
+        try:
+            episodes_per_second = time_training(episodes, device, num_warmup, **config)
+        except Exception as e:
+            # compile needs a working compiler toolchain and mixed precision
+            # support differs between devices
+            print(f"{name:>16}: unavailable ({type(e).__name__}: {e})")
+            continue
+        print(f"{name:>16}: {episodes_per_second:.1f} episodes/s")
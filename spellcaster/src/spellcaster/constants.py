@@ -2,6 +2,30 @@ import os
 
 FRAME_SHAPE=(480, 640, 3)
 FRAME_RATE=30
+# (width, height) each stream tier is resized to before encoding, None keeps
+# the frame's own resolution
+STREAM_TIERS={
+    "full": None,
+    "medium": (480, 360),
+    "low": (320, 240),
+}
 DATA_DIR=os.path.expanduser("~/.local/share/spellcaster/data")
 MODEL_PATH="model.pth"
-MODEL_INPUT_SIZE=28
\ No newline at end of file
+MODEL_INPUT_SIZE=28
+ACTION_TIMEOUT=5
+ACTION_RETRIES=1
+# predictions below this confidence are rejected as an unknown spell
+SPELL_CONFIDENCE_THRESHOLD=0.6
+# spells recognized before the wand stops are only cast at this confidence,
+# an unfinished stroke looks like more spells than a finished one
+EARLY_SPELL_CONFIDENCE_THRESHOLD=0.9
+UNKNOWN_SPELL="unknown"
+# comma separated indices of the cameras the server captures from, one
+# capture process each
+CAMERAS=os.environ.get("SPELLCASTER_CAMERAS", "0")
+# where a standalone inference worker serves predictions, and the key its
+# clients authenticate with. Requests are pickled, so anyone with the key can
+# run code in the worker. Without a key the worker only serves on loopback
+# addresses, with a random key it prints.
+INFERENCE_ADDRESS=os.environ.get("SPELLCASTER_INFERENCE_ADDRESS", "localhost:6010")
+INFERENCE_AUTHKEY=os.environ.get("SPELLCASTER_INFERENCE_KEY")
@@ -1,13 +1,13 @@
 import sqlite3
 import os
 import json
+import threading
 from dataclasses import dataclass
 from typing import Optional
 
 from .constants import DATA_DIR
 
 DB_PATH = os.path.join(DATA_DIR, 'spellcaster.db')
-os.makedirs(DATA_DIR, exist_ok=True)
 
 
 @dataclass
@@ -25,12 +25,52 @@ class Action:
     payload: Optional[str]
 
 
-def get_connection():
-    return sqlite3.connect(DB_PATH)
+_local = threading.local()
 
 
-def create_tables():
-    with get_connection() as conn:
+def get_connection() -> sqlite3.Connection:
+    """
+    Returns this thread's connection to the database, opening it on first use.
+    Connections stay open so SQLite's statement cache is reused across calls,
+    and use WAL journaling so readers and a writer in different processes
+    don't block each other.
+    """
+    conn = getattr(_local, "conn", None)
+    # connections can't be shared with forked processes
+    if conn is None or _local.pid != os.getpid():
+        os.makedirs(DATA_DIR, exist_ok=True)
+        conn = sqlite3.connect(DB_PATH, timeout=10, cached_statements=256)
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        _local.conn = conn
+        _local.pid = os.getpid()
+        create_tables(conn)
+    return conn
+
+
+def close_connection():
+    conn = getattr(_local, "conn", None)
+    if conn is not None and _local.pid == os.getpid():
+        conn.close()
+    _local.conn = None
+
+
+# bumped on every write made from this process, so caches in this process see
+# their own writes immediately
+_local_version = 0
+
+
+def _mark_changed():
+    global _local_version
+    _local_version += 1
+
+
+def _payload_json(action: Action) -> Optional[str]:
+    return json.dumps(action.payload) if action.payload is not None else None
+
+
+def create_tables(conn: sqlite3.Connection):
+    with conn:
         cursor = conn.cursor()
         cursor.execute('''
             CREATE TABLE IF NOT EXISTS spells (
@@ -49,8 +89,6 @@ def create_tables():
         ''')
         conn.commit()
 
-create_tables()
-
 
 def get_all_spells() -> list[Spell]:
     with get_connection() as conn:
@@ -61,10 +99,18 @@ def get_all_spells() -> list[Spell]:
 
 
 def add_spell(spell: Spell):
+    add_spells([spell])
+
+
+def add_spells(spells: list[Spell]):
     with get_connection() as conn:
         cursor = conn.cursor()
-        cursor.execute('INSERT INTO spells (name, action_id) VALUES (?, ?)', (spell.name, spell.action_id))
+        cursor.executemany(
+            'INSERT INTO spells (name, action_id) VALUES (?, ?)',
+            [(spell.name, spell.action_id) for spell in spells]
+        )
         conn.commit()
+    _mark_changed()
 
 
 def get_spell(spell_name: str) -> Optional[Spell]:
@@ -88,10 +134,18 @@ def get_spell_by_id(spell_id: int) -> Optional[Spell]:
     
 
 def update_spell(spell: Spell):
+    update_spells([spell])
+
+
+def update_spells(spells: list[Spell]):
     with get_connection() as conn:
         cursor = conn.cursor()
-        cursor.execute('UPDATE spells SET name = ?, action_id = ? WHERE id = ?', (spell.name, spell.action_id, spell.id))
+        cursor.executemany(
+            'UPDATE spells SET name = ?, action_id = ? WHERE id = ?',
+            [(spell.name, spell.action_id, spell.id) for spell in spells]
+        )
         conn.commit()
+    _mark_changed()
 
 
 def delete_spell(spell: Spell):
@@ -99,14 +153,22 @@ def delete_spell(spell: Spell):
         cursor = conn.cursor()
         cursor.execute('DELETE FROM spells WHERE id = ?', (spell.id,))
         conn.commit()
+    _mark_changed()
 
 
 def add_action(action: Action):
+    add_actions([action])
+
+
+def add_actions(actions: list[Action]):
     with get_connection() as conn:
         cursor = conn.cursor()
-        payload_json = json.dumps(action.payload) if action.payload is not None else None
-        cursor.execute('INSERT INTO actions (name, function, payload) VALUES (?, ?, json(?))', (action.name, action.function, payload_json))
+        cursor.executemany(
+            'INSERT INTO actions (name, function, payload) VALUES (?, ?, json(?))',
+            [(action.name, action.function, _payload_json(action)) for action in actions]
+        )
         conn.commit()
+    _mark_changed()
 
 
 def get_all_actions() -> list[Action]:
@@ -128,11 +190,18 @@ def get_action(action_id: int) -> Optional[Action]:
 
 
 def update_action(action: Action):
+    update_actions([action])
+
+
+def update_actions(actions: list[Action]):
     with get_connection() as conn:
         cursor = conn.cursor()
-        payload_json = json.dumps(action.payload) if action.payload is not None else None
-        cursor.execute('UPDATE actions SET name = ?, function = ?, payload = json(?) WHERE id = ?', (action.name, action.function, payload_json, action.id))
+        cursor.executemany(
+            'UPDATE actions SET name = ?, function = ?, payload = json(?) WHERE id = ?',
+            [(action.name, action.function, _payload_json(action), action.id) for action in actions]
+        )
         conn.commit()
+    _mark_changed()
 
 
 def delete_action(action: Action):
@@ -145,6 +214,66 @@ def delete_action(action: Action):
             raise ValueError(f"Cannot delete action {action.id} because it is referenced by {count} spell(s).")
         cursor.execute('DELETE FROM actions WHERE id = ?', (action.id,))
         conn.commit()
+    _mark_changed()
+
+
+class SpellActionCache:
+    """
+    In-memory mapping of spell names to the actions they trigger, so looking up
+    the action for a detected spell doesn't touch the database. A background
+    thread watches PRAGMA data_version on its own connection and reloads the
+    mapping whenever another connection commits to the database.
+    """
+    def __init__(self, poll_interval: float = 1.0):
+        self.poll_interval = poll_interval
+        self.spell_actions: dict[str, Optional[Action]] = {}
+        self.lock = threading.Lock()
+        self.loaded_version = -1
+        self.stop_event = threading.Event()
+        self.reload()
+        self.poll_thread = threading.Thread(target=self.poll, daemon=True)
+        self.poll_thread.start()
+
+    def reload(self):
+        local_version = _local_version
+        with get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                SELECT spells.name, actions.id, actions.name, actions.function,
+                    json_extract(actions.payload, "$")
+                FROM spells LEFT JOIN actions ON spells.action_id = actions.id
+            ''')
+            spell_actions = {
+                row[0]: Action(id=row[1], name=row[2], function=row[3], payload=row[4])
+                if row[1] is not None else None
+                for row in cursor.fetchall()
+            }
+        with self.lock:
+            self.spell_actions = spell_actions
+            self.loaded_version = local_version
+
+    def poll(self):
+        # the poller has its own connection, so data_version changes on any
+        # commit made elsewhere
+        conn = get_connection()
+        try:
+            data_version = conn.execute('PRAGMA data_version').fetchone()[0]
+            while not self.stop_event.wait(self.poll_interval):
+                new_data_version = conn.execute('PRAGMA data_version').fetchone()[0]
+                if new_data_version != data_version:
+                    data_version = new_data_version
+                    self.reload()
+        finally:
+            close_connection()
+
+    def get_action(self, spell_name: str) -> Optional[Action]:
+        if self.loaded_version != _local_version:
+            self.reload()
+        with self.lock:
+            return self.spell_actions.get(spell_name)
+
+    def stop(self):
+        self.stop_event.set()
 
 
 def manage_db(action: str, table: str, entry: Optional[dict] = None, entry_id: Optional[int] = None):
@@ -0,0 +1,77 @@
+import queue
+import time
+from abc import ABC, abstractmethod
+from enum import StrEnum
+from typing import Optional
+
+
+class EventType(StrEnum):
+    WAND_POINT = "wand_point"
+    PATH_RESET = "path_reset"
+    SPELL = "spell"
+    ACTION = "action"
+
+
+class EventPublisher(ABC):
+    """
+    Publishes small structured events about what the tracker is doing, as
+    plain dicts with a type and a timestamp.
+    """
+    @abstractmethod
+    def publish(self, event: dict):
+        pass
+
+    def wand_point(self, x: int, y: int):
+        self.publish({"type": EventType.WAND_POINT, "t": time.time(), "x": int(x), "y": int(y)})
+
+    def path_reset(self):
+        self.publish({"type": EventType.PATH_RESET, "t": time.time()})
+
+    def spell(self, spell_name: str, confidence: float):
+        self.publish({
+            "type": EventType.SPELL,
+            "t": time.time(),
+            "spell": spell_name,
+            "confidence": float(confidence)
+        })
+
+    def action(self, action: str, success: bool, latency: float, error: Optional[str] = None):
+        self.publish({
+            "type": EventType.ACTION,
+            "t": time.time(),
+            "action": action,
+            "success": success,
+            "latency": latency,
+            "error": error
+        })
+
+
+class NullEventPublisher(EventPublisher):
+    def publish(self, event: dict):
+        pass
+
+
+class QueueEventPublisher(EventPublisher):
+    """
+    Publishes events to a multiprocessing queue. Events are dropped rather
+    than blocking when nobody is draining the queue. Capture processes of
+    several cameras share the queue, so events are tagged with the camera.
+    """
+    def __init__(self, event_queue, camera: Optional[int] = None):
+        self.event_queue = event_queue
+        self.camera = camera
+        self.dropped_events = 0
+
+    def publish(self, event: dict):
+        if self.camera is not None:
+            event["camera"] = self.camera
+        try:
+            self.event_queue.put_nowait(event)
+        except queue.Full:
+            self.dropped_events += 1
+
+
+def get_event_publisher(event_queue=None, camera: Optional[int] = None) -> EventPublisher:
+    if event_queue is None:
+        return NullEventPublisher()
+    return QueueEventPublisher(event_queue, camera)
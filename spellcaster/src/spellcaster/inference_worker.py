@@ -0,0 +1,337 @@
+import ipaddress
+import os
+import queue
+import secrets
+import socket
+import threading
+import time
+from itertools import count
+from multiprocessing.connection import Client, Connection, Listener
+from typing import Optional
+
+import numpy as np
+
+from .constants import INFERENCE_ADDRESS, INFERENCE_AUTHKEY, MODEL_PATH
+from .utils.metrics import Stage, get_metrics_name, record_stage, share_stage_metrics
+
+# Requests are (client, request_id, images) tuples, where images are
+# rasterized wand paths of shape (N, 1, MODEL_INPUT_SIZE, MODEL_INPUT_SIZE)
+# and dtype uint8. Responses are (request_id, predictions) tuples, with a
+# (spell, confidence) prediction per image. Request ids are (pid, n) pairs, so
+# a restarted capture process never takes an answer meant for its previous
+# incarnation. Requests the worker fails to classify are answered with an
+# InferenceError in place of the predictions.
+# the worker stamps the heartbeat this often once it serves, clients give up
+# on a worker whose heartbeat is older than HEARTBEAT_TIMEOUT
+HEARTBEAT_INTERVAL = 0.25
+HEARTBEAT_TIMEOUT = 1.0
+
+
+class InferenceError(RuntimeError):
+    pass
+
+
+def parse_address(address: str) -> tuple[str, int]:
+    host, port = address.rsplit(":", 1)
+    return host, int(port)
+
+
+def is_loopback(host: str) -> bool:
+    try:
+        return ipaddress.ip_address(socket.gethostbyname(host)).is_loopback
+    except (OSError, ValueError):
+        return False
+
+
+class InferenceClient:
+    """
+    Stands in for the spell classifier of a capture process, sending wand
+    path images to the inference worker shared by every camera and waiting
+    for its predictions. While the worker is down or still loading the model,
+    predictions fail straight away rather than holding up the frame.
+    """
+    def __init__(
+        self,
+        request_queue,
+        response_queue,
+        client_id: int,
+        heartbeat=None,
+        timeout: float = 1.0
+    ):
+        self.request_queue = request_queue
+        self.response_queue = response_queue
+        self.client_id = client_id
+        self.heartbeat = heartbeat
+        self.timeout = timeout
+        # the client is created by the manager and copied into every capture
+        # process it starts, see start()
+        self.pid = None
+
+    def start(self):
+        self.pid = os.getpid()
+        self.request_ids = count()
+        # answers to requests of a capture process that died
+        try:
+            while True:
+                self.response_queue.get_nowait()
+        except queue.Empty:
+            pass
+
+    def is_worker_alive(self) -> bool:
+        return self.heartbeat is None or time.time() - self.heartbeat.value < HEARTBEAT_TIMEOUT
+
+    def send(self, request_id: tuple[int, int], images: np.ndarray):
+        self.request_queue.put((self.client_id, request_id, images))
+
+    def receive(self, timeout: float) -> tuple[tuple[int, int], list[tuple[str, float]]]:
+        try:
+            return self.response_queue.get(timeout=timeout)
+        except queue.Empty:
+            raise TimeoutError(f"no prediction from the inference worker in {self.timeout}s")
+
+    def predict(self, images: np.ndarray) -> list[tuple[str, float]]:
+        if self.pid != os.getpid():
+            self.start()
+        if not self.is_worker_alive():
+            raise ConnectionError("the inference worker isn't running")
+        request_id = (self.pid, next(self.request_ids))
+        self.send(request_id, images)
+        deadline = time.monotonic() + self.timeout
+        while True:
+            response_id, predictions = self.receive(max(0.0, deadline - time.monotonic()))
+            # answers to requests that timed out earlier are stale
+            if response_id != request_id:
+                continue
+            if isinstance(predictions, InferenceError):
+                raise predictions
+            return predictions
+
+    def refresh(self, force: bool = False):
+        # the worker refreshes the classifier it serves
+        pass
+
+
+class SocketInferenceClient(InferenceClient):
+    """
+    Client of an inference worker serving over a socket, for trackers that
+    weren't started by the manager.
+    """
+    def __init__(
+        self,
+        address: str = INFERENCE_ADDRESS,
+        authkey: Optional[str] = INFERENCE_AUTHKEY,
+        timeout: float = 1.0
+    ):
+        if authkey is None:
+            raise ValueError(
+                "Set SPELLCASTER_INFERENCE_KEY to the key the inference worker was started with"
+            )
+        self.connection = Client(parse_address(address), authkey=authkey.encode())
+        self.heartbeat = None
+        self.timeout = timeout
+        self.pid = os.getpid()
+        self.request_ids = count()
+
+    def send(self, request_id: tuple[int, int], images: np.ndarray):
+        self.connection.send((request_id, images))
+
+    def receive(self, timeout: float) -> tuple[tuple[int, int], list[tuple[str, float]]]:
+        if not self.connection.poll(timeout):
+            raise TimeoutError(f"no prediction from the inference worker in {self.timeout}s")
+        return self.connection.recv()
+
+
+class InferenceWorker:
+    """
+    Serves predictions to the capture processes of every camera from a
+    single copy of the model. Once a request arrives, the worker waits up to
+    batch_window seconds for more, and classifies them all in one forward
+    pass, so a batch costs about as much as a single path.
+    """
+    def __init__(
+        self,
+        request_queue,
+        response_queues: dict,
+        model_path: str = MODEL_PATH,
+        batch_window: float = 0.002,
+        max_batch_size: int = 32,
+        heartbeat=None
+    ):
+        self.request_queue = request_queue
+        self.response_queues = response_queues
+        self.model_path = model_path
+        self.heartbeat = heartbeat
+        self.batch_window = batch_window
+        self.max_batch_size = max_batch_size
+        self.batches = 0
+        self.requests = 0
+
+    def next_batch(self) -> list[tuple]:
+        batch = [self.request_queue.get()]
+        deadline = time.monotonic() + self.batch_window
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            try:
+                if remaining > 0:
+                    batch.append(self.request_queue.get(timeout=remaining))
+                else:
+                    # whatever is already queued still joins the batch
+                    batch.append(self.request_queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def beat(self):
+        while True:
+            self.heartbeat.value = time.time()
+            time.sleep(HEARTBEAT_INTERVAL)
+
+    def classify(self, classifier, batch: list[tuple]) -> list:
+        """
+        Predictions for every request of batch, from a single forward pass.
+        If that fails, the requests are classified one by one, so only the
+        ones that can't be classified are answered with an InferenceError.
+        """
+        try:
+            predictions = classifier.predict(np.concatenate([images for _, _, images in batch]))
+        except Exception as e:
+            if len(batch) > 1:
+                return [result for request in batch for result in self.classify(classifier, [request])]
+            print(f"inference failed: {e!r}")
+            return [InferenceError(f"the inference worker failed to classify the request: {e!r}")]
+
+        results = []
+        offset = 0
+        for _, _, images in batch:
+            results.append(predictions[offset:offset + len(images)])
+            offset += len(images)
+        return results
+
+    def respond(self, client, request_id: tuple[int, int], predictions):
+        response_queue = self.response_queues.get(client)
+        if response_queue is None:
+            print(f"inference request from unknown client {client!r}")
+            return
+        response_queue.put((request_id, predictions))
+
+    def serve(self):
+        from .modeling.watcher import ModelWatcher
+
+        # the only place models are reloaded, capture processes keep
+        # tracking while the worker loads a new version
+        model_watcher = ModelWatcher(self.model_path)
+        model_watcher.latest().refresh()
+        if self.heartbeat is not None:
+            threading.Thread(target=self.beat, daemon=True).start()
+        try:
+            while True:
+                batch = self.next_batch()
+                # new versions of the model are swapped in between batches,
+                # each classified by a single model
+                classifier = model_watcher.latest()
+                start = time.perf_counter()
+                results = self.classify(classifier, batch)
+                record_stage(Stage.INFERENCE_BATCH, time.perf_counter() - start)
+                self.batches += 1
+                self.requests += len(batch)
+
+                for (client, request_id, _), result in zip(batch, results):
+                    self.respond(client, request_id, result)
+        finally:
+            model_watcher.stop()
+
+
+class SocketInferenceWorker(InferenceWorker):
+    """
+    Inference worker serving SocketInferenceClients. A thread per connection
+    feeds its requests into the batches, and responses are sent back on the
+    connection the request came from.
+    """
+    def __init__(self, address: str, authkey: str, **kwargs):
+        super().__init__(queue.Queue(), {}, **kwargs)
+        self.listener = Listener(parse_address(address), authkey=authkey.encode())
+        self.send_locks: dict[Connection, threading.Lock] = {}
+        threading.Thread(target=self.accept, daemon=True).start()
+
+    def accept(self):
+        while True:
+            try:
+                connection = self.listener.accept()
+            except Exception as e:
+                # a client with the wrong key, or that hung up mid handshake
+                print(f"inference client rejected: {e}")
+                continue
+            self.send_locks[connection] = threading.Lock()
+            threading.Thread(target=self.receive, args=(connection,), daemon=True).start()
+
+    def receive(self, connection: Connection):
+        try:
+            while True:
+                request_id, images = connection.recv()
+                self.request_queue.put((connection, request_id, images))
+        except (EOFError, OSError):
+            pass
+        finally:
+            self.send_locks.pop(connection, None)
+            connection.close()
+
+    def respond(self, connection: Connection, request_id: tuple[int, int], predictions):
+        send_lock = self.send_locks.get(connection)
+        if send_lock is None:
+            # the client hung up while its request was being classified
+            return
+        try:
+            with send_lock:
+                connection.send((request_id, predictions))
+        except (EOFError, OSError):
+            pass
+
+
+def serve_inference(
+    request_queue,
+    response_queues: dict,
+    model_path: str = MODEL_PATH,
+    batch_window: float = 0.002,
+    heartbeat=None
+):
+    import torch
+    from .modeling.device import get_num_cores
+
+    # the worker may have been pinned to a share of the cores
+    torch.set_num_threads(get_num_cores())
+    share_stage_metrics(get_metrics_name("inference"))
+    InferenceWorker(
+        request_queue, response_queues, model_path, batch_window, heartbeat=heartbeat
+    ).serve()
+
+
+def serve_inference_socket(
+    address: str = INFERENCE_ADDRESS,
+    model_path: str = MODEL_PATH,
+    batch_window: float = 0.002,
+    max_batch_size: int = 32,
+    num_threads: Optional[int] = None,
+    authkey: Optional[str] = INFERENCE_AUTHKEY
+):
+    """
+    Serves predictions to SocketInferenceClients. Clients can run code in the
+    worker, so it only serves beyond the loopback interface with a key chosen
+    by the user, and otherwise makes up a key for local clients.
+    """
+    import torch
+
+    if authkey is None:
+        if not is_loopback(parse_address(address)[0]):
+            raise ValueError(
+                f"Set SPELLCASTER_INFERENCE_KEY to serve inference on {address}, "
+                "beyond the loopback interface"
+            )
+        authkey = secrets.token_urlsafe(16)
+        print(f"clients authenticate with SPELLCASTER_INFERENCE_KEY={authkey}")
+    if num_threads is not None:
+        torch.set_num_threads(num_threads)
+    worker = SocketInferenceWorker(
+        address, authkey, model_path=model_path, batch_window=batch_window, max_batch_size=max_batch_size
+    )
+    print(f"serving spell predictions from {model_path} on {address}")
+    worker.serve()
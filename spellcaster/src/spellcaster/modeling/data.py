@@ -4,10 +4,11 @@ import numpy as np
 from easyfsl.samplers import TaskSampler
 import torch
 from torch.utils.data import DataLoader
-from torchvision.datasets import ImageFolder, Omniglot
+from torchvision.datasets import Omniglot
 from torchvision import transforms
 
 from spellcaster.constants import MODEL_INPUT_SIZE, DATA_DIR
+from .preprocess import preprocess_spell_images
 
 
 def omniglot_dataloaders(
@@ -16,7 +17,8 @@ def omniglot_dataloaders(
     nquery=10,
     ntraining_tasks=40_000,
     nevaluation_tasks=100,
-    num_workers=12,
+    num_workers=0,
+    pin_memory=False,
 ):
     pretrain_data_dir = os.path.join(DATA_DIR, "pretrain")
 
@@ -65,14 +67,14 @@ def omniglot_dataloaders(
         train_set,
         batch_sampler=train_sampler,
         num_workers=num_workers,
-        pin_memory=True,
+        pin_memory=pin_memory,
         collate_fn=train_sampler.episodic_collate_fn,
     )
     test_loader = DataLoader(
         test_set,
         batch_sampler=test_sampler,
         num_workers=num_workers,
-        pin_memory=True,
+        pin_memory=pin_memory,
         collate_fn=test_sampler.episodic_collate_fn,
     )
 
@@ -114,9 +116,8 @@ class IncreaseContrast():
         return img
     
 
-def spell_dataloader():
-    image_dir = os.path.join(DATA_DIR, "images")
-    dataset = ImageFolder(image_dir, transform=transforms.Compose(
+def spell_transform():
+    return transforms.Compose(
         [
         transforms.Grayscale(),
         CropWandPath(),
@@ -130,9 +131,13 @@ def spell_dataloader():
         ),
         IncreaseContrast(),
         ]
-    ))
+    )
+
 
-    dataset.get_labels = lambda: dataset.targets
+def spell_dataloader(pin_memory=False):
+    # the images are transformed once and cached, so batches are read straight
+    # from memory without worker processes
+    dataset = preprocess_spell_images(spell_transform(), "few_shot")
     sampler = TaskSampler(
         dataset, n_way=len(dataset.classes), n_shot=5, n_query=5, n_tasks=100
     )
@@ -140,7 +145,6 @@ def spell_dataloader():
     return DataLoader(
         dataset,
         batch_sampler=sampler,
-        num_workers=12,
-        pin_memory=True,
+        pin_memory=pin_memory,
         collate_fn=sampler.episodic_collate_fn,
     )
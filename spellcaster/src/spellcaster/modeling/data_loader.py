@@ -1,11 +1,9 @@
-import os
 import numpy as np
 
 from torch.utils.data import DataLoader, random_split
-from torchvision.datasets import ImageFolder
 from torchvision import transforms
 
-from spellcaster.constants import DATA_DIR
+from .preprocess import preprocess_spell_images
 
 
 class CropWandPath():
@@ -33,9 +31,8 @@ class CropWandPath():
         return img[new_xl:new_xr, new_yl:new_yr]
 
 
-def build_dataloaders(batch_size=16):
-    image_dir = os.path.join(DATA_DIR, "images")
-    dataset = ImageFolder(image_dir, transform=transforms.Compose(
+def classifier_transform():
+    return transforms.Compose(
         [
         transforms.Grayscale(),
         CropWandPath(),
@@ -43,7 +40,11 @@ def build_dataloaders(batch_size=16):
         transforms.Resize((28, 28)),
         transforms.ToTensor(),
         ]
-    ))
+    )
+
+
+def build_dataloaders(batch_size=16):
+    dataset = preprocess_spell_images(classifier_transform(), "classifier")
 
     train_size = int(0.8 * len(dataset))
     test_size = len(dataset) - train_size
@@ -0,0 +1,95 @@
+import os
+from contextlib import nullcontext
+from typing import Optional
+
+import torch
+
+
+def get_num_cores() -> int:
+    # cores this process may run on, which is less than cpu_count() in
+    # containers and under taskset
+    if hasattr(os, "sched_getaffinity"):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count() or 1
+
+
+def get_device(device: Optional[str] = None) -> torch.device:
+    """
+    Returns the given device, or the first available accelerator, falling
+    back to the CPU.
+    """
+    if device is not None:
+        return torch.device(device)
+    if torch.cuda.is_available():
+        return torch.device("cuda")
+    if torch.backends.mps.is_available():
+        return torch.device("mps")
+    return torch.device("cpu")
+
+
+def configure_threads(device: torch.device, num_threads: Optional[int] = None) -> int:
+    """
+    Sets the number of intra-op threads torch computes with. On the CPU they
+    get every core not taken by data loader workers, while an accelerator
+    only needs a couple for the host side work.
+    """
+    if num_threads is None:
+        cores = get_num_cores()
+        if device.type == "cpu":
+            num_threads = max(1, cores - get_num_workers(device))
+        else:
+            num_threads = min(cores, 2)
+    torch.set_num_threads(num_threads)
+    return num_threads
+
+
+def get_num_workers(device: torch.device) -> int:
+    """
+    Data loader worker processes. On the CPU workers compete with the model
+    for cores, so only larger machines spare a few of them.
+    """
+    cores = get_num_cores()
+    if device.type == "cpu":
+        return min(4, cores // 4)
+    return min(8, max(0, cores - 1))
+
+
+def use_pin_memory(device: torch.device) -> bool:
+    return device.type == "cuda"
+
+
+def prepare_model(
+    model: torch.nn.Module,
+    device: torch.device,
+    channels_last: Optional[bool] = None,
+    compile: bool = False
+) -> torch.nn.Module:
+    """
+    Moves model to device. Channels last memory format is used by default on
+    CUDA, where convolutions run faster with it. Compiling pays off on long
+    training runs, but costs more than it saves on short ones.
+    """
+    if channels_last is None:
+        channels_last = device.type == "cuda"
+    model = model.to(device, memory_format=torch.channels_last if channels_last else torch.preserve_format)
+    if compile:
+        model = torch.compile(model)
+    return model
+
+
+def to_device(tensor: torch.Tensor, device: torch.device, channels_last: bool = False) -> torch.Tensor:
+    memory_format = torch.channels_last if channels_last and tensor.dim() == 4 else torch.preserve_format
+    return tensor.to(device, non_blocking=use_pin_memory(device), memory_format=memory_format)
+
+
+def autocast(device: torch.device, mixed_precision: Optional[bool] = None):
+    """
+    Mixed precision context, on by default on CUDA only. On the CPU bfloat16
+    helps only on processors with native bfloat16 support.
+    """
+    if mixed_precision is None:
+        mixed_precision = device.type == "cuda"
+    if not mixed_precision:
+        return nullcontext()
+    dtype = torch.float16 if device.type == "cuda" else torch.bfloat16
+    return torch.autocast(device.type, dtype=dtype)
@@ -0,0 +1,75 @@
+import json
+from pathlib import Path
+from typing import Optional
+
+import torch
+
+from spellcaster.constants import MODEL_PATH, MODEL_INPUT_SIZE
+from .runtime import (
+    CLASSES_METADATA_KEY,
+    MODEL_FORMAT_SUFFIXES,
+    ModelFormat,
+    build_state_dict_model,
+    is_few_shot_checkpoint
+)
+
+
+def to_torchscript(model: torch.nn.Module) -> torch.jit.ScriptModule:
+    example_input = torch.zeros(1, 1, MODEL_INPUT_SIZE, MODEL_INPUT_SIZE)
+    with torch.no_grad():
+        return torch.jit.freeze(torch.jit.trace(model, example_input))
+
+
+def save_torchscript(model: torch.nn.Module, classes: list[str], output_path: str):
+    torch.jit.save(
+        to_torchscript(model),
+        output_path,
+        _extra_files={CLASSES_METADATA_KEY: json.dumps(classes)}
+    )
+
+
+def export_model(
+    model_format: ModelFormat = ModelFormat.TORCHSCRIPT,
+    model_path: str = MODEL_PATH,
+    output_path: Optional[str] = None
+):
+    """
+    Exports a trained BasicConvNet classifier checkpoint as TorchScript or
+    ONNX, with the class names stored alongside the weights.
+    """
+    model_format = ModelFormat(model_format)
+    if output_path is None:
+        output_path = str(Path(model_path).with_suffix(MODEL_FORMAT_SUFFIXES[model_format]))
+
+    stored_model = torch.load(model_path, map_location="cpu")
+    if is_few_shot_checkpoint(stored_model):
+        # its spells come from the prototypes of the collected images, which
+        # an exported model would freeze
+        raise ValueError(
+            f"{model_path} is a few-shot checkpoint, only classifiers can be exported, "
+            "load_spell_classifier loads it as is"
+        )
+    model, classes = build_state_dict_model(stored_model)
+    example_input = torch.zeros(1, 1, MODEL_INPUT_SIZE, MODEL_INPUT_SIZE)
+
+    match model_format:
+        case ModelFormat.TORCHSCRIPT:
+            save_torchscript(model, classes, output_path)
+        case ModelFormat.ONNX:
+            import onnx
+
+            torch.onnx.export(
+                model,
+                example_input,
+                output_path,
+                input_names=["images"],
+                output_names=["scores"],
+                dynamic_axes={"images": {0: "batch"}, "scores": {0: "batch"}},
+            )
+            onnx_model = onnx.load(output_path)
+            onnx_model.metadata_props.add(key=CLASSES_METADATA_KEY, value=json.dumps(classes))
+            onnx.save(onnx_model, output_path)
+        case _:
+            raise ValueError(f"Can't export to {model_format}")
+
+    print(f"exported {model_path} to {output_path}")
@@ -3,11 +3,11 @@ from torch import nn
 
 
 class BasicConvNet(nn.Module):
-    def __init__(self, num_classes=3):
+    def __init__(self, num_classes=3, conv1_channels=20, conv2_channels=50):
         super().__init__()
-        self.conv1 = nn.Conv2d(1, 20, kernel_size=5)
-        self.conv2 = nn.Conv2d(20, 50, kernel_size=5)
-        self.fc = nn.Linear(50 * 4 * 4, 128)
+        self.conv1 = nn.Conv2d(1, conv1_channels, kernel_size=5)
+        self.conv2 = nn.Conv2d(conv1_channels, conv2_channels, kernel_size=5)
+        self.fc = nn.Linear(conv2_channels * 4 * 4, 128)
         self.classifier = nn.Linear(128, num_classes)
 
     def forward(self, x):
@@ -15,7 +15,7 @@ class BasicConvNet(nn.Module):
         x = nn.functional.max_pool2d(x, 2)
         x = nn.functional.relu(self.conv2(x))
         x = nn.functional.max_pool2d(x, 2)
-        x = x.view(x.size(0), -1)
+        x = torch.flatten(x, 1)
         x = nn.functional.relu(self.fc(x))
         x = self.classifier(x)
         return x
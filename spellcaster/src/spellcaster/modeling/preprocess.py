@@ -0,0 +1,130 @@
+import json
+import os
+from typing import Callable, Optional
+
+import numpy as np
+import torch
+from torch.utils.data import Dataset
+from torchvision.datasets.folder import IMG_EXTENSIONS, default_loader, find_classes, make_dataset
+
+from spellcaster.constants import DATA_DIR
+
+PREPROCESSED_DIR = os.path.join(DATA_DIR, "preprocessed")
+
+
+class PreprocessedSpellDataset(Dataset):
+    """
+    Spell images that already went through the transform pipeline, backed by
+    a memory mapped array. Batches are read with a single indexing operation,
+    so loading needs no decoding and no worker processes.
+    """
+    def __init__(self, images: np.ndarray, samples: list[dict], classes: list[str]):
+        self.images = images
+        # path relative to the image directory, mtime_ns, size and target of
+        # every image
+        self.samples = samples
+        self.targets = [sample["target"] for sample in samples]
+        self.classes = classes
+
+    def __len__(self):
+        return len(self.targets)
+
+    def __getitem__(self, idx):
+        return torch.from_numpy(np.array(self.images[idx])), self.targets[idx]
+
+    def __getitems__(self, indices: list[int]):
+        images = torch.from_numpy(self.images[indices])
+        return [(image, self.targets[idx]) for image, idx in zip(images, indices)]
+
+    def get_labels(self):
+        return self.targets
+
+
+def scan_image_dir(image_dir: str) -> tuple[list[str], list[dict]]:
+    """
+    Lists the classes and samples of image_dir the same way ImageFolder does,
+    with the modification time and size of every file.
+    """
+    classes, class_to_idx = find_classes(image_dir)
+    samples = []
+    for path, target in make_dataset(image_dir, class_to_idx, extensions=IMG_EXTENSIONS):
+        stat = os.stat(path)
+        samples.append({
+            "path": os.path.relpath(path, image_dir),
+            "mtime_ns": stat.st_mtime_ns,
+            "size": stat.st_size,
+            "target": target,
+        })
+    return classes, samples
+
+
+def load_preprocessed(images_path: str, index_path: str) -> tuple[Optional[np.ndarray], dict]:
+    if not os.path.exists(images_path) or not os.path.exists(index_path):
+        return None, {}
+    with open(index_path) as f:
+        index = json.load(f)
+    images = np.load(images_path, mmap_mode="r")
+    if len(images) != len(index["samples"]):
+        # the images were written but the index wasn't, start over
+        return None, {}
+    return images, index
+
+
+def preprocess_spell_images(
+    transform: Callable,
+    name: str,
+    image_dir: Optional[str] = None,
+    preprocessed_dir: str = PREPROCESSED_DIR
+) -> PreprocessedSpellDataset:
+    """
+    Runs transform over every image in image_dir once and packs the results in
+    a .npy file under preprocessed_dir, named after the pipeline. Only images
+    that are new, or whose modification time or size changed, are transformed
+    again on later calls. Delete the file after changing a pipeline.
+    """
+    image_dir = image_dir or os.path.join(DATA_DIR, "images")
+    images_path = os.path.join(preprocessed_dir, f"{name}.npy")
+    index_path = os.path.join(preprocessed_dir, f"{name}.json")
+
+    classes, samples = scan_image_dir(image_dir)
+    images, index = load_preprocessed(images_path, index_path)
+    rows = {
+        (sample["path"], sample["mtime_ns"], sample["size"]): row
+        for row, sample in enumerate(index.get("samples", []))
+    }
+    unchanged = index.get("classes") == classes and index.get("samples") == samples
+    if images is not None and unchanged:
+        return PreprocessedSpellDataset(images, samples, classes)
+
+    def load(sample):
+        row = rows.get((sample["path"], sample["mtime_ns"], sample["size"]))
+        if row is not None:
+            return np.array(images[row])
+        image = transform(default_loader(os.path.join(image_dir, sample["path"])))
+        return np.asarray(image, dtype=np.float32)
+
+    transformed = [load(sample) for sample in samples]
+    shape = transformed[0].shape if transformed else (0,)
+    os.makedirs(preprocessed_dir, exist_ok=True)
+    # written next to the old files and moved over them, so a reader never
+    # sees a partially written file
+    tmp_images_path = images_path + ".tmp.npy"
+    packed = np.lib.format.open_memmap(
+        tmp_images_path, mode="w+", dtype=np.float32, shape=(len(samples), *shape)
+    )
+    for row, image in enumerate(transformed):
+        packed[row] = image
+    packed.flush()
+    del packed
+    os.replace(tmp_images_path, images_path)
+
+    tmp_index_path = index_path + ".tmp"
+    with open(tmp_index_path, "w") as f:
+        json.dump({"classes": classes, "samples": samples}, f)
+    os.replace(tmp_index_path, index_path)
+
+    num_transformed = sum(
+        (s["path"], s["mtime_ns"], s["size"]) not in rows for s in samples
+    )
+    print(f"preprocessed {num_transformed} new images, {len(samples)} total, to {images_path}")
+    return PreprocessedSpellDataset(np.load(images_path, mmap_mode="r"), samples, classes)
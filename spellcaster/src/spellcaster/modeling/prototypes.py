@@ -0,0 +1,190 @@
+import json
+import os
+from pathlib import Path
+from typing import Optional
+
+import numpy as np
+import torch
+
+from spellcaster.constants import DATA_DIR
+from spellcaster.utils.wand_path_rasterizer import resize_wand_path_image
+from .net import BasicConvNet
+from .preprocess import preprocess_spell_images, scan_image_dir
+from .runtime import SpellClassifier, get_model_key
+
+PROTOTYPES_DIR = os.path.join(DATA_DIR, "prototypes")
+# paths further than this many times a spell's spread from its prototype
+# are rejected as not any of the spells
+MAX_SPREAD_DISTANCE = 3.0
+# the few-shot model is trained on dark strokes on a light background, wand
+# path images are light strokes on black. Pixels brighter than this fraction
+# of full intensity are part of the stroke, as with IncreaseContrast.
+STROKE_THRESHOLD = 0.1
+# name of the preprocessed images prototypes are built from, stored with the
+# prototypes so ones built from another pipeline aren't reused
+PROTOTYPE_PIPELINE = "prototypes"
+
+
+def to_strokes(images: np.ndarray) -> np.ndarray:
+    stroke = images > STROKE_THRESHOLD * 255
+    return np.where(stroke, 0, 1).astype(np.float32)
+
+
+def prototype_transform(image) -> np.ndarray:
+    """
+    Turns a collected spell image into what the classifier gets for the same
+    wand path at runtime, see rasterize_wand_path, so prototypes and the paths
+    measured against them are drawn alike.
+    """
+    return to_strokes(resize_wand_path_image(np.asarray(image.convert("L"))))[None]
+
+
+def load_backbone(state_dict: dict) -> BasicConvNet:
+    # FewShotClassifier checkpoints hold the backbone weights under backbone.
+    backbone = BasicConvNet()
+    backbone.classifier = torch.nn.Identity()
+    backbone.load_state_dict({
+        key.removeprefix("backbone."): value
+        for key, value in state_dict.items()
+        if key.startswith("backbone.")
+    })
+    return backbone.eval()
+
+
+def embed(backbone: torch.nn.Module, images: np.ndarray, batch_size: int = 256) -> np.ndarray:
+    with torch.inference_mode():
+        return np.concatenate([
+            backbone(torch.from_numpy(np.ascontiguousarray(images[i:i + batch_size]))).numpy()
+            for i in range(0, len(images), batch_size)
+        ])
+
+
+class PrototypeStore:
+    """
+    Per spell prototype embeddings of a few-shot model, the mean embedding of
+    the spell's images, and their spread, the root mean square distance of
+    the images from the prototype. Both are cached on disk as sums, along
+    with the images they were computed from. Updating only embeds the images
+    added since the last update, and recomputes a spell from scratch only if
+    its images were changed or removed.
+    """
+    def __init__(self, model_path: str, prototypes_dir: str = PROTOTYPES_DIR):
+        self.path = os.path.join(prototypes_dir, f"{Path(model_path).stem}.json")
+        self.model_key = get_model_key(model_path)
+        self.spells: dict[str, dict] = {}
+        if os.path.exists(self.path):
+            with open(self.path) as f:
+                stored = json.load(f)
+            # embeddings of another version of the model, or of differently
+            # preprocessed images, are no use
+            if stored["model"] == self.model_key and stored.get("pipeline") == PROTOTYPE_PIPELINE:
+                self.spells = stored["spells"]
+
+    def update(self, backbone: torch.nn.Module, image_dir: Optional[str] = None) -> bool:
+        dataset = preprocess_spell_images(prototype_transform, PROTOTYPE_PIPELINE, image_dir)
+        rows_per_spell = {spell: [] for spell in dataset.classes}
+        for row, sample in enumerate(dataset.samples):
+            rows_per_spell[dataset.classes[sample["target"]]].append(row)
+
+        changed = set(self.spells) != set(rows_per_spell)
+        spells = {}
+        for spell, rows in rows_per_spell.items():
+            keys = [[dataset.samples[row][k] for k in ("path", "mtime_ns", "size")] for row in rows]
+            cached = self.spells.get(spell, {"images": [], "sum": None, "sum_sq": 0.0, "count": 0})
+            cached_keys = {tuple(key) for key in cached["images"]}
+            if cached_keys == {tuple(key) for key in keys}:
+                spells[spell] = cached
+                continue
+
+            changed = True
+            if cached["count"] > 0 and cached_keys <= {tuple(key) for key in keys}:
+                new_rows = [row for row, key in zip(rows, keys) if tuple(key) not in cached_keys]
+                embeddings = embed(backbone, dataset.images[new_rows]).astype(np.float64)
+                embedding_sum = np.array(cached["sum"]) + embeddings.sum(0)
+                embedding_sum_sq = cached["sum_sq"] + (embeddings ** 2).sum()
+            else:
+                embeddings = embed(backbone, dataset.images[rows]).astype(np.float64)
+                embedding_sum = embeddings.sum(0)
+                embedding_sum_sq = (embeddings ** 2).sum()
+            spells[spell] = {
+                "images": keys,
+                "sum": embedding_sum.tolist(),
+                "sum_sq": float(embedding_sum_sq),
+                "count": len(rows)
+            }
+
+        self.spells = spells
+        if changed:
+            self.save()
+        return changed
+
+    def save(self):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump({"model": self.model_key, "pipeline": PROTOTYPE_PIPELINE, "spells": self.spells}, f)
+        os.replace(tmp_path, self.path)
+
+    def prototypes(self) -> tuple[list[str], np.ndarray, np.ndarray]:
+        classes = sorted(self.spells)
+        prototypes, spreads = [], []
+        for spell in classes:
+            count = self.spells[spell]["count"]
+            prototype = np.array(self.spells[spell]["sum"]) / count
+            # mean squared norm minus squared norm of the mean
+            variance = self.spells[spell]["sum_sq"] / count - (prototype ** 2).sum()
+            prototypes.append(prototype)
+            spreads.append(np.sqrt(max(variance, 0.0)))
+        prototypes = np.array(prototypes, dtype=np.float32).reshape(len(classes), -1)
+        return classes, prototypes, np.array(spreads, dtype=np.float32)
+
+
+class PrototypeSpellClassifier(SpellClassifier):
+    """
+    Classifies wand paths with a few-shot model by their distance to the
+    prototype of each spell, so spells are added by collecting images for
+    them rather than by retraining. Scores are negative distances, as in
+    training.
+    """
+    def __init__(self, state_dict: dict, model_path: str, image_dir: Optional[str] = None):
+        self.backbone = load_backbone(state_dict)
+        self.image_dir = image_dir
+        self.store = PrototypeStore(model_path)
+        self.refresh(force=True)
+
+    def refresh(self, force: bool = False):
+        if self.store.update(self.backbone, self.image_dir) or force:
+            self.classes, prototypes, spreads = self.store.prototypes()
+            if len(self.classes) == 0:
+                raise FileNotFoundError("No spell images to build prototypes from")
+            self.prototypes = torch.from_numpy(prototypes)
+            # a spell made of identical images has no spread, so fall back to
+            # the others'
+            fallback = spreads[spreads > 0].mean() if (spreads > 0).any() else 1.0
+            self.spreads = np.where(spreads > 0, spreads, fallback)
+
+    def get_refresh_key(self) -> Optional[list]:
+        try:
+            _, samples = scan_image_dir(self.image_dir or os.path.join(DATA_DIR, "images"))
+        except FileNotFoundError:
+            return None
+        return [[sample[k] for k in ("path", "mtime_ns", "size")] for sample in samples]
+
+    def __call__(self, images: np.ndarray) -> np.ndarray:
+        # preprocessed like the images prototypes are built from, see
+        # prototype_transform
+        with torch.inference_mode():
+            embeddings = self.backbone(torch.from_numpy(to_strokes(images)))
+            return (-torch.cdist(embeddings, self.prototypes)).numpy()
+
+    def confidence(self, scores: np.ndarray) -> np.ndarray:
+        """
+        Softmax over distances measured in each spell's spread. Paths too far
+        from every prototype get no confidence at all, however much closer
+        they are to one spell than to the others.
+        """
+        spread_distances = -scores / self.spreads
+        probabilities = super().confidence(-spread_distances)
+        outlier = spread_distances.min(axis=1) > MAX_SPREAD_DISTANCE
+        probabilities[outlier] = 0
+        return probabilities
@@ -0,0 +1,157 @@
+import time
+import warnings
+from enum import StrEnum
+from pathlib import Path
+from typing import Optional
+
+import numpy as np
+import torch
+
+from spellcaster.constants import MODEL_PATH, MODEL_INPUT_SIZE
+from .data_loader import classifier_transform
+from .export import save_torchscript, to_torchscript
+from .net import BasicConvNet
+from .preprocess import preprocess_spell_images
+from .runtime import build_state_dict_model, is_few_shot_checkpoint
+
+
+class QuantizationMode(StrEnum):
+    # float weights, for pruning alone
+    NONE = "none"
+    # int8 weights for the linear layers, activations quantized on the fly
+    DYNAMIC = "dynamic"
+    # int8 weights and activations everywhere, with activation ranges
+    # calibrated on the stored spell images
+    STATIC = "static"
+
+
+def prune_channels(model: BasicConvNet, amount: float) -> BasicConvNet:
+    """
+    Returns a smaller copy of model without the amount fraction of each
+    convolution's output channels with the smallest L2 norm. The channels are
+    removed rather than zeroed, so the pruned model does less work.
+    """
+    def keep(conv: torch.nn.Conv2d) -> torch.Tensor:
+        norms = conv.weight.detach().flatten(1).norm(dim=1)
+        num_kept = max(1, round(len(norms) * (1 - amount)))
+        return norms.argsort(descending=True)[:num_kept].sort().values
+
+    keep1, keep2 = keep(model.conv1), keep(model.conv2)
+    pruned = BasicConvNet(model.classifier.out_features, len(keep1), len(keep2))
+    with torch.no_grad():
+        pruned.conv1.weight.copy_(model.conv1.weight[keep1])
+        pruned.conv1.bias.copy_(model.conv1.bias[keep1])
+        pruned.conv2.weight.copy_(model.conv2.weight[keep2][:, keep1])
+        pruned.conv2.bias.copy_(model.conv2.bias[keep2])
+        # fc inputs are the flattened 4x4 feature maps of each conv2 channel
+        fc_weight = model.fc.weight.view(model.fc.out_features, -1, 4 * 4)
+        pruned.fc.weight.copy_(fc_weight[:, keep2].flatten(1))
+        pruned.fc.bias.copy_(model.fc.bias)
+        pruned.classifier.load_state_dict(model.classifier.state_dict())
+    return pruned.eval()
+
+
+def get_calibration_data(classes: list[str]) -> tuple[np.ndarray, np.ndarray]:
+    """
+    The stored spell images of the given classes, scaled to the 0-255 range
+    of the rasterized wand paths the classifier sees at inference.
+    """
+    dataset = preprocess_spell_images(classifier_transform(), "classifier")
+    class_indices = {spell: i for i, spell in enumerate(classes)}
+    rows, labels = [], []
+    for row, target in enumerate(dataset.targets):
+        spell = dataset.classes[target]
+        if spell in class_indices:
+            rows.append(row)
+            labels.append(class_indices[spell])
+    return np.asarray(dataset.images[rows]) * 255, np.array(labels)
+
+
+def quantize(model: BasicConvNet, mode: QuantizationMode, calibration_images: np.ndarray) -> torch.nn.Module:
+    """
+    Quantizes model for the quantized engine of this machine, so quantize on
+    the kind of machine the model will run on.
+    """
+    # the torch.ao quantization APIs are deprecated in favour of torchao,
+    # which isn't a dependency
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore")
+        match QuantizationMode(mode):
+            case QuantizationMode.NONE:
+                return model
+            case QuantizationMode.DYNAMIC:
+                return torch.ao.quantization.quantize_dynamic(
+                    model, {torch.nn.Linear}, dtype=torch.qint8
+                )
+            case QuantizationMode.STATIC:
+                from torch.ao.quantization import get_default_qconfig_mapping
+                from torch.ao.quantization.quantize_fx import convert_fx, prepare_fx
+
+                qconfig_mapping = get_default_qconfig_mapping(torch.backends.quantized.engine)
+                images = torch.from_numpy(calibration_images)
+                prepared = prepare_fx(model, qconfig_mapping, (images[:1],))
+                with torch.inference_mode():
+                    for i in range(0, len(images), 64):
+                        prepared(images[i:i + 64])
+                return convert_fx(prepared)
+
+
+def accuracy(model: torch.nn.Module, images: np.ndarray, labels: np.ndarray) -> float:
+    with torch.inference_mode():
+        predictions = model(torch.from_numpy(images)).argmax(dim=1).numpy()
+    return float((predictions == labels).mean())
+
+
+def latency_ms(model: torch.nn.Module, repeat: int = 500) -> float:
+    image = torch.zeros(1, 1, MODEL_INPUT_SIZE, MODEL_INPUT_SIZE)
+    with torch.inference_mode():
+        for _ in range(20):
+            model(image)
+        start = time.perf_counter()
+        for _ in range(repeat):
+            model(image)
+    return (time.perf_counter() - start) / repeat * 1000
+
+
+def get_output_path(model_path: str, mode: QuantizationMode, prune_amount: float) -> str:
+    suffix = f".{mode}" if mode != QuantizationMode.NONE else ""
+    if prune_amount > 0:
+        suffix += f".pruned{round(prune_amount * 100)}"
+    return str(Path(model_path).with_name(Path(model_path).stem + suffix + ".ts"))
+
+
+def quantize_model(
+    mode: QuantizationMode = QuantizationMode.STATIC,
+    prune_amount: float = 0.0,
+    model_path: str = MODEL_PATH,
+    output_path: Optional[str] = None
+):
+    """
+    Prunes and quantizes a BasicConvNet checkpoint, saves it as TorchScript,
+    which load_spell_classifier loads like any other model, and reports its
+    accuracy on the stored spell images and its single image latency next to
+    the float model's.
+    """
+    mode = QuantizationMode(mode)
+    stored_model = torch.load(model_path, map_location="cpu")
+    if is_few_shot_checkpoint(stored_model):
+        raise ValueError(f"{model_path} is a few-shot checkpoint, only classifiers can be quantized")
+    model, classes = build_state_dict_model(stored_model)
+    images, labels = get_calibration_data(classes)
+    if len(images) == 0:
+        raise ValueError("No spell images of the model's classes to calibrate and evaluate on")
+
+    optimized = prune_channels(model, prune_amount) if prune_amount > 0 else model
+    optimized = quantize(optimized, mode, images)
+    output_path = output_path or get_output_path(model_path, mode, prune_amount)
+    save_torchscript(optimized, classes, output_path)
+    print(f"saved model quantized with {mode}, pruned by {prune_amount:.0%}, to {output_path}")
+
+    # both timed as the TorchScript modules inference runs
+    print(f"{len(images)} images of {len(classes)} spells, also used for calibration")
+    for name, candidate in [("float", model), (output_path, optimized)]:
+        print(
+            f"{name:>24}: "
+            f"accuracy {accuracy(candidate, images, labels):.1%}, "
+            f"latency {latency_ms(to_torchscript(candidate)):.3f} ms"
+        )
@@ -0,0 +1,196 @@
+import json
+import os
+from abc import ABC, abstractmethod
+from enum import StrEnum
+from functools import cache
+from pathlib import Path
+from typing import Optional
+
+import numpy as np
+import torch
+
+from spellcaster.constants import MODEL_PATH, MODEL_INPUT_SIZE
+from .net import BasicConvNet
+
+CLASSES_METADATA_KEY = "classes.json"
+
+
+class ModelFormat(StrEnum):
+    STATE_DICT = "state_dict"
+    TORCHSCRIPT = "torchscript"
+    ONNX = "onnx"
+
+
+MODEL_FORMAT_SUFFIXES = {
+    ModelFormat.STATE_DICT: ".pth",
+    ModelFormat.TORCHSCRIPT: ".ts",
+    ModelFormat.ONNX: ".onnx",
+}
+
+
+def resolve_model_path(model_path: str) -> str:
+    """
+    A model path may be a directory of model versions, of which the most
+    recently written is used.
+    """
+    if not os.path.isdir(model_path):
+        return model_path
+    versions = [
+        path for path in Path(model_path).iterdir()
+        if path.suffix in MODEL_FORMAT_SUFFIXES.values()
+    ]
+    if len(versions) == 0:
+        raise FileNotFoundError(f"No models in {model_path}")
+    return str(max(versions, key=lambda path: path.stat().st_mtime_ns))
+
+
+def get_model_key(model_path: str) -> list[int]:
+    stat = os.stat(model_path)
+    return [stat.st_mtime_ns, stat.st_size]
+
+
+def get_model_format(model_path: str) -> ModelFormat:
+    suffix = Path(model_path).suffix
+    for model_format, format_suffix in MODEL_FORMAT_SUFFIXES.items():
+        if suffix == format_suffix:
+            return model_format
+    raise ValueError(f"Unknown model format for {model_path}")
+
+
+class SpellClassifier(ABC):
+    """
+    Maps batches of wand path images of shape (N, 1, MODEL_INPUT_SIZE,
+    MODEL_INPUT_SIZE) to per-class scores of shape (N, len(classes)).
+    """
+    classes: list[str]
+    # path, modification time and size of the model file, see
+    # build_spell_classifier
+    model_key: Optional[list] = None
+
+    @abstractmethod
+    def __call__(self, images: np.ndarray) -> np.ndarray:
+        pass
+
+    def confidence(self, scores: np.ndarray) -> np.ndarray:
+        """
+        Per-class probabilities of a batch of scores.
+        """
+        probabilities = np.exp(scores - scores.max(axis=1, keepdims=True))
+        return probabilities / probabilities.sum(axis=1, keepdims=True)
+
+    def predict(self, images: np.ndarray) -> list[tuple[str, float]]:
+        """
+        The most likely spell of each image in a batch and its confidence.
+        Images may be uint8, as rasterized.
+        """
+        probabilities = self.confidence(self(images.astype(np.float32, copy=False)))
+        spell_classes = probabilities.argmax(axis=1)
+        return [
+            (self.classes[spell_cls], float(probabilities[i, spell_cls]))
+            for i, spell_cls in enumerate(spell_classes)
+        ]
+
+    def refresh(self, force: bool = False):
+        """
+        Picks up changes to what the classifier depends on besides its
+        weights, for classifiers that have any. With force, rebuilds from
+        them even if they haven't changed.
+        """
+        pass
+
+    def get_refresh_key(self) -> Optional[list]:
+        """
+        Version of what refresh picks up, None for classifiers that depend on
+        nothing but their weights.
+        """
+        return None
+
+    def warmup(self, iterations: int = 3):
+        images = np.zeros((1, 1, MODEL_INPUT_SIZE, MODEL_INPUT_SIZE), dtype=np.float32)
+        for _ in range(iterations):
+            self(images)
+
+
+class TorchSpellClassifier(SpellClassifier):
+    def __init__(self, model: torch.nn.Module, classes: list[str]):
+        self.model = model.eval()
+        self.classes = classes
+
+    def __call__(self, images: np.ndarray) -> np.ndarray:
+        with torch.inference_mode():
+            return self.model(torch.from_numpy(images)).numpy()
+
+
+class OnnxSpellClassifier(SpellClassifier):
+    def __init__(self, model_path: str):
+        try:
+            import onnxruntime
+        except ImportError as e:
+            raise ImportError(
+                "onnxruntime is required to run ONNX models, install spellcaster[onnx]"
+            ) from e
+
+        self.session = onnxruntime.InferenceSession(
+            model_path, providers=["CPUExecutionProvider"]
+        )
+        metadata = self.session.get_modelmeta().custom_metadata_map
+        self.classes = json.loads(metadata[CLASSES_METADATA_KEY])
+        self.input_name = self.session.get_inputs()[0].name
+
+    def __call__(self, images: np.ndarray) -> np.ndarray:
+        return self.session.run(None, {self.input_name: images})[0]
+
+
+def is_few_shot_checkpoint(stored_model: dict) -> bool:
+    # classifier checkpoints store their classes, few-shot checkpoints are a
+    # bare FewShotClassifier state dict
+    return "classes" not in stored_model
+
+
+def build_state_dict_model(stored_model: dict) -> tuple[BasicConvNet, list[str]]:
+    classes = list(stored_model["classes"])
+    model = BasicConvNet(num_classes=len(classes))
+    model.load_state_dict(stored_model["state_dict"])
+    return model.eval(), classes
+
+
+def load_state_dict_model(model_path: str = MODEL_PATH) -> tuple[BasicConvNet, list[str]]:
+    return build_state_dict_model(torch.load(model_path, map_location="cpu"))
+
+
+@cache
+def load_spell_classifier(model_path: str = MODEL_PATH) -> SpellClassifier:
+    """
+    Loads and warms up a spell classifier. The result is cached, so the model
+    is only loaded once per process.
+    """
+    return build_spell_classifier(model_path)
+
+
+def build_spell_classifier(model_path: str = MODEL_PATH) -> SpellClassifier:
+    """
+    Loads and warms up a spell classifier, remembering the path and version
+    of the model file it was loaded from.
+    """
+    model_path = resolve_model_path(model_path)
+    # taken before loading, so a model written during the load is picked up
+    # as a newer version
+    model_key = [model_path, *get_model_key(model_path)]
+    match get_model_format(model_path):
+        case ModelFormat.STATE_DICT:
+            stored_model = torch.load(model_path, map_location="cpu")
+            if is_few_shot_checkpoint(stored_model):
+                from .prototypes import PrototypeSpellClassifier
+                classifier = PrototypeSpellClassifier(stored_model, model_path)
+            else:
+                classifier = TorchSpellClassifier(*build_state_dict_model(stored_model))
+        case ModelFormat.TORCHSCRIPT:
+            extra_files = {CLASSES_METADATA_KEY: ""}
+            model = torch.jit.load(model_path, _extra_files=extra_files)
+            classifier = TorchSpellClassifier(model, json.loads(extra_files[CLASSES_METADATA_KEY]))
+        case ModelFormat.ONNX:
+            classifier = OnnxSpellClassifier(model_path)
+
+    classifier.warmup()
+    classifier.model_key = model_key
+    return classifier
@@ -1,3 +1,6 @@
+import os
+from typing import Optional
+
 import torch
 from easyfsl.utils import sliding_average
 from torch import nn
@@ -6,6 +9,15 @@ from tqdm import tqdm
 
 from spellcaster.constants import MODEL_PATH
 from .data import omniglot_dataloaders, spell_dataloader
+from .device import (
+    autocast,
+    configure_threads,
+    get_device,
+    get_num_workers,
+    prepare_model,
+    to_device,
+    use_pin_memory,
+)
 from .net import FewShotClassifier
 
 
@@ -30,15 +42,21 @@ def evaluate_on_one_task(
     ).sum().item(), len(query_labels)
 
 
-def evaluate(model: torch.nn.Module, data_loader: DataLoader):
+def evaluate(
+    model: torch.nn.Module,
+    data_loader: DataLoader,
+    device: Optional[torch.device] = None,
+    mixed_precision: Optional[bool] = None
+):
+    device = device or get_device()
     # We'll count everything and compute the ratio at the end
     total_predictions = 0
     correct_predictions = 0
 
     # eval mode affects the behaviour of some layers (such as batch normalization or dropout)
-    # no_grad() tells torch not to keep in memory the whole computational graph (it's more lightweight this way)
-    model.cuda().eval()
-    with torch.no_grad():
+    # inference_mode() tells torch not to keep in memory the whole computational graph (it's more lightweight this way)
+    model.to(device).eval()
+    with torch.inference_mode(), autocast(device, mixed_precision):
         for episode_index, (
             support_images,
             support_labels,
@@ -49,10 +67,10 @@ def evaluate(model: torch.nn.Module, data_loader: DataLoader):
 
             correct, total = evaluate_on_one_task(
                 model,
-                support_images.cuda(),
-                support_labels.cuda(),
-                query_images.cuda(),
-                query_labels.cuda()
+                to_device(support_images, device),
+                to_device(support_labels, device),
+                to_device(query_images, device),
+                to_device(query_labels, device)
             )
 
             total_predictions += total
@@ -63,12 +81,60 @@ def evaluate(model: torch.nn.Module, data_loader: DataLoader):
     )
 
 
-def train():
-    train_loader, test_loader = omniglot_dataloaders()
-    model = FewShotClassifier().cuda()
+def train_step(
+    model: torch.nn.Module,
+    optimizer: torch.optim.Optimizer,
+    criterion: nn.Module,
+    scaler: torch.amp.GradScaler,
+    support_images: torch.Tensor,
+    support_labels: torch.Tensor,
+    query_images: torch.Tensor,
+    query_labels: torch.Tensor,
+    device: torch.device,
+    channels_last: bool = False,
+    mixed_precision: Optional[bool] = None
+) -> float:
+    optimizer.zero_grad(set_to_none=True)
+    with autocast(device, mixed_precision):
+        classification_scores = model(
+            to_device(support_images, device, channels_last),
+            to_device(support_labels, device),
+            to_device(query_images, device, channels_last)
+        )
+        loss = criterion(classification_scores.float(), to_device(query_labels, device))
+
+    scaler.scale(loss).backward()
+    scaler.step(optimizer)
+    scaler.update()
+    return loss.item()
+
+
+def get_grad_scaler(device: torch.device, mixed_precision: Optional[bool] = None) -> torch.amp.GradScaler:
+    # gradients only need scaling with float16, which autocast only uses on CUDA
+    enabled = device.type == "cuda" and mixed_precision is not False
+    return torch.amp.GradScaler(device.type, enabled=enabled)
+
+
+def train(
+    device: Optional[str] = None,
+    num_threads: Optional[int] = None,
+    channels_last: Optional[bool] = None,
+    compile: bool = False,
+    mixed_precision: Optional[bool] = None
+):
+    device = get_device(device)
+    configure_threads(device, num_threads)
+    channels_last = device.type == "cuda" if channels_last is None else channels_last
+    print(f"training on {device} with {torch.get_num_threads()} threads")
+
+    train_loader, test_loader = omniglot_dataloaders(
+        num_workers=get_num_workers(device), pin_memory=use_pin_memory(device)
+    )
+    model = prepare_model(FewShotClassifier(), device, channels_last, compile)
 
     optimizer = torch.optim.Adam(model.parameters(), lr=0.001)
     criterion = nn.CrossEntropyLoss()
+    scaler = get_grad_scaler(device, mixed_precision)
 
     log_update_frequency = 10
 
@@ -82,28 +148,38 @@ def train():
             query_labels,
             _,
         ) in tqdm_train:
-            optimizer.zero_grad()
-            classification_scores = model(
-                support_images.cuda(),
-                support_labels.cuda(),
-                query_images.cuda()
-            )
-
-            loss = criterion(classification_scores, query_labels.cuda())
-            all_loss.append(loss.item())
-
-            loss.backward()
-            optimizer.step()
+            all_loss.append(train_step(
+                model,
+                optimizer,
+                criterion,
+                scaler,
+                support_images,
+                support_labels,
+                query_images,
+                query_labels,
+                device,
+                channels_last,
+                mixed_precision
+            ))
 
             if episode_index % log_update_frequency == 0:
                 tqdm_train.set_postfix(loss=sliding_average(all_loss, log_update_frequency))
 
-    evaluate(model, test_loader)
-    torch.save(model.state_dict(), MODEL_PATH)
-
-
-def evaluate_on_spell_classification():
-    spell_loader = spell_dataloader()
+    evaluate(model, test_loader, device, mixed_precision)
+    # a compiled model keeps the original module, whose state dict has the
+    # plain parameter names
+    model = getattr(model, "_orig_mod", model)
+    # written aside and moved into place, so running trackers reloading the
+    # model never read a partial file
+    tmp_path = MODEL_PATH + ".tmp"
+    torch.save(model.state_dict(), tmp_path)
+    os.replace(tmp_path, MODEL_PATH)
+
+
+def evaluate_on_spell_classification(device: Optional[str] = None, num_threads: Optional[int] = None):
+    device = get_device(device)
+    configure_threads(device, num_threads)
+    spell_loader = spell_dataloader(pin_memory=use_pin_memory(device))
     model = FewShotClassifier()
-    model.load_state_dict(torch.load(MODEL_PATH))
-    evaluate(model, spell_loader)
\ No newline at end of file
+    model.load_state_dict(torch.load(MODEL_PATH, map_location=device))
+    evaluate(model, spell_loader, device)
\ No newline at end of file
@@ -0,0 +1,101 @@
+import copy
+import os
+import threading
+import time
+from typing import Optional
+
+from spellcaster.constants import MODEL_PATH
+from spellcaster.utils.metrics import Stage, record_stage
+from .runtime import (
+    SpellClassifier,
+    build_spell_classifier,
+    get_model_key,
+    load_spell_classifier,
+    resolve_model_path
+)
+
+
+class ModelWatcher:
+    """
+    Watches a model file, or a directory of model versions, and loads new
+    versions on a background thread while the current one keeps serving.
+    A file is loaded once it has stopped changing between two polls, so
+    half written models are skipped. The weights, classes and prototypes of
+    a model live in one classifier, which latest() hands out whole, so
+    callers swap all of them at once by taking the latest classifier
+    between batches. The spell images prototypes are built from are watched
+    the same way, so spells collected while the worker runs are picked up.
+    The watcher thread runs at a lower priority, so loading yields the CPU to
+    the thread serving predictions.
+    """
+    def __init__(self, model_path: str = MODEL_PATH, poll_interval: float = 1.0):
+        self.model_path = model_path
+        self.poll_interval = poll_interval
+        self.classifier = load_spell_classifier(model_path)
+        self.refresh_key = self.classifier.get_refresh_key()
+        self.reloads = 0
+        self.failed_key = None
+        self.stop_event = threading.Event()
+        self.watch_thread = threading.Thread(target=self.watch, daemon=True)
+        self.watch_thread.start()
+
+    def latest(self) -> SpellClassifier:
+        return self.classifier
+
+    def get_model_key(self) -> Optional[list]:
+        try:
+            model_path = resolve_model_path(self.model_path)
+            return [model_path, *get_model_key(model_path)]
+        except FileNotFoundError:
+            # between a model being removed and its replacement moved in
+            return None
+
+    def watch(self):
+        # Linux gives every thread its own nice value
+        if hasattr(os, "setpriority"):
+            os.setpriority(os.PRIO_PROCESS, threading.get_native_id(), 10)
+        previous_key = None
+        previous_refresh_key = None
+        while not self.stop_event.wait(self.poll_interval):
+            model_key = self.get_model_key()
+            stable = model_key is not None and model_key == previous_key
+            previous_key = model_key
+            if not stable or model_key in (self.classifier.model_key, self.failed_key):
+                refresh_key = self.classifier.get_refresh_key()
+                if refresh_key == previous_refresh_key and refresh_key != self.refresh_key:
+                    self.refresh(refresh_key)
+                previous_refresh_key = refresh_key
+                continue
+            start = time.perf_counter()
+            try:
+                classifier = build_spell_classifier(self.model_path)
+            except Exception as e:
+                # an unfinished or broken model, keep serving the current one
+                print(f"not reloading model {model_key[0]}: {e}")
+                self.failed_key = model_key
+                continue
+            record_stage(Stage.MODEL_RELOAD, time.perf_counter() - start)
+            self.refresh_key = classifier.get_refresh_key()
+            self.classifier = classifier
+            self.reloads += 1
+            print(f"reloaded model {model_key[0]} with spells {classifier.classes}")
+
+    def refresh(self, refresh_key: list):
+        # refreshed aside, the serving classifier's prototypes keep matching
+        # its classes until the refreshed one replaces it
+        classifier = copy.copy(self.classifier)
+        start = time.perf_counter()
+        try:
+            classifier.refresh()
+        except Exception as e:
+            print(f"not refreshing model {self.model_path}: {e}")
+        else:
+            record_stage(Stage.MODEL_RELOAD, time.perf_counter() - start)
+            self.classifier = classifier
+            print(f"refreshed model {self.model_path} with spells {classifier.classes}")
+        # a failed refresh is retried once the images change again
+        self.refresh_key = refresh_key
+
+    def stop(self):
+        self.stop_event.set()
+        self.watch_thread.join()
@@ -1,32 +1,91 @@
 from contextlib import asynccontextmanager
-from fastapi import FastAPI, Request
-from fastapi.responses import StreamingResponse
+from typing import Optional
+
+from fastapi import FastAPI, HTTPException, Request, WebSocket, WebSocketDisconnect
+from fastapi.responses import PlainTextResponse, StreamingResponse
 
 from .spellcaster_manager import SpellcasterManager
 from .spellcaster_viewer import SpellcasterViewer
+from .spellcaster_events import SpellcasterEvents
+from spellcaster.constants import FRAME_SHAPE, STREAM_TIERS
+from spellcaster.utils.metrics import (
+    StageHistograms,
+    format_prometheus,
+    get_metrics_name,
+    get_stage_histograms
+)
 
 spellcaster_manager = None
 spellcaster_viewer = None
+spellcaster_events = None
 
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    global spellcaster_manager, spellcaster_viewer
+    global spellcaster_manager, spellcaster_viewer, spellcaster_events
 
     spellcaster_manager = SpellcasterManager()
     spellcaster_manager.debug()
-    spellcaster_viewer = SpellcasterViewer()
+    spellcaster_viewer = SpellcasterViewer(spellcaster_manager.cameras)
+    spellcaster_events = SpellcasterEvents(spellcaster_manager.event_queue)
     yield
+    del spellcaster_events
     del spellcaster_viewer
     del spellcaster_manager
     
 
 app = FastAPI(lifespan=lifespan)
 
+def get_camera(camera: Optional[int]) -> int:
+    if camera is None:
+        return spellcaster_manager.cameras[0]
+    if camera not in spellcaster_manager.cameras:
+        raise HTTPException(status_code=404, detail=f"Unknown camera: {camera}")
+    return camera
+
+
 @app.get("/stream")
-async def stream(request: Request):
-    
+async def stream(request: Request, tier: str = "full", camera: Optional[int] = None):
+    if tier not in STREAM_TIERS:
+        raise HTTPException(status_code=400, detail=f"Unknown stream tier: {tier}")
+
     return StreamingResponse(
-        spellcaster_viewer.get_stream(request),
+        spellcaster_viewer.get_stream(request, get_camera(camera), tier),
         media_type='multipart/x-mixed-replace; boundary=frame'
     )
+
+
+@app.websocket("/events")
+async def events(websocket: WebSocket, camera: Optional[int] = None):
+    """
+    Events of a single camera, or of all of them tagged with their camera.
+    """
+    await websocket.accept()
+    await websocket.send_json({
+        "type": "config",
+        "width": FRAME_SHAPE[1],
+        "height": FRAME_SHAPE[0],
+        "cameras": spellcaster_manager.cameras
+    })
+    try:
+        await spellcaster_events.stream(websocket, camera)
+    except WebSocketDisconnect:
+        pass
+
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics():
+    # the server's own stages, like JPEG encoding, and the workers'
+    snapshots = [get_stage_histograms().snapshot()]
+    workers = [f"camera{camera}" for camera in spellcaster_manager.cameras] + ["inference"]
+    for worker in workers:
+        try:
+            worker_histograms = StageHistograms.attach(get_metrics_name(worker))
+        except (FileNotFoundError, RuntimeError):
+            # the worker isn't running
+            continue
+        snapshots.append(worker_histograms.snapshot())
+        worker_histograms.close()
+    return PlainTextResponse(
+        format_prometheus(snapshots), media_type="text/plain; version=0.0.4"
+    )
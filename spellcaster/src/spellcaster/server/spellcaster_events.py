@@ -0,0 +1,93 @@
+import asyncio
+import queue
+import threading
+from typing import Optional
+
+
+class EventBroadcaster:
+    """
+    Drains the event queue the capture process publishes to and fans every
+    event out to the subscribed websocket clients, either of every camera or
+    of a single one. Each client has a bounded queue that drops its oldest
+    events if the client falls behind.
+    """
+    def __init__(self, event_queue, max_client_events: int = 256):
+        self.event_queue = event_queue
+        self.max_client_events = max_client_events
+        self.subscribers: dict[asyncio.Queue, tuple[asyncio.AbstractEventLoop, Optional[int]]] = {}
+        self.lock = threading.Lock()
+        self.dropped_events = 0
+        self.stop_event = threading.Event()
+        self.drain_thread = threading.Thread(target=self.drain, daemon=True)
+        self.drain_thread.start()
+
+    def subscribe(self, camera: Optional[int] = None) -> asyncio.Queue:
+        client_queue = asyncio.Queue(maxsize=self.max_client_events)
+        with self.lock:
+            self.subscribers[client_queue] = (asyncio.get_running_loop(), camera)
+        return client_queue
+
+    def unsubscribe(self, client_queue: asyncio.Queue):
+        with self.lock:
+            self.subscribers.pop(client_queue, None)
+
+    def put_event(self, client_queue: asyncio.Queue, event: dict):
+        if client_queue.full():
+            client_queue.get_nowait()
+            self.dropped_events += 1
+        client_queue.put_nowait(event)
+
+    def drain(self):
+        while not self.stop_event.is_set():
+            try:
+                event = self.event_queue.get(timeout=0.5)
+            except queue.Empty:
+                continue
+            # events are drained even without clients, so the capture
+            # process never sees a full queue
+            with self.lock:
+                subscribers = list(self.subscribers.items())
+            for client_queue, (loop, camera) in subscribers:
+                if camera is None or event.get("camera") == camera:
+                    loop.call_soon_threadsafe(self.put_event, client_queue, event)
+
+    def stop(self):
+        self.stop_event.set()
+        self.drain_thread.join()
+
+
+class SpellcasterEvents:
+    def __init__(self, event_queue):
+        self.broadcaster = EventBroadcaster(event_queue)
+
+    async def send_events(self, websocket, client_queue: asyncio.Queue):
+        while True:
+            await websocket.send_json(await client_queue.get())
+
+    async def wait_for_disconnect(self, websocket):
+        # clients only listen, anything they send is ignored
+        while (await websocket.receive())["type"] != "websocket.disconnect":
+            pass
+
+    async def stream(self, websocket, camera: Optional[int] = None):
+        """
+        Sends events to websocket until it disconnects, which is noticed
+        straight away rather than on the next event, which may never come.
+        """
+        client_queue = self.broadcaster.subscribe(camera)
+        tasks = [
+            asyncio.create_task(self.send_events(websocket, client_queue)),
+            asyncio.create_task(self.wait_for_disconnect(websocket))
+        ]
+        try:
+            done, _ = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                # raises the error a failed send ended with
+                task.result()
+        finally:
+            for task in tasks:
+                task.cancel()
+            self.broadcaster.unsubscribe(client_queue)
+
+    def __del__(self):
+        self.broadcaster.stop()
@@ -1,8 +1,28 @@
 from enum import StrEnum
+from typing import Optional
 
-from multiprocessing import Process
+import multiprocessing
+import os
+import threading
 
-from spellcaster.spellcaster import run, train, Env
+from spellcaster.constants import CAMERAS, MODEL_PATH
+from spellcaster.inference_worker import InferenceClient, serve_inference
+from spellcaster.spellcaster import run, collect_training_data, Env
+
+# The server runs threads, and forking it could copy a lock one of them holds,
+# like OpenMP's, into a child that then deadlocks. Workers are forked from a
+# clean single threaded server instead, which has already imported torch and
+# the tracking modules, so workers start without importing them again.
+context = multiprocessing.get_context("forkserver")
+context.set_forkserver_preload([
+    "spellcaster.spellcaster",
+    "spellcaster.inference_worker",
+    "spellcaster.modeling.runtime",
+    "spellcaster.modeling.prototypes",
+    "spellcaster.wand_tracker",
+    "spellcaster.spell_handler"
+])
+Process = context.Process
 
 
 class SpellcasterMode(StrEnum):
@@ -12,38 +32,202 @@ class SpellcasterMode(StrEnum):
     STANDBY = "standby"
 
 
+def parse_cameras(cameras: str) -> list[int]:
+    try:
+        indices = [int(camera) for camera in cameras.split(",")]
+    except ValueError:
+        raise ValueError(
+            f"SPELLCASTER_CAMERAS should be comma separated camera indices, like 0,2, not {cameras!r}"
+        )
+    if len(set(indices)) != len(indices):
+        raise ValueError(f"SPELLCASTER_CAMERAS lists a camera twice: {cameras!r}")
+    return indices
+
+
+def get_cpus() -> list[int]:
+    if hasattr(os, "sched_getaffinity"):
+        return sorted(os.sched_getaffinity(0))
+    return list(range(os.cpu_count() or 1))
+
+
+def assign_cpus(num_cameras: int) -> tuple[list[list[int]], list[int]]:
+    """
+    Gives the capture process of every camera a core of its own, counting
+    down from the last core, and the inference worker the rest, which it
+    shares with the server. Cameras share cores when there aren't enough.
+    """
+    cpus = get_cpus()
+    if len(cpus) <= num_cameras:
+        return [[cpus[i % len(cpus)]] for i in range(num_cameras)], cpus
+    capture_cpus = [[cpu] for cpu in reversed(cpus[-num_cameras:])]
+    return capture_cpus, cpus[:-num_cameras]
+
+
+def run_pinned(target, cpus: list[int], **kwargs):
+    if hasattr(os, "sched_setaffinity"):
+        os.sched_setaffinity(0, cpus)
+    target(**kwargs)
+
+
+class Worker:
+    """
+    A process the manager keeps running, restarted when it fails, for
+    instance when its camera is unplugged.
+    """
+    def __init__(self, name: str, target, cpus: list[int], kwargs: dict):
+        self.name = name
+        self.target = target
+        self.cpus = cpus
+        self.kwargs = kwargs
+        self.process = None
+        self.restarts = 0
+
+    def start(self):
+        self.process = Process(
+            target=run_pinned,
+            args=(self.target, self.cpus),
+            kwargs=self.kwargs,
+            name=self.name
+        )
+        self.process.start()
+
+    def is_alive(self) -> bool:
+        return self.process is not None and self.process.is_alive()
+
+    def has_failed(self) -> bool:
+        # capture processes exit cleanly when told to, and training ones when
+        # they've collected their samples
+        return self.process is not None and self.process.exitcode not in (None, 0)
+
+    def terminate(self):
+        if self.is_alive():
+            self.process.terminate()
+        if self.process is not None:
+            self.process.join()
+
+
 class SpellcasterManager:
-    def __init__(self):
-        self.spellcaster_process = None
+    """
+    Runs a capture process per camera, each pinned to its own core, and a
+    single inference worker that classifies the wand paths of every camera.
+    The inference worker keeps running across mode switches, which only
+    restart the capture processes, so switching doesn't reload the model.
+    """
+    def __init__(
+        self,
+        cameras: Optional[list[int]] = None,
+        model_path: str = MODEL_PATH,
+        batch_window: float = 0.002
+    ):
+        self.cameras = cameras if cameras is not None else parse_cameras(CAMERAS)
+        self.model_path = model_path
+        # how long the inference worker waits for other cameras' requests
+        # to batch with the first
+        self.batch_window = batch_window
+        self.workers: list[Worker] = []
+        self.inference_worker: Optional[Worker] = None
         self.mode = SpellcasterMode.STANDBY
+        # capture processes publish wand and spell events here
+        self.event_queue = context.Queue(maxsize=1024)
+        self.capture_cpus, self.inference_cpus = assign_cpus(len(self.cameras))
+        self.restart_interval = 5.0
+        self.lock = threading.Lock()
+        self.stop_event = threading.Event()
+        self.supervisor_thread = threading.Thread(target=self.supervise, daemon=True)
+        self.supervisor_thread.start()
+
+    def supervise(self):
+        while not self.stop_event.wait(self.restart_interval):
+            with self.lock:
+                workers = self.workers if self.inference_worker is None else [self.inference_worker, *self.workers]
+                for worker in workers:
+                    if worker.has_failed():
+                        worker.restarts += 1
+                        print(f"restarting {worker.name} (restart {worker.restarts})")
+                        worker.start()
+
+    def start_workers(self, workers: list[Worker]):
+        with self.lock:
+            self.workers = workers
+            for worker in workers:
+                worker.start()
 
     def terminate(self):
-        if self.spellcaster_process is not None and self.spellcaster_process.is_alive():
-            self.spellcaster_process.terminate()
-            self.spellcaster_process.join()
+        with self.lock:
+            for worker in self.workers:
+                worker.terminate()
+            self.workers = []
         self.mode = SpellcasterMode.STANDBY
 
+    def start_inference_worker(self):
+        with self.lock:
+            if self.inference_worker is not None:
+                return
+            self.request_queue = context.Queue()
+            self.response_queues = {camera: context.Queue() for camera in self.cameras}
+            # lets capture processes tell whether the worker is up
+            self.heartbeat = context.Value("d", 0.0, lock=False)
+            self.inference_worker = Worker(
+                "inference",
+                serve_inference,
+                self.inference_cpus,
+                {
+                    "request_queue": self.request_queue,
+                    "response_queues": self.response_queues,
+                    "model_path": self.model_path,
+                    "batch_window": self.batch_window,
+                    "heartbeat": self.heartbeat
+                }
+            )
+            self.inference_worker.start()
+
+    def capture_workers(self, debug: bool) -> list[Worker]:
+        self.start_inference_worker()
+        workers = []
+        for camera, cpus in zip(self.cameras, self.capture_cpus):
+            # answers meant for a capture process of the previous mode are
+            # told apart by their request ids, see InferenceClient
+            classifier = InferenceClient(self.request_queue, self.response_queues[camera], camera, self.heartbeat)
+            kwargs = {
+                "debug": debug,
+                "env": Env.SUBPROCESS,
+                "camera": camera,
+                "event_queue": self.event_queue,
+                "classifier": classifier
+            }
+            workers.append(Worker(f"camera{camera}", run, cpus, kwargs))
+        return workers
+
     def run(self):
         self.terminate()
         self.mode = SpellcasterMode.INFERENCE
-        kwargs = {"debug": False, "env": Env.SUBPROCESS}
-        self.spellcaster_process = Process(target=run, kwargs=kwargs)
-        self.spellcaster_process.start()
-    
-    def train(self, spell_name: str):
+        self.start_workers(self.capture_workers(debug=False))
+
+    def train(self, spell_name: str, camera: Optional[int] = None):
         self.terminate()
         self.mode = SpellcasterMode.TRAINING
-        kwargs = {"spell_name": spell_name, "env": Env.SUBPROCESS}
-        self.spellcaster_process = Process(target=train, kwargs=kwargs)
-        self.spellcaster_process.start()
+        camera = camera if camera is not None else self.cameras[0]
+        kwargs = {
+            "spell_name": spell_name,
+            "env": Env.SUBPROCESS,
+            "camera": camera,
+            "event_queue": self.event_queue
+        }
+        cpus = self.capture_cpus[self.cameras.index(camera)]
+        self.start_workers([Worker(f"camera{camera}", collect_training_data, cpus, kwargs)])
 
     def debug(self):
         self.terminate()
         self.mode = SpellcasterMode.DEBUG
-        kwargs = {"debug": True, "env": Env.SUBPROCESS}
-        self.spellcaster_process = Process(target=run, kwargs=kwargs)
-        self.spellcaster_process.start()
-            
-    def __del__(self):
+        self.start_workers(self.capture_workers(debug=True))
+
+    def close(self):
+        self.stop_event.set()
         self.terminate()
-    
\ No newline at end of file
+        with self.lock:
+            if self.inference_worker is not None:
+                self.inference_worker.terminate()
+                self.inference_worker = None
+
+    def __del__(self):
+        self.close()
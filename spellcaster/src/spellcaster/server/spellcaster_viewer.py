@@ -1,63 +1,164 @@
-import time
 import asyncio
 import threading
+import time
+from typing import Optional
 
 import cv2
 
-from spellcaster.utils.shared_buffer import SharedFrameBufferReader
-from spellcaster.constants import FRAME_RATE
+from spellcaster.constants import STREAM_TIERS
+from spellcaster.utils.jpeg_encoder import JpegBackend, get_jpeg_encoder
+from spellcaster.utils.metrics import Stage, record_stage
+from spellcaster.utils.shared_buffer import (
+    DEFAULT_FRAME_BUFFER_NAME,
+    SharedFrameBufferReader,
+    get_frame_buffer_name
+)
+
+class FrameBroadcaster:
+    """
+    Encodes frames from the shared frame buffer once and fans the JPEG out to
+    every subscribed client of each resolution tier. Each client has a queue holding only the latest
+    frame, so slow clients skip frames instead of falling behind, and nothing
+    is encoded for tiers without clients.
+    """
+    def __init__(
+        self,
+        jpeg_quality: int = 80,
+        jpeg_backend: Optional[JpegBackend] = None,
+        frame_buffer_name: str = DEFAULT_FRAME_BUFFER_NAME
+    ):
+        self.encoder = get_jpeg_encoder(jpeg_backend, jpeg_quality)
+        self.frame_buffer_name = frame_buffer_name
+        self.subscribers: dict[asyncio.Queue, tuple[asyncio.AbstractEventLoop, str]] = {}
+        self.lock = threading.Lock()
+        self.encoded_frames = 0
+        # frames written to the shared buffer that were never encoded
+        self.missed_frames = 0
+        # frames encoded but replaced before a client took them
+        self.dropped_frames = 0
+        self.reattach_interval = 1.0
+        # every capture thread has its own stop event, so a thread that is
+        # still winding down can't be revived by a new subscriber
+        self.stop_event = None
+        self.capture_thread = None
+        self.stopping_thread = None
+
+    def subscribe(self, tier: str = "full") -> asyncio.Queue:
+        if tier not in STREAM_TIERS:
+            raise ValueError(f"Unknown stream tier: {tier}")
+        queue = asyncio.Queue(maxsize=1)
+        with self.lock:
+            self.subscribers[queue] = (asyncio.get_running_loop(), tier)
+            if self.capture_thread is None:
+                self.stop_event = threading.Event()
+                self.capture_thread = threading.Thread(
+                    target=self.capture,
+                    args=(self.stop_event, self.stopping_thread),
+                    daemon=True
+                )
+                self.capture_thread.start()
+        return queue
+
+    def unsubscribe(self, queue: asyncio.Queue):
+        # called on the event loop, so the capture thread is told to stop
+        # rather than waited for
+        with self.lock:
+            self.subscribers.pop(queue, None)
+            if len(self.subscribers) > 0 or self.capture_thread is None:
+                return
+            self.stopping_thread = self.capture_thread
+            self.capture_thread = None
+            self.stop_event.set()
+
+    def put_latest(self, queue: asyncio.Queue, jpeg: bytes):
+        if queue.full():
+            queue.get_nowait()
+            self.dropped_frames += 1
+        queue.put_nowait(jpeg)
+
+    def encode(self, frame, tier: str) -> Optional[bytes]:
+        start = time.perf_counter()
+        resolution = STREAM_TIERS[tier]
+        if resolution is not None and resolution != frame.shape[1::-1]:
+            frame = cv2.resize(frame, resolution, interpolation=cv2.INTER_AREA)
+        jpeg = self.encoder.encode(frame)
+        record_stage(Stage.JPEG_ENCODE, time.perf_counter() - start)
+        return jpeg
 
+    def attach(self, stop_event: threading.Event) -> Optional[SharedFrameBufferReader]:
+        while not stop_event.is_set():
+            try:
+                return SharedFrameBufferReader(self.frame_buffer_name)
+            except (FileNotFoundError, RuntimeError):
+                # the capture process hasn't created the buffer yet
+                stop_event.wait(self.reattach_interval)
+        return None
 
-_latest_frame = None
-def capture_stream(stop_event: threading.Event):
-    global _latest_frame
-    shared_frame_buffer = SharedFrameBufferReader()
-    for frame in shared_frame_buffer.read():
-        ret, jpeg = cv2.imencode('.jpg', frame)
-        if ret:
-            _latest_frame = jpeg.tobytes()
+    def capture(self, stop_event: threading.Event, previous_thread: Optional[threading.Thread]):
+        # frame locks are held per process, so only one thread reads at a time
+        if previous_thread is not None:
+            previous_thread.join()
+        shared_frame_buffer = self.attach(stop_event)
+        while not stop_event.is_set():
+            shared_frame = shared_frame_buffer.wait_for_frame(timeout=self.reattach_interval)
+            if shared_frame is None:
+                # the capture process may have been restarted with a new buffer
+                del shared_frame_buffer
+                shared_frame_buffer = self.attach(stop_event)
+                continue
 
-        if stop_event.is_set():
-            break
+            with self.lock:
+                subscribers = list(self.subscribers.items())
+            # the frame is encoded straight from shared memory, the writer
+            # skips its slot until it is released
+            jpegs = {
+                tier: self.encode(shared_frame.frame, tier)
+                for tier in {tier for _, (_, tier) in subscribers}
+            }
+            shared_frame_buffer.release(shared_frame)
+            self.encoded_frames += 1
+            self.missed_frames += shared_frame.missed
+            for queue, (loop, tier) in subscribers:
+                if jpegs[tier] is not None:
+                    loop.call_soon_threadsafe(self.put_latest, queue, jpegs[tier])
 
-        time.sleep(1 / FRAME_RATE)
+    def stop(self):
+        with self.lock:
+            self.subscribers.clear()
+            capture_thread = self.capture_thread
+            self.capture_thread = None
+            if self.stop_event is not None:
+                self.stop_event.set()
+        if capture_thread is not None:
+            capture_thread.join()
 
 
 class SpellcasterViewer:
-    def __init__(self):
-        self.streams = 0
-        self.stop_event = threading.Event()
-        self.init_thread()
-
-    def init_thread(self):
-        self.livestream_thread = threading.Thread(
-            target=capture_stream, args=(self.stop_event,)
-        )
-        self.stop_event.clear()
-        
-    async def get_stream(self, request):
-        self.start_livestream()
+    """
+    Streams the frames of every camera, each from its own shared frame buffer.
+    """
+    def __init__(
+        self,
+        cameras: list[int],
+        jpeg_quality: int = 80,
+        jpeg_backend: Optional[JpegBackend] = None
+    ):
+        self.broadcasters = {
+            camera: FrameBroadcaster(jpeg_quality, jpeg_backend, get_frame_buffer_name(camera))
+            for camera in cameras
+        }
+
+    async def get_stream(self, request, camera: int, tier: str = "full"):
+        broadcaster = self.broadcasters[camera]
+        queue = broadcaster.subscribe(tier)
         try:
             while True:
-                if _latest_frame is not None:
-                    yield (b'--frame\r\n'
-                        b'Content-Type: image/jpeg\r\n\r\n' + _latest_frame + b'\r\n')
-                await asyncio.sleep(1 / FRAME_RATE)
-        except asyncio.CancelledError:
-            self.stop_livestream()
-
-    def start_livestream(self):
-        if self.streams == 0:
-            self.livestream_thread.start()
-        self.streams += 1
-
-    def stop_livestream(self):
-        self.streams -= 1
-        if self.streams == 0:
-            self.stop_event.set()
-            self.livestream_thread.join()
-            self.init_thread()
+                jpeg = await queue.get()
+                yield (b'--frame\r\n'
+                    b'Content-Type: image/jpeg\r\n\r\n' + jpeg + b'\r\n')
+        finally:
+            broadcaster.unsubscribe(queue)
 
     def __del__(self):
-        self.stop_livestream()
-        
+        for broadcaster in self.broadcasters.values():
+            broadcaster.stop()
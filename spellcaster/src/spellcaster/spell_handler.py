@@ -1,20 +1,42 @@
+import os
+import time
 from abc import ABC, abstractmethod
+from dataclasses import dataclass
 from datetime import datetime
 from pathlib import Path
+from typing import Optional
 
 import cv2
 import numpy as np
-import torch
 
-from .actions_registry import actions
-from .constants import FRAME_SHAPE, DATA_DIR, MODEL_PATH
-from .db import get_spell, get_action
-from .modeling.net import BasicConvNet
-from .modeling.data_loader import CropWandPath
+from .action_executor import ActionExecutor
+from .constants import (
+    FRAME_SHAPE,
+    DATA_DIR,
+    MODEL_PATH,
+    SPELL_CONFIDENCE_THRESHOLD,
+    UNKNOWN_SPELL
+)
+from .db import SpellActionCache
+from .events import EventPublisher, NullEventPublisher
+from .inference_worker import InferenceError
+from .modeling.runtime import SpellClassifier, load_spell_classifier
+from .utils.confidence_histograms import ConfidenceHistograms
+from .utils.metrics import Stage, record_stage
+from .utils.wand_path_rasterizer import rasterize_wand_path
+
+
+@dataclass
+class SpellPrediction:
+    spell_name: str
+    confidence: float
+    # whether the confidence clears the reject threshold
+    accepted: bool
 
 
 class SpellHandler(ABC):
-    def draw_wand_path(self, wand_path: list[tuple[int, int]]):
+    @staticmethod
+    def draw_wand_path(wand_path: list[tuple[int, int]]):
         frame = np.zeros(FRAME_SHAPE, dtype=np.uint8)
         for i in range(1, len(wand_path)):
             thickness = int(np.sqrt(len(wand_path) / float(i + 1)) * 2.5)
@@ -28,34 +50,100 @@ class SpellHandler(ABC):
     def handle_spell(self, wand_path: list[tuple[int, int]]):
         pass
 
+    def classify(self, wand_path: list[tuple[int, int]]) -> Optional[SpellPrediction]:
+        """
+        Classifies a possibly unfinished wand path without acting on it.
+        Handlers that don't classify never recognize spells early.
+        """
+        return None
+
+    def handle_prediction(self, prediction: Optional[SpellPrediction]):
+        pass
+
+    def close(self):
+        pass
+
 
 class InferenceSpellHandler(SpellHandler):
-    def __init__(self, debug: bool=False):
+    def __init__(
+        self,
+        debug: bool=False,
+        model_path: str = MODEL_PATH,
+        event_publisher: Optional[EventPublisher] = None,
+        confidence_threshold: float = SPELL_CONFIDENCE_THRESHOLD,
+        classifier: Optional[SpellClassifier] = None
+    ):
         self.debug = debug
-        self.model = BasicConvNet()
-        stored_model = torch.load(MODEL_PATH)
-        self.model.load_state_dict(stored_model["state_dict"])
-        self.model.eval()
-        self.class_to_spell = {
-            cls: spell for cls, spell in enumerate(stored_model["classes"])
-        }
+        self.confidence_threshold = confidence_threshold
+        # wand paths that fit in a box this small, in frame pixels, are
+        # treated as noise and never classified
+        self.minimum_spell_extent = 40
+        self.confidence_histograms = ConfidenceHistograms(
+            os.path.join(DATA_DIR, "confidence_histograms.json")
+        )
+        self.event_publisher = event_publisher or NullEventPublisher()
+        # anything with predict and refresh, like the client of an inference
+        # worker shared with other cameras. New versions of the model are only
+        # picked up by the inference worker, loading them here would hold up
+        # tracking.
+        self.classifier = classifier or load_spell_classifier(model_path)
+        # the classifier is loaded once per process, spell images may have
+        # been collected since
+        self.classifier.refresh()
+        self.action_executor = ActionExecutor(event_publisher=self.event_publisher)
+        self.spell_action_cache = SpellActionCache()
         
+    def is_junk_path(self, wand_path: list[tuple[int, int]]) -> bool:
+        points = np.asarray(wand_path)
+        return (points.max(axis=0) - points.min(axis=0)).max() < self.minimum_spell_extent
+
+    def classify(self, wand_path: list[tuple[int, int]]) -> Optional[SpellPrediction]:
+        """
+        Returns the most likely spell and its confidence, or None for paths
+        too small to be a spell.
+        """
+        if self.is_junk_path(wand_path):
+            return None
+
+        start = time.perf_counter()
+        # sent to the inference worker as is, floats would be four times larger
+        wand_path_img = rasterize_wand_path(wand_path)[None, None, ...]
+        try:
+            [(spell_name, confidence)] = self.classifier.predict(wand_path_img)
+        except (TimeoutError, ConnectionError, InferenceError) as e:
+            print(f"spell not classified: {e}")
+            return None
+        record_stage(Stage.INFERENCE, time.perf_counter() - start)
+        return SpellPrediction(spell_name, confidence, confidence >= self.confidence_threshold)
+
     def handle_spell(self, wand_path: list[tuple[int, int]]):
-        wand_path_img = self.draw_wand_path(wand_path)
-        cropped_wand_path_img = CropWandPath()(wand_path_img)
-        wand_path_img_tensor = torch.tensor(cropped_wand_path_img)[None, None, ...].float()
-        resized_wand_path = torch.nn.functional.interpolate(wand_path_img_tensor, size=(28, 28))
-
-        with torch.no_grad():
-            y_pred = self.model(resized_wand_path)
-            spell_name = self.class_to_spell[torch.argmax(y_pred).item()]
-            print(f"spell detected: {spell_name}")
-            spell = get_spell(spell_name)
-            if spell.action_id is not None:
-                action = get_action(spell.action_id)
-                print(f"executing action: {action.name}")
-                actions[action.function]()
-            
+        self.handle_prediction(self.classify(wand_path))
+
+    def handle_prediction(self, prediction: Optional[SpellPrediction]):
+        if prediction is None:
+            self.event_publisher.spell(UNKNOWN_SPELL, 0.0)
+            return
+
+        self.confidence_histograms.record(
+            prediction.spell_name, prediction.confidence, prediction.accepted
+        )
+        if self.debug:
+            print(self.confidence_histograms.summary())
+        if not prediction.accepted:
+            print(f"spell rejected: {prediction.spell_name} ({prediction.confidence:.2f})")
+            self.event_publisher.spell(UNKNOWN_SPELL, prediction.confidence)
+            return
+
+        print(f"spell detected: {prediction.spell_name} ({prediction.confidence:.2f})")
+        self.event_publisher.spell(prediction.spell_name, prediction.confidence)
+        action = self.spell_action_cache.get_action(prediction.spell_name)
+        if action is not None:
+            print(f"executing action: {action.name}")
+            self.action_executor.submit(action.function)
+
+    def close(self):
+        # capture processes exit without running atexit handlers
+        self.confidence_histograms.close()
 
 
 class TrainingSpellHandler(SpellHandler):
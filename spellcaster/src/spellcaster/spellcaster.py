@@ -1,24 +1,51 @@
+import importlib
 import time
 from enum import StrEnum
-from typing import Optional
+from typing import Optional, TYPE_CHECKING
 
 from fire import Fire
 
-from .db import get_spell, add_spell, manage_db, Spell
-from .wand_tracker import WandTracker
-from .spell_handler import InferenceSpellHandler, TrainingSpellHandler
-from .modeling.train import train, evaluate_on_spell_classification
-from .utils import (
-    Camera,
-    WandPathVisualizer,
-    CV2WandPathVisualizer,
-    ShmWandPathVisualizer,
-    ExitChecker,
-    CV2ExitChecker,
-    SigTermExitChecker,
-    get_blob_detector
+from .constants import (
+    EARLY_SPELL_CONFIDENCE_THRESHOLD,
+    INFERENCE_ADDRESS,
+    MODEL_PATH,
+    SPELL_CONFIDENCE_THRESHOLD
 )
 
+# everything heavier than the standard library is imported where it's used, so
+# commands like `spellcaster manage` don't pay for torch and OpenCV
+if TYPE_CHECKING:
+    from .wand_tracker import WandTracker
+    from .utils import Camera, ExitChecker, WandPathVisualizer
+    from .events import EventPublisher
+
+
+class LazyCommand:
+    """
+    A command that imports the function it runs only when it runs, or when
+    Fire inspects it for help. Fire reads the function's own signature and
+    docstring through __wrapped__, so the two can't drift apart.
+    """
+    def __init__(self, module: str, name: str):
+        self._module = module
+        self._name = name
+        self.__name__ = name
+
+    @property
+    def __wrapped__(self):
+        return getattr(importlib.import_module(self._module, __package__), self._name)
+
+    @property
+    def __doc__(self):
+        return self.__wrapped__.__doc__
+
+    def __get__(self, instance, owner=None):
+        # makes Fire list it as a command, like a function
+        return self
+
+    def __call__(self, *args, **kwargs):
+        return self.__wrapped__(*args, **kwargs)
+
 
 class Env(StrEnum):
     SUBPROCESS = "subprocess"
@@ -28,28 +55,56 @@ class Env(StrEnum):
 class Spellcaster:
     def __init__(
         self,
-        camera: Camera,
-        wand_tracker: WandTracker,
-        exit_checker: ExitChecker,
-        visualizer: Optional[WandPathVisualizer] = None
+        camera: "Camera",
+        wand_tracker: "WandTracker",
+        exit_checker: "ExitChecker",
+        visualizer: Optional["WandPathVisualizer"] = None,
+        event_publisher: Optional["EventPublisher"] = None
     ):
         self.camera = camera
         self.wand_tracker = wand_tracker
         self.exit_checker = exit_checker
         self.visualizer = visualizer
+        self.event_publisher = event_publisher
         
-    def run(self, debug: bool = False):
-        spell_handler = InferenceSpellHandler(debug=debug)
+    def run(
+        self,
+        debug: bool = False,
+        model_path: str = MODEL_PATH,
+        confidence_threshold: float = SPELL_CONFIDENCE_THRESHOLD,
+        classifier=None
+    ):
+        from .spell_handler import InferenceSpellHandler
+        from .utils.metrics import Stage, record_stage
+
+        spell_handler = InferenceSpellHandler(
+            debug=debug,
+            model_path=model_path,
+            event_publisher=self.event_publisher,
+            confidence_threshold=confidence_threshold,
+            classifier=classifier
+        )
         self.wand_tracker.set_spell_handler(spell_handler)
 
-        for frame in self.camera.stream():
-            wand_path = self.wand_tracker.process_frame(frame)
-            if debug:
-                self.visualizer(frame, wand_path)
-            if self.exit_checker.should_exit():
-                break
+        try:
+            capture_start = time.perf_counter()
+            for frame in self.camera.stream():
+                frame_start = time.perf_counter()
+                record_stage(Stage.CAPTURE, frame_start - capture_start)
+                wand_path = self.wand_tracker.process_frame(frame)
+                if debug:
+                    self.visualizer(frame, wand_path)
+                if self.exit_checker.should_exit():
+                    break
+                capture_start = time.perf_counter()
+                record_stage(Stage.FRAME, capture_start - frame_start)
+        finally:
+            spell_handler.close()
 
     def collect_training_data(self, spell_name: str, num_samples: int = 15):
+        from .db import get_spell, add_spell, Spell
+        from .spell_handler import TrainingSpellHandler
+
         if get_spell(spell_name) is None:
             add_spell(Spell(name=spell_name))
 
@@ -79,8 +134,37 @@ class Spellcaster:
                 break
 
             
-def build_spellcaster(env: Env):    
-    camera = Camera()
+def build_spellcaster(
+    env: Env,
+    threaded_capture: bool = True,
+    roi_radius: Optional[int] = 120,
+    detection_scale: float = 0.5,
+    detector: str = "simple",
+    event_queue=None,
+    early_recognition_interval: Optional[int] = None,
+    recording: Optional[str] = None,
+    camera: int = 0,
+    early_confidence_threshold: float = EARLY_SPELL_CONFIDENCE_THRESHOLD
+):    
+    from .events import get_event_publisher
+    from .wand_tracker import WandTracker
+    from .utils import (
+        Camera,
+        ThreadedCamera,
+        CV2WandPathVisualizer,
+        ShmWandPathVisualizer,
+        CV2ExitChecker,
+        SigTermExitChecker,
+        get_blob_detector
+    )
+
+    if recording is not None:
+        from .utils.replay import ReplayCamera
+        # paced like a live camera
+        capture = ReplayCamera(recording, real_time=True)
+    else:
+        capture = ThreadedCamera(camera) if threaded_capture else Camera(camera)
+    event_publisher = get_event_publisher(event_queue, camera)
     exit_checker = None
     visualizer = None
 
@@ -89,32 +173,127 @@ def build_spellcaster(env: Env):
             exit_checker = CV2ExitChecker()
             visualizer = CV2WandPathVisualizer()
         case Env.SUBPROCESS:
+            from .utils.metrics import get_metrics_name, share_stage_metrics
+            from .utils.shared_buffer import get_frame_buffer_name
             exit_checker = SigTermExitChecker()
-            visualizer = ShmWandPathVisualizer()
+            visualizer = ShmWandPathVisualizer(get_frame_buffer_name(camera))
+            # the server reads the stage timings for /metrics
+            share_stage_metrics(get_metrics_name(f"camera{camera}"))
         case _:
             raise ValueError(f"Unknown env: {env}")
         
-    wand_tracker = WandTracker(get_blob_detector())
-    return Spellcaster(camera, wand_tracker, exit_checker, visualizer)
+    wand_tracker = WandTracker(
+        get_blob_detector(detection_scale, detector),
+        roi_radius=roi_radius,
+        detection_scale=detection_scale,
+        event_publisher=event_publisher,
+        early_recognition_interval=early_recognition_interval,
+        early_confidence_threshold=early_confidence_threshold
+    )
+    return Spellcaster(capture, wand_tracker, exit_checker, visualizer, event_publisher)
 
 
-def run(debug: bool = False, env: Env = Env.STANDALONE):
-    spellcaster = build_spellcaster(env)
-    spellcaster.run(debug)
+def run(
+    debug: bool = False,
+    env: Env = Env.STANDALONE,
+    threaded_capture: bool = True,
+    roi_radius: Optional[int] = 120,
+    detection_scale: float = 0.5,
+    detector: str = "simple",
+    model_path: str = MODEL_PATH,
+    confidence_threshold: float = SPELL_CONFIDENCE_THRESHOLD,
+    early_recognition_interval: Optional[int] = None,
+    early_confidence_threshold: float = EARLY_SPELL_CONFIDENCE_THRESHOLD,
+    recording: Optional[str] = None,
+    camera: int = 0,
+    inference_address: Optional[str] = None,
+    event_queue=None,
+    classifier=None
+):
+    if inference_address is not None and classifier is None:
+        from .inference_worker import SocketInferenceClient
+        # classify with a running serve_inference instead of loading the model
+        classifier = SocketInferenceClient(inference_address)
+    spellcaster = build_spellcaster(
+        env,
+        threaded_capture,
+        roi_radius,
+        detection_scale,
+        detector,
+        event_queue,
+        early_recognition_interval,
+        recording,
+        camera,
+        early_confidence_threshold
+    )
+    spellcaster.run(debug, model_path, confidence_threshold, classifier)
 
 
-def collect_training_data(spell_name: str, env: Env = Env.STANDALONE):
-    spellcaster = build_spellcaster(env)
+def collect_training_data(
+    spell_name: str,
+    env: Env = Env.STANDALONE,
+    threaded_capture: bool = True,
+    camera: int = 0,
+    event_queue=None
+):
+    spellcaster = build_spellcaster(env, threaded_capture, event_queue=event_queue, camera=camera)
     spellcaster.collect_training_data(spell_name)
 
 
+def serve_inference(
+    address: str = INFERENCE_ADDRESS,
+    model_path: str = MODEL_PATH,
+    batch_window_ms: float = 2.0,
+    max_batch_size: int = 32,
+    num_threads: Optional[int] = None
+):
+    from .inference_worker import serve_inference_socket
+    serve_inference_socket(address, model_path, batch_window_ms / 1000, max_batch_size, num_threads)
+
+
+def preprocess_data():
+    from .modeling.data import spell_transform
+    from .modeling.data_loader import classifier_transform
+    from .modeling.preprocess import preprocess_spell_images
+    from .modeling.prototypes import PROTOTYPE_PIPELINE, prototype_transform
+    preprocess_spell_images(spell_transform(), "few_shot")
+    preprocess_spell_images(prototype_transform, PROTOTYPE_PIPELINE)
+    preprocess_spell_images(classifier_transform(), "classifier")
+
+
+def record_session(
+    output_dir: str,
+    num_frames: int = 300,
+    threaded_capture: bool = True,
+    camera: int = 0
+):
+    from .utils import Camera, ThreadedCamera
+    from .utils.replay import record_session
+    record_session(output_dir, num_frames, ThreadedCamera(camera) if threaded_capture else Camera(camera))
+
+
 def cli():
     Fire({
         "run": run,
         "collect_training_data": collect_training_data,
-        "manage": manage_db,
-        "train_model": train,
-        "evaluate_model": evaluate_on_spell_classification
+        "record_session": record_session,
+        "serve_inference": serve_inference,
+        "manage": LazyCommand(".db", "manage_db"),
+        "preprocess_data": preprocess_data,
+        "train_model": LazyCommand(".modeling.train", "train"),
+        "evaluate_model": LazyCommand(".modeling.train", "evaluate_on_spell_classification"),
+        "export_model": LazyCommand(".modeling.export", "export_model"),
+        "quantize_model": LazyCommand(".modeling.quantize", "quantize_model"),
+        "benchmark": {
+            "detectors": LazyCommand(".benchmarks.detectors", "benchmark_detectors"),
+            "rasterizer": LazyCommand(".benchmarks.rasterizer", "benchmark_rasterizer"),
+            "imports": LazyCommand(".benchmarks.imports", "benchmark_imports"),
+            "jpeg": LazyCommand(".benchmarks.jpeg", "benchmark_jpeg"),
+            "training": LazyCommand(".benchmarks.training", "benchmark_training"),
+            "pipeline": LazyCommand(".benchmarks.pipeline", "benchmark_pipeline"),
+            "inference": LazyCommand(".benchmarks.inference", "benchmark_inference"),
+            "reload": LazyCommand(".benchmarks.reload", "benchmark_reload")
+        }
     })
 
 
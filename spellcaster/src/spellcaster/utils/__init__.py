@@ -1,5 +1,9 @@
-from .blob_detector import get_blob_detector
-from .camera import Camera
+from .blob_detector import (
+    BlobDetectorType,
+    ConnectedComponentsBlobDetector,
+    get_blob_detector
+)
+from .camera import Camera, ThreadedCamera
 from .exit_checker import (
     ExitChecker,
     CV2ExitChecker,
@@ -11,9 +15,12 @@ from .wand_path_visualizer import (
     ShmWandPathVisualizer
 )
 from .shared_buffer import SharedFrameBufferWriter
+from .replay import ReplayCamera
 
 __all__ = [
     "Camera",
+    "ThreadedCamera",
+    "ReplayCamera",
     "ExitChecker",
     "CV2ExitChecker",
     "SigTermExitChecker",
@@ -21,5 +28,7 @@ __all__ = [
     "CV2WandPathVisualizer",
     "ShmWandPathVisualizer",
     "SharedFrameBufferWriter",
+    "BlobDetectorType",
+    "ConnectedComponentsBlobDetector",
     "get_blob_detector"
 ]
\ No newline at end of file
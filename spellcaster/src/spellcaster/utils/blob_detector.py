@@ -1,7 +1,59 @@
+from enum import StrEnum
+
 import cv2
+import numpy as np
+
+
+class BlobDetectorType(StrEnum):
+    SIMPLE = "simple"
+    COMPONENTS = "components"
+
+
+class ConnectedComponentsBlobDetector:
+    """
+    Drop-in replacement for cv2.SimpleBlobDetector that finds bright blobs
+    with a single threshold and one connected components pass, instead of
+    sweeping a range of thresholds.
+    """
+    def __init__(self, threshold=150, min_area=25, max_area=1000):
+        self.threshold = threshold
+        self.min_area = min_area
+        self.max_area = max_area
 
+    def detect(self, img):
+        _, binary = cv2.threshold(img, self.threshold, 255, cv2.THRESH_BINARY)
+        # only label the region that has any pixels above the threshold, which
+        # is usually a small patch around the wand tip
+        x, y, w, h = cv2.boundingRect(binary)
+        if w == 0 or h == 0:
+            return []
+        num_labels, _, stats, centroids = cv2.connectedComponentsWithStats(
+            binary[y:y + h, x:x + w], connectivity=8, ltype=cv2.CV_16U
+        )
+
+        # label 0 is the background
+        areas = stats[1:num_labels, cv2.CC_STAT_AREA]
+        centroids = centroids[1:num_labels] + (x, y)
+        mask = (areas >= self.min_area) & (areas <= self.max_area)
+        areas, centroids = areas[mask], centroids[mask]
+
+        order = np.argsort(-areas, kind="stable")
+        sizes = 2 * np.sqrt(areas / np.pi)
+        return [
+            cv2.KeyPoint(float(centroids[i, 0]), float(centroids[i, 1]), float(sizes[i]))
+            for i in order
+        ]
+
+
+def get_blob_detector(scale: float = 1.0, detector: BlobDetectorType = BlobDetectorType.SIMPLE):
+    if detector == BlobDetectorType.COMPONENTS:
+        return ConnectedComponentsBlobDetector(
+            min_area=25 * scale ** 2,
+            max_area=1000 * scale ** 2
+        )
+    if detector != BlobDetectorType.SIMPLE:
+        raise ValueError(f"Unknown blob detector: {detector}")
 
-def get_blob_detector():
     params = cv2.SimpleBlobDetector_Params()
 
     params.filterByColor = True
@@ -11,6 +63,9 @@ def get_blob_detector():
     params.maxThreshold = 255
 
     params.filterByArea = True
-    params.maxArea = 1000
-    
-    return cv2.SimpleBlobDetector_create(params)
\ No newline at end of file
+    # blob areas shrink with the square of the detection scale
+    params.minArea = params.minArea * scale ** 2
+    params.maxArea = 1000 * scale ** 2
+    params.minDistBetweenBlobs = params.minDistBetweenBlobs * scale
+
+    return cv2.SimpleBlobDetector_create(params)
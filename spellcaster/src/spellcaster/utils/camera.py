@@ -1,11 +1,19 @@
+import threading
+import time
+
 import cv2
+import numpy as np
+
+from spellcaster.constants import FRAME_SHAPE, FRAME_RATE
+
 
 class Camera:
-    def __init__(self):
-        print("Starting video capture")
-        self.cap = cv2.VideoCapture(0)
+    def __init__(self, index: int = 0):
+        print(f"Starting video capture from camera {index}")
+        self.index = index
+        self.cap = cv2.VideoCapture(index)
         if not self.cap.isOpened():
-            raise RuntimeError("Couldn't start video capture")
+            raise RuntimeError(f"Couldn't start video capture from camera {index}")
         
     def stream(self):
         while True:
@@ -19,3 +27,107 @@ class Camera:
     def __del__(self):
         print("Stopping video capture")
         self.cap.release()
+
+
+class ThreadedCamera(Camera):
+    """
+    Camera that reads frames on a dedicated thread into a preallocated ring of
+    buffers, so that slow frame processing never holds up capture. stream()
+    always yields the freshest frame; frames overwritten before being yielded
+    are counted as dropped, and frames older than one frame interval when
+    yielded are counted as late.
+    """
+    def __init__(self, index: int = 0, num_buffers: int = 3, shape=FRAME_SHAPE, frame_rate=FRAME_RATE):
+        if num_buffers < 3:
+            raise ValueError("ThreadedCamera needs at least 3 buffers")
+        super().__init__(index)
+        self.cap.set(cv2.CAP_PROP_BUFFERSIZE, 1)
+        self.cap.set(cv2.CAP_PROP_FRAME_HEIGHT, shape[0])
+        self.cap.set(cv2.CAP_PROP_FRAME_WIDTH, shape[1])
+        self.frame_interval = 1 / frame_rate
+        # cameras may not support the requested resolution, the buffers take
+        # the shape of the frames they actually deliver
+        ret, self._raw_frame = self.cap.read()
+        if not ret:
+            raise RuntimeError(f"Couldn't read a frame from camera {index}")
+        self.buffers = np.zeros((num_buffers, *self._raw_frame.shape), dtype=np.uint8)
+        self.timestamps = np.zeros(num_buffers, dtype=np.float64)
+
+        self.captured_frames = 0
+        self.dropped_frames = 0
+        self.late_frames = 0
+
+        self._latest = -1
+        self._in_use = -1
+        self._served = True
+        self._error = None
+        self._new_frame = threading.Condition()
+        self._stop_event = threading.Event()
+        self._reader_thread = threading.Thread(target=self._read_frames, daemon=True)
+        self._reader_thread.start()
+
+    def _next_slot(self):
+        slot = (self._latest + 1) % len(self.buffers)
+        while slot == self._in_use or slot == self._latest:
+            slot = (slot + 1) % len(self.buffers)
+        return slot
+
+    def _read_frames(self):
+        while not self._stop_event.is_set():
+            ret, raw_frame = self.cap.read(self._raw_frame)
+            if not ret or raw_frame.shape != self._raw_frame.shape:
+                with self._new_frame:
+                    self._error = RuntimeError(
+                        "Video capture ended abruptly" if not ret
+                        else f"Camera changed resolution to {raw_frame.shape} mid capture"
+                    )
+                    self._new_frame.notify_all()
+                return
+
+            with self._new_frame:
+                slot = self._next_slot()
+            # the slot can't be handed out until _latest points at it, so the
+            # flip happens outside the lock
+            cv2.flip(raw_frame, 1, self.buffers[slot])
+            with self._new_frame:
+                if not self._served:
+                    self.dropped_frames += 1
+                self.timestamps[slot] = time.monotonic()
+                self._latest = slot
+                self._served = False
+                self.captured_frames += 1
+                self._new_frame.notify_all()
+
+    def stream(self):
+        while True:
+            with self._new_frame:
+                self._new_frame.wait_for(lambda: not self._served or self._error is not None)
+                if self._error is not None:
+                    raise self._error
+                self._in_use = self._latest
+                self._served = True
+                if time.monotonic() - self.timestamps[self._in_use] > self.frame_interval:
+                    self.late_frames += 1
+
+            yield self.buffers[self._in_use]
+
+    def stats(self):
+        return {
+            "captured_frames": self.captured_frames,
+            "dropped_frames": self.dropped_frames,
+            "late_frames": self.late_frames,
+        }
+
+    def stop(self):
+        if not hasattr(self, "_reader_thread"):
+            # the camera failed to start
+            return
+        self._stop_event.set()
+        if self._reader_thread.is_alive():
+            self._reader_thread.join()
+
+    def __del__(self):
+        self.stop()
+        if hasattr(self, "_reader_thread"):
+            print(f"Capture stats: {self.stats()}")
+        super().__del__()
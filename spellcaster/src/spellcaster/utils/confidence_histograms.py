@@ -0,0 +1,99 @@
+import atexit
+import fcntl
+import json
+import os
+import threading
+
+import numpy as np
+
+
+class ConfidenceHistograms:
+    """
+    Histograms of the confidence of every prediction, per predicted spell,
+    counting accepted and rejected predictions separately. They show where
+    the reject threshold cuts each spell's confidence distribution.
+
+    Counts are kept in memory and added to the file every flush_interval
+    seconds and at exit, on a background thread. The capture processes of
+    every camera add to the same file, under a lock.
+    """
+    def __init__(self, path: str, num_bins: int = 10, flush_interval: float = 30.0):
+        self.path = path
+        self.num_bins = num_bins
+        self.flush_interval = flush_interval
+        # counts in the file as of the last flush, and counts since then
+        self.histograms: dict[str, dict[str, list[int]]] = self.load()
+        self.pending: dict[str, dict[str, list[int]]] = {}
+        self.lock = threading.Lock()
+        self.stop_event = threading.Event()
+        self.flush_thread = threading.Thread(target=self.flush_periodically, daemon=True)
+        self.flush_thread.start()
+        atexit.register(self.close)
+
+    def load(self) -> dict[str, dict[str, list[int]]]:
+        if not os.path.exists(self.path):
+            return {}
+        with open(self.path) as f:
+            stored = json.load(f)
+        if stored["num_bins"] != self.num_bins:
+            return {}
+        return stored["histograms"]
+
+    def empty_histogram(self) -> dict[str, list[int]]:
+        return {"accepted": [0] * self.num_bins, "rejected": [0] * self.num_bins}
+
+    def add(self, histograms: dict, counts: dict) -> dict:
+        """
+        Returns a copy of histograms with counts added to it.
+        """
+        total = {spell_name: dict(histogram) for spell_name, histogram in histograms.items()}
+        for spell_name, histogram_counts in counts.items():
+            histogram = total.setdefault(spell_name, self.empty_histogram())
+            for outcome in ("accepted", "rejected"):
+                histogram[outcome] = [a + b for a, b in zip(histogram[outcome], histogram_counts[outcome])]
+        return total
+
+    def record(self, spell_name: str, confidence: float, accepted: bool):
+        confidence_bin = min(int(confidence * self.num_bins), self.num_bins - 1)
+        with self.lock:
+            histogram = self.pending.setdefault(spell_name, self.empty_histogram())
+            histogram["accepted" if accepted else "rejected"][confidence_bin] += 1
+
+    def flush(self):
+        with self.lock:
+            pending, self.pending = self.pending, {}
+        if len(pending) == 0:
+            return
+
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        with open(self.path + ".lock", "w") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            # other processes may have flushed since this one last did
+            histograms = self.add(self.load(), pending)
+            tmp_path = f"{self.path}.{os.getpid()}.tmp"
+            with open(tmp_path, "w") as f:
+                json.dump({"num_bins": self.num_bins, "histograms": histograms}, f)
+            os.replace(tmp_path, self.path)
+        self.histograms = histograms
+
+    def flush_periodically(self):
+        while not self.stop_event.wait(self.flush_interval):
+            self.flush()
+
+    def close(self):
+        self.stop_event.set()
+        self.flush()
+
+    def summary(self) -> str:
+        with self.lock:
+            histograms = self.add(self.histograms, self.pending)
+
+        edges = np.linspace(0, 1, self.num_bins + 1)
+        lines = ["spell".ljust(16) + " ".join(f"{edge:>5.1f}" for edge in edges[:-1])]
+        for spell_name, histogram in sorted(histograms.items()):
+            for outcome in ("accepted", "rejected"):
+                counts = histogram[outcome]
+                if sum(counts) > 0:
+                    label = f"{spell_name} ({outcome[0]})"
+                    lines.append(label.ljust(16) + " ".join(f"{c:>5}" for c in counts))
+        return "\n".join(lines)
@@ -0,0 +1,35 @@
+from contextvars import ContextVar
+from functools import cache
+
+from dotenv import dotenv_values
+from requests import Session
+from requests.adapters import HTTPAdapter
+
+from spellcaster.constants import ACTION_TIMEOUT
+
+# timeout applied to requests made through post(), set per action by the
+# ActionExecutor
+request_timeout = ContextVar("request_timeout", default=ACTION_TIMEOUT)
+
+
+@cache
+def get_env_values(path: str = ".env") -> dict:
+    return dotenv_values(path)
+
+
+@cache
+def get_session() -> Session:
+    """
+    Session shared by all actions, so connections to the same host are kept
+    alive and reused between actions.
+    """
+    session = Session()
+    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=8)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+def post(url: str, **kwargs):
+    kwargs.setdefault("timeout", request_timeout.get())
+    return get_session().post(url, **kwargs)
@@ -0,0 +1,106 @@
+from abc import ABC, abstractmethod
+from enum import StrEnum
+from typing import Optional
+
+import cv2
+import numpy as np
+
+
+class JpegBackend(StrEnum):
+    TURBOJPEG = "turbojpeg"
+    OPENCV = "opencv"
+
+
+class JpegSubsampling(StrEnum):
+    S444 = "444"
+    S422 = "422"
+    S420 = "420"
+
+
+class JpegEncoder(ABC):
+    def __init__(self, quality: int = 80, subsampling: JpegSubsampling = JpegSubsampling.S420):
+        self.quality = quality
+        self.subsampling = JpegSubsampling(subsampling)
+
+    @abstractmethod
+    def encode(self, frame: np.ndarray) -> Optional[bytes]:
+        pass
+
+
+class OpenCVJpegEncoder(JpegEncoder):
+    SAMPLING_FACTORS = {
+        JpegSubsampling.S444: cv2.IMWRITE_JPEG_SAMPLING_FACTOR_444,
+        JpegSubsampling.S422: cv2.IMWRITE_JPEG_SAMPLING_FACTOR_422,
+        JpegSubsampling.S420: cv2.IMWRITE_JPEG_SAMPLING_FACTOR_420,
+    }
+
+    def __init__(self, quality: int = 80, subsampling: JpegSubsampling = JpegSubsampling.S420):
+        super().__init__(quality, subsampling)
+        self.params = [
+            cv2.IMWRITE_JPEG_QUALITY, quality,
+            cv2.IMWRITE_JPEG_SAMPLING_FACTOR, self.SAMPLING_FACTORS[self.subsampling],
+            # huffman table optimization costs an extra pass for a few
+            # percent smaller frames
+            cv2.IMWRITE_JPEG_OPTIMIZE, 0,
+            cv2.IMWRITE_JPEG_PROGRESSIVE, 0,
+        ]
+
+    def encode(self, frame: np.ndarray) -> Optional[bytes]:
+        ret, jpeg = cv2.imencode('.jpg', frame, self.params)
+        return jpeg.tobytes() if ret else None
+
+
+class TurboJpegEncoder(JpegEncoder):
+    """
+    Encodes through libjpeg-turbo directly, into an output buffer that is
+    allocated once and reused for every frame.
+    """
+    def __init__(self, quality: int = 80, subsampling: JpegSubsampling = JpegSubsampling.S420):
+        import turbojpeg
+
+        super().__init__(quality, subsampling)
+        self.jpeg = turbojpeg.TurboJPEG()
+        self.subsample = {
+            JpegSubsampling.S444: turbojpeg.TJSAMP_444,
+            JpegSubsampling.S422: turbojpeg.TJSAMP_422,
+            JpegSubsampling.S420: turbojpeg.TJSAMP_420,
+        }[self.subsampling]
+        self.flags = turbojpeg.TJFLAG_FASTDCT
+        self.dst = bytearray()
+
+    def encode(self, frame: np.ndarray) -> Optional[bytes]:
+        height, width = frame.shape[:2]
+        # worst case JPEG size is bounded by 6 bytes per (MCU padded) pixel
+        required_size = (width + 16) * (height + 16) * 6 + 4096
+        if len(self.dst) < required_size:
+            self.dst = bytearray(required_size)
+        _, size = self.jpeg.encode(
+            np.ascontiguousarray(frame),
+            quality=self.quality,
+            jpeg_subsample=self.subsample,
+            flags=self.flags,
+            dst=self.dst
+        )
+        return bytes(memoryview(self.dst)[:size])
+
+
+def get_jpeg_encoder(
+    backend: Optional[JpegBackend] = None,
+    quality: int = 80,
+    subsampling: JpegSubsampling = JpegSubsampling.S420
+) -> JpegEncoder:
+    """
+    Returns an encoder for the given backend, or the fastest one available if
+    no backend is given.
+    """
+    if backend is None:
+        try:
+            return TurboJpegEncoder(quality, subsampling)
+        except (ImportError, RuntimeError, OSError):
+            return OpenCVJpegEncoder(quality, subsampling)
+
+    match JpegBackend(backend):
+        case JpegBackend.TURBOJPEG:
+            return TurboJpegEncoder(quality, subsampling)
+        case JpegBackend.OPENCV:
+            return OpenCVJpegEncoder(quality, subsampling)
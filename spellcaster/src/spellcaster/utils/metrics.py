@@ -0,0 +1,209 @@
+import atexit
+import bisect
+import threading
+import time
+from enum import StrEnum
+from multiprocessing.shared_memory import SharedMemory
+from typing import Optional
+
+import numpy as np
+
+DEFAULT_METRICS_NAME = "spellcaster_metrics"
+
+
+class Stage(StrEnum):
+    CAPTURE = "capture"
+    GRAYSCALE = "grayscale"
+    DETECTION = "detection"
+    ASSOCIATION = "association"
+    DRAWING = "drawing"
+    SHM_WRITE = "shm_write"
+    JPEG_ENCODE = "jpeg_encode"
+    INFERENCE = "inference"
+    # one batch of the inference worker shared by the cameras
+    INFERENCE_BATCH = "inference_batch"
+    # loading and warming up a new version of the model
+    MODEL_RELOAD = "model_reload"
+    ACTION = "action"
+    FRAME = "frame"
+
+
+STAGES = list(Stage)
+STAGE_INDICES = {stage: i for i, stage in enumerate(STAGES)}
+# upper bounds of the histogram buckets in seconds, the last bucket is +Inf
+BUCKETS = (
+    0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005,
+    0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5
+)
+NUM_BUCKETS = len(BUCKETS) + 1
+# the recent histograms cover the last NUM_WINDOWS windows of WINDOW_SECONDS
+WINDOW_SECONDS = 10
+NUM_WINDOWS = 6
+# per stage, the all time histogram followed by one per window, each the
+# bucket counts followed by the sum and count of the durations
+HISTOGRAM_SIZE = NUM_BUCKETS + 2
+SUM, COUNT = NUM_BUCKETS, NUM_BUCKETS + 1
+MAGIC = 0x4D4554524943  # "METRIC"
+
+
+def get_metrics_name(worker: str) -> str:
+    return f"{DEFAULT_METRICS_NAME}_{worker}"
+
+
+def _buffer_size() -> int:
+    # magic, then the epoch of every window, then the histograms
+    return 8 * (1 + NUM_WINDOWS + len(STAGES) * (NUM_WINDOWS + 1) * HISTOGRAM_SIZE)
+
+
+class StageHistograms:
+    """
+    Histograms of how long each pipeline stage takes, all time and over the
+    last minute, in a flat array that is either local to the process or in
+    shared memory, so the server can read the capture process's histograms.
+    A single process writes to each instance. Readers don't lock, so a
+    snapshot may be a few durations inconsistent.
+    """
+    def __init__(self, shm: Optional[SharedMemory] = None, owner: bool = False):
+        self.shm = shm
+        self.owner = owner
+        buffer = shm.buf if shm is not None else bytearray(_buffer_size())
+        self.header = np.ndarray((1 + NUM_WINDOWS,), dtype=np.int64, buffer=buffer)
+        self.window_epochs = self.header[1:]
+        self.histograms = np.ndarray(
+            (len(STAGES), NUM_WINDOWS + 1, HISTOGRAM_SIZE),
+            dtype=np.float64,
+            buffer=buffer,
+            offset=self.header.nbytes
+        )
+        # flat views for record(), indexing them is much cheaper than
+        # indexing numpy arrays
+        self.epochs_view = memoryview(buffer)[8:self.header.nbytes].cast("q")
+        self.values_view = memoryview(buffer)[self.header.nbytes:_buffer_size()].cast("d")
+        self.lock = threading.Lock()
+
+    @classmethod
+    def create_shared(cls, name: str = DEFAULT_METRICS_NAME) -> "StageHistograms":
+        try:
+            shm = SharedMemory(name=name, create=True, size=_buffer_size())
+        except FileExistsError:
+            # left behind by a capture process that didn't exit cleanly
+            stale = SharedMemory(name=name)
+            stale.close()
+            stale.unlink()
+            shm = SharedMemory(name=name, create=True, size=_buffer_size())
+        histograms = cls(shm, owner=True)
+        histograms.window_epochs[:] = -1
+        histograms.header[0] = MAGIC
+        atexit.register(histograms.close)
+        return histograms
+
+    @classmethod
+    def attach(cls, name: str = DEFAULT_METRICS_NAME) -> "StageHistograms":
+        shm = SharedMemory(name=name)
+        histograms = cls(shm)
+        if shm.size < _buffer_size() or histograms.header[0] != MAGIC:
+            histograms.close()
+            raise RuntimeError(f"Shared stage metrics {name} aren't initialized")
+        return histograms
+
+    def record(self, stage: Stage, seconds: float):
+        bucket = bisect.bisect_left(BUCKETS, seconds)
+        epoch = int(time.monotonic() // WINDOW_SECONDS)
+        window = epoch % NUM_WINDOWS
+        stage_offset = STAGE_INDICES[stage] * (NUM_WINDOWS + 1) * HISTOGRAM_SIZE
+        values = self.values_view
+        with self.lock:
+            if self.epochs_view[window] != epoch:
+                self.histograms[:, window + 1] = 0
+                self.epochs_view[window] = epoch
+            for offset in (stage_offset, stage_offset + (window + 1) * HISTOGRAM_SIZE):
+                values[offset + bucket] += 1
+                values[offset + SUM] += seconds
+                values[offset + COUNT] += 1
+
+    def snapshot(self) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Returns copies of the all time and recent histograms, each of shape
+        (len(STAGES), HISTOGRAM_SIZE).
+        """
+        histograms = self.histograms.copy()
+        epoch = int(time.monotonic() // WINDOW_SECONDS)
+        recent = self.window_epochs > epoch - NUM_WINDOWS
+        return histograms[:, 0], histograms[:, 1:][:, recent].sum(axis=1)
+
+    def close(self):
+        if self.shm is None:
+            return
+        self.epochs_view.release()
+        self.values_view.release()
+        self.header = self.window_epochs = self.histograms = None
+        self.shm.close()
+        if self.owner:
+            self.shm.unlink()
+        self.shm = None
+
+
+_stage_histograms = StageHistograms()
+
+
+def share_stage_metrics(name: str = DEFAULT_METRICS_NAME):
+    """
+    Records this process's stage durations in shared memory from now on.
+    """
+    global _stage_histograms
+    _stage_histograms = StageHistograms.create_shared(name)
+
+
+def get_stage_histograms() -> StageHistograms:
+    return _stage_histograms
+
+
+def record_stage(stage: Stage, seconds: float):
+    _stage_histograms.record(stage, seconds)
+
+
+def estimate_quantile(histogram: np.ndarray, quantile: float) -> float:
+    # interpolates within the bucket, like Prometheus' histogram_quantile
+    counts = histogram[:NUM_BUCKETS]
+    rank = quantile * histogram[COUNT]
+    cumulative = np.cumsum(counts)
+    bucket = min(int(np.searchsorted(cumulative, rank)), len(BUCKETS) - 1)
+    lower = BUCKETS[bucket - 1] if bucket > 0 else 0.0
+    below = cumulative[bucket - 1] if bucket > 0 else 0.0
+    if counts[bucket] == 0:
+        return BUCKETS[bucket]
+    return lower + (BUCKETS[bucket] - lower) * (rank - below) / counts[bucket]
+
+
+def format_prometheus(snapshots: list[tuple[np.ndarray, np.ndarray]]) -> str:
+    """
+    Renders the sum of snapshots from several processes in the Prometheus
+    text exposition format.
+    """
+    histograms = sum(snapshot[0] for snapshot in snapshots)
+    recent = sum(snapshot[1] for snapshot in snapshots)
+    lines = [
+        "# HELP spellcaster_stage_seconds Time spent in each stage of the pipeline.",
+        "# TYPE spellcaster_stage_seconds histogram",
+    ]
+    for stage, histogram in zip(STAGES, histograms):
+        cumulative = np.cumsum(histogram[:NUM_BUCKETS])
+        for bound, count in zip((*BUCKETS, "+Inf"), cumulative):
+            lines.append(f'spellcaster_stage_seconds_bucket{{stage="{stage}",le="{bound}"}} {count:.0f}')
+        lines.append(f'spellcaster_stage_seconds_sum{{stage="{stage}"}} {histogram[SUM]:.9f}')
+        lines.append(f'spellcaster_stage_seconds_count{{stage="{stage}"}} {histogram[COUNT]:.0f}')
+
+    lines += [
+        f"# HELP spellcaster_stage_recent_seconds Stage time quantiles over the last "
+        f"{NUM_WINDOWS * WINDOW_SECONDS} seconds, estimated from the histogram buckets.",
+        "# TYPE spellcaster_stage_recent_seconds gauge",
+    ]
+    for stage, histogram in zip(STAGES, recent):
+        if histogram[COUNT] == 0:
+            continue
+        for quantile in (0.5, 0.9, 0.99):
+            lines.append(
+                f'spellcaster_stage_recent_seconds{{stage="{stage}",quantile="{quantile}"}} '
+                f"{estimate_quantile(histogram, quantile):.9f}"
+            )
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,155 @@
+import json
+import os
+import time
+from dataclasses import dataclass, field
+from pathlib import Path
+
+import cv2
+import numpy as np
+
+from spellcaster.constants import FRAME_RATE
+
+# A recording is a directory holding the frames, either as a raw dump in
+# frames.npy of shape (N, height, width, 3) or as any video OpenCV can read in
+# frames.<ext>, and a labels.json with the frame rate and the spells cast:
+#   {"frame_rate": 30, "spells": [{"spell": "lumos", "start": 12, "end": 58}]}
+# start and end are the indices of the first and last frame of the gesture.
+# Frames are stored as the camera yields them, already mirrored.
+RAW_FRAMES_FILE = "frames.npy"
+LABELS_FILE = "labels.json"
+
+
+@dataclass
+class SpellLabel:
+    spell: str
+    start: int
+    end: int
+
+
+@dataclass
+class Recording:
+    path: Path
+    frame_rate: float = FRAME_RATE
+    spells: list[SpellLabel] = field(default_factory=list)
+
+    @property
+    def frames_path(self) -> Path:
+        raw_frames_path = self.path / RAW_FRAMES_FILE
+        if raw_frames_path.exists():
+            return raw_frames_path
+        videos = sorted(self.path.glob("frames.*"))
+        if len(videos) == 0:
+            raise FileNotFoundError(f"No frames in recording {self.path}")
+        return videos[0]
+
+
+def load_recording(path: str) -> Recording:
+    path = Path(path)
+    labels_path = path / LABELS_FILE
+    if not labels_path.exists():
+        return Recording(path)
+    with open(labels_path) as f:
+        labels = json.load(f)
+    return Recording(
+        path,
+        labels.get("frame_rate", FRAME_RATE),
+        [SpellLabel(**spell) for spell in labels.get("spells", [])]
+    )
+
+
+class ReplayCamera:
+    """
+    Stands in for Camera, yielding the frames of a recording. Frames are
+    yielded as fast as they're consumed, or paced at the recording's frame
+    rate with real_time. Blank frames can be appended so the wand tracker
+    sees the wand disappear after the last gesture.
+    """
+    def __init__(self, recording: str, real_time: bool = False, trailing_blank_frames: int = 0):
+        self.recording = load_recording(recording)
+        self.real_time = real_time
+        self.trailing_blank_frames = trailing_blank_frames
+        self.frame_index = -1
+
+    def read_frames(self):
+        frames_path = self.recording.frames_path
+        if frames_path.suffix == ".npy":
+            yield from np.load(frames_path, mmap_mode="r")
+            return
+
+        cap = cv2.VideoCapture(str(frames_path))
+        try:
+            while True:
+                ret, frame = cap.read()
+                if not ret:
+                    return
+                yield frame
+        finally:
+            cap.release()
+
+    def stream(self):
+        frame_interval = 1 / self.recording.frame_rate
+        next_frame_time = time.monotonic()
+        frame = None
+        for frame in self.read_frames():
+            if self.real_time:
+                time.sleep(max(0.0, next_frame_time - time.monotonic()))
+                next_frame_time += frame_interval
+            self.frame_index += 1
+            yield np.ascontiguousarray(frame)
+
+        if frame is not None:
+            blank_frame = np.zeros_like(frame)
+            for _ in range(self.trailing_blank_frames):
+                self.frame_index += 1
+                yield blank_frame
+
+
+def record_session(output_dir: str, num_frames: int, camera=None):
+    """
+    Records num_frames camera frames as a raw dump, with an empty labels.json
+    to fill in with the spells cast. If the camera stops early, the frames
+    recorded until then are kept.
+    """
+    from .camera import Camera
+
+    if num_frames < 1:
+        raise ValueError(f"Can't record {num_frames} frames")
+    camera = camera or Camera()
+    output_dir = Path(output_dir)
+    output_dir.mkdir(parents=True, exist_ok=True)
+    frames_path = output_dir / RAW_FRAMES_FILE
+    frames = None
+    recorded = 0
+    start = time.monotonic()
+    try:
+        for frame in camera.stream():
+            if frames is None:
+                frames = np.lib.format.open_memmap(
+                    frames_path, mode="w+", dtype=np.uint8, shape=(num_frames, *frame.shape)
+                )
+            frames[recorded] = frame
+            recorded += 1
+            if recorded == num_frames:
+                break
+    except RuntimeError as e:
+        if recorded == 0:
+            raise RuntimeError(f"No frames recorded: {e}") from e
+        print(f"camera stopped after {recorded} of {num_frames} frames: {e}")
+    if recorded == 0:
+        raise RuntimeError("No frames recorded: the camera didn't yield any")
+    frame_rate = recorded / (time.monotonic() - start)
+
+    frames.flush()
+    if recorded < num_frames:
+        # the dump was sized for num_frames, rewrite it without the blank tail
+        tmp_path = output_dir / f"{RAW_FRAMES_FILE}.tmp"
+        with open(tmp_path, "wb") as f:
+            np.save(f, frames[:recorded])
+        del frames
+        os.replace(tmp_path, frames_path)
+
+    labels_path = output_dir / LABELS_FILE
+    if not labels_path.exists():
+        with open(labels_path, "w") as f:
+            json.dump({"frame_rate": round(frame_rate, 1), "spells": []}, f, indent=2)
+    print(f"recorded {recorded} frames at {frame_rate:.1f} fps to {output_dir}")
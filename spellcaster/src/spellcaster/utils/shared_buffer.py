@@ -1,4 +1,10 @@
+import fcntl
+import os
+import tempfile
+import time
+from dataclasses import dataclass
 from multiprocessing.shared_memory import SharedMemory
+from typing import Optional
 
 import numpy as np
 
@@ -6,29 +12,252 @@ from spellcaster.constants import FRAME_SHAPE
 
 DEFAULT_FRAME_BUFFER_NAME = "frame_buffer"
 
+# The buffer starts with a header of int64 fields, followed by num_slots
+# slots, each a header of int64 fields and the frame bytes. The header and
+# every slot are guarded by a lock on the byte at their offset in a lock file
+# next to the buffer. These are kernel record locks, so taking and releasing them orders the
+# memory accesses around them on any CPU, where plain stores to shared memory
+# may be seen out of order on ARM. The writer fills a slot other than the
+# latest under an exclusive lock, skipping slots a reader holds, then points
+# the header at it. Readers hold a shared lock on the slot they read until
+# they release the frame, so it can't be overwritten while they use it.
+# Record locks belong to a process, so the writer and its readers have to be
+# in different processes.
+MAGIC = 0x5350454C4C  # "SPELL"
+HEADER_MAGIC, HEADER_NUM_SLOTS, HEADER_SLOT_BYTES, HEADER_LATEST_SEQ, HEADER_LATEST_SLOT = range(5)
+HEADER_FIELDS = 8
+SLOT_SEQ, SLOT_TIMESTAMP_NS, SLOT_HEIGHT, SLOT_WIDTH, SLOT_CHANNELS = range(5)
+SLOT_HEADER_FIELDS = 8
+FIELD_BYTES = np.dtype(np.int64).itemsize
+# frame data starts on a cache line boundary
+ALIGNMENT = 64
 
-class SharedFrameBufferWriter:
-    def __init__(self, name=DEFAULT_FRAME_BUFFER_NAME, shape=FRAME_SHAPE):
-        ex_frame = np.zeros(shape, dtype=np.uint8)
-        self.shm = SharedMemory(name=name, create=True, size=ex_frame.nbytes)
-        self.buffer = np.ndarray(shape, buffer=self.shm.buf, dtype=np.uint8)
+
+def get_frame_buffer_name(camera: int) -> str:
+    return f"{DEFAULT_FRAME_BUFFER_NAME}_{camera}"
+
+
+def get_lock_path(name: str) -> str:
+    return os.path.join(tempfile.gettempdir(), f"{name}.lock")
+
+
+def _slot_size(slot_bytes: int) -> int:
+    size = SLOT_HEADER_FIELDS * FIELD_BYTES + slot_bytes
+    return (size + ALIGNMENT - 1) // ALIGNMENT * ALIGNMENT
+
+
+class _SharedFrameBuffer:
+    def map(self, num_slots: int, slot_bytes: int):
+        self.num_slots = num_slots
+        self.slot_bytes = slot_bytes
+        self.header = np.ndarray((HEADER_FIELDS,), dtype=np.int64, buffer=self.shm.buf)
+        slot_size = _slot_size(slot_bytes)
+        self.slot_offsets = []
+        self.slot_headers = []
+        self.slot_data = []
+        for i in range(num_slots):
+            offset = HEADER_FIELDS * FIELD_BYTES + i * slot_size
+            self.slot_offsets.append(offset)
+            self.slot_headers.append(np.ndarray(
+                (SLOT_HEADER_FIELDS,), dtype=np.int64, buffer=self.shm.buf, offset=offset
+            ))
+            self.slot_data.append(np.ndarray(
+                (slot_bytes,),
+                dtype=np.uint8,
+                buffer=self.shm.buf,
+                offset=offset + SLOT_HEADER_FIELDS * FIELD_BYTES
+            ))
+
+    def lock(self, offset: int, operation: int):
+        fcntl.lockf(self.lock_fd, operation, 1, offset)
+
+    def close(self):
+        # numpy views have to go before the shared memory can be closed
+        self.header = None
+        self.slot_headers = []
+        self.slot_data = []
+        self.shm.close()
+        os.close(self.lock_fd)
+
+
+@dataclass
+class SharedFrame:
+    seq: int
+    timestamp_ns: int
+    frame: np.ndarray
+    # frames written between the previously read frame and this one
+    missed: int
+    slot: int
+
+
+class SharedFrameBufferWriter(_SharedFrameBuffer):
+    def __init__(self, name=DEFAULT_FRAME_BUFFER_NAME, shape=FRAME_SHAPE, num_slots=3):
+        slot_bytes = int(np.prod(shape))
+        size = HEADER_FIELDS * FIELD_BYTES + num_slots * _slot_size(slot_bytes)
+        # a fresh lock file, readers of a buffer left behind may still hold
+        # locks on the previous one. It's replaced before the buffer, so
+        # readers of the new buffer always find the new lock file.
+        self.lock_path = get_lock_path(name)
+        try:
+            os.unlink(self.lock_path)
+        except FileNotFoundError:
+            pass
+        self.lock_fd = os.open(self.lock_path, os.O_RDWR | os.O_CREAT | os.O_EXCL, 0o600)
+        try:
+            self.shm = SharedMemory(name=name, create=True, size=size)
+        except FileExistsError:
+            # left behind by a capture process that didn't exit cleanly
+            stale = SharedMemory(name=name)
+            stale.close()
+            stale.unlink()
+            self.shm = SharedMemory(name=name, create=True, size=size)
+        self.map(num_slots, slot_bytes)
+        self.lock(0, fcntl.LOCK_EX)
+        self.header[HEADER_NUM_SLOTS] = num_slots
+        self.header[HEADER_SLOT_BYTES] = slot_bytes
+        self.header[HEADER_LATEST_SEQ] = 0
+        self.header[HEADER_LATEST_SLOT] = 0
+        self.header[HEADER_MAGIC] = MAGIC
+        self.lock(0, fcntl.LOCK_UN)
+        self.seq = 0
+        self.latest_slot = 0
+        # frames dropped because readers held every other slot
+        self.dropped_frames = 0
+
+    def acquire_free_slot(self) -> Optional[int]:
+        for i in range(1, self.num_slots):
+            slot = (self.latest_slot + i) % self.num_slots
+            try:
+                self.lock(self.slot_offsets[slot], fcntl.LOCK_EX | fcntl.LOCK_NB)
+                return slot
+            except OSError:
+                # a reader is still using the frame in this slot
+                continue
+        return None
 
     def write(self, frame):
-        self.buffer[:] = frame[:]
+        if frame.nbytes > self.slot_bytes:
+            raise ValueError(f"Frame of shape {frame.shape} doesn't fit in the shared frame buffer")
+
+        slot = self.acquire_free_slot()
+        if slot is None:
+            self.dropped_frames += 1
+            return
+        self.seq += 1
+        slot_header = self.slot_headers[slot]
+        height, width = frame.shape[:2]
+        slot_header[SLOT_HEIGHT] = height
+        slot_header[SLOT_WIDTH] = width
+        slot_header[SLOT_CHANNELS] = frame.shape[2] if frame.ndim == 3 else 1
+        slot_header[SLOT_TIMESTAMP_NS] = time.time_ns()
+        slot_header[SLOT_SEQ] = self.seq
+        self.slot_data[slot][:frame.nbytes].reshape(frame.shape)[:] = frame
+        self.lock(self.slot_offsets[slot], fcntl.LOCK_UN)
+
+        self.lock(0, fcntl.LOCK_EX)
+        self.header[HEADER_LATEST_SEQ] = self.seq
+        self.header[HEADER_LATEST_SLOT] = slot
+        self.lock(0, fcntl.LOCK_UN)
+        self.latest_slot = slot
 
     def __del__(self):
-        self.shm.close()
+        self.close()
         self.shm.unlink()
-    
+        os.unlink(self.lock_path)
+
 
-class SharedFrameBufferReader:
-    def __init__(self, name=DEFAULT_FRAME_BUFFER_NAME, shape=FRAME_SHAPE):
+class SharedFrameBufferReader(_SharedFrameBuffer):
+    def __init__(self, name=DEFAULT_FRAME_BUFFER_NAME, poll_interval=0.002):
         self.shm = SharedMemory(name=name)
-        self.buffer = np.ndarray(shape, buffer=self.shm.buf, dtype=np.uint8)
+        try:
+            self.lock_fd = os.open(get_lock_path(name), os.O_RDWR)
+        except FileNotFoundError:
+            # the writer is being torn down
+            self.shm.close()
+            del self.shm
+            raise
+        header = np.ndarray((HEADER_FIELDS,), dtype=np.int64, buffer=self.shm.buf)
+        self.lock(0, fcntl.LOCK_SH)
+        magic, num_slots, slot_bytes = (int(header[field]) for field in (
+            HEADER_MAGIC, HEADER_NUM_SLOTS, HEADER_SLOT_BYTES
+        ))
+        self.lock(0, fcntl.LOCK_UN)
+        del header
+        if magic != MAGIC:
+            self.shm.close()
+            os.close(self.lock_fd)
+            del self.shm
+            raise RuntimeError(f"Shared frame buffer {name} isn't initialized")
+        self.map(num_slots, slot_bytes)
+        self.poll_interval = poll_interval
+        self.last_seq = 0
+        self.held_slot = None
+
+    def get_latest(self) -> tuple[int, int]:
+        self.lock(0, fcntl.LOCK_SH)
+        seq, slot = int(self.header[HEADER_LATEST_SEQ]), int(self.header[HEADER_LATEST_SLOT])
+        self.lock(0, fcntl.LOCK_UN)
+        return seq, slot
+
+    def read_latest(self) -> Optional[SharedFrame]:
+        """
+        Returns the latest frame as a view into shared memory, without copying
+        it, or None if no frame has been written yet. The writer leaves the
+        frame's slot alone until release() is called, or the next frame is
+        read.
+        """
+        if self.held_slot is not None:
+            self.release_slot(self.held_slot)
+        while True:
+            seq, slot = self.get_latest()
+            if seq == 0:
+                return None
+            self.lock(self.slot_offsets[slot], fcntl.LOCK_SH)
+            slot_header = self.slot_headers[slot]
+            if int(slot_header[SLOT_SEQ]) != seq:
+                # the writer moved on and refilled the slot before it was locked
+                self.lock(self.slot_offsets[slot], fcntl.LOCK_UN)
+                continue
+
+            shape = (int(slot_header[SLOT_HEIGHT]), int(slot_header[SLOT_WIDTH]), int(slot_header[SLOT_CHANNELS]))
+            timestamp_ns = int(slot_header[SLOT_TIMESTAMP_NS])
+            frame = self.slot_data[slot][:int(np.prod(shape))].reshape(shape)
+            missed = max(0, seq - self.last_seq - 1) if self.last_seq > 0 else 0
+            self.last_seq = seq
+            self.held_slot = slot
+            return SharedFrame(seq, timestamp_ns, frame, missed, slot)
+
+    def release_slot(self, slot: int):
+        self.lock(self.slot_offsets[slot], fcntl.LOCK_UN)
+        self.held_slot = None
+
+    def release(self, shared_frame: SharedFrame):
+        """
+        Lets the writer reuse shared_frame's slot. The frame's data mustn't
+        be used afterwards.
+        """
+        if self.held_slot == shared_frame.slot:
+            self.release_slot(shared_frame.slot)
+
+    def wait_for_frame(self, timeout: Optional[float] = None) -> Optional[SharedFrame]:
+        """
+        Waits for a frame newer than the last one read and returns it, or None
+        on timeout.
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        # polling the sequence without the lock only decides when to look,
+        # the frame is read under it
+        while int(self.header[HEADER_LATEST_SEQ]) <= self.last_seq:
+            if deadline is not None and time.monotonic() >= deadline:
+                return None
+            time.sleep(self.poll_interval)
+        return self.read_latest()
 
     def read(self):
         while True:
-            yield self.buffer
+            yield self.wait_for_frame()
 
     def __del__(self):
-        self.shm.close()
\ No newline at end of file
+        # the buffer may not have existed yet
+        if hasattr(self, "shm"):
+            self.close()
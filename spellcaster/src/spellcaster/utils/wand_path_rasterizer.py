@@ -0,0 +1,101 @@
+import threading
+
+import cv2
+import numpy as np
+
+from spellcaster.constants import FRAME_SHAPE, MODEL_INPUT_SIZE
+
+# side of the square image wand paths are saved at, and the space the crop
+# padding is measured in
+WAND_PATH_IMAGE_SIZE = 128
+
+# a blank frame per thread that paths are drawn on and erased from again
+_frames = threading.local()
+
+
+def get_segment_thickness(num_points: int) -> np.ndarray:
+    """
+    Thickness of each segment of a wand path, in frame pixels. Older segments
+    are drawn thicker.
+    """
+    i = np.arange(1, num_points)
+    return (np.sqrt(num_points / (i + 1.0)) * 2.5).astype(np.int32)
+
+
+def get_blank_frame(frame_shape) -> np.ndarray:
+    frame = getattr(_frames, "frame", None)
+    if frame is None or frame.shape != frame_shape[:2]:
+        frame = np.zeros(frame_shape[:2], dtype=np.uint8)
+        _frames.frame = frame
+    return frame
+
+
+def crop_wand_path(img: np.ndarray, padding: int) -> np.ndarray:
+    # CropWandPath, without importing torchvision
+    rows, cols = np.nonzero(img)
+    row_low, row_high = rows.min(), rows.max()
+    col_low, col_high = cols.min(), cols.max()
+    crop_size = max(row_high - row_low, col_high - col_low) + 2 * padding
+    row_start = max(0, (row_low + row_high) // 2 - crop_size // 2)
+    col_start = max(0, (col_low + col_high) // 2 - crop_size // 2)
+    return img[row_start:row_start + crop_size, col_start:col_start + crop_size]
+
+
+def nearest_indices(input_size: int, output_size: int) -> np.ndarray:
+    # the source pixels torch.nn.functional.interpolate's nearest mode samples,
+    # computed in float32 like it does for float tensors
+    scale = np.float32(input_size) / np.float32(output_size)
+    indices = np.floor(np.arange(output_size, dtype=np.float32) * scale).astype(np.int64)
+    return np.minimum(indices, input_size - 1)
+
+
+def resize_wand_path_image(
+    wand_path_img: np.ndarray,
+    size: int = MODEL_INPUT_SIZE,
+    padding: int = 5
+) -> np.ndarray:
+    """
+    Crops a WAND_PATH_IMAGE_SIZE wand path image, like the ones saved while
+    collecting spells, to the path and resizes it to size by nearest
+    neighbour.
+    """
+    if not wand_path_img.any():
+        # a path drawn entirely outside the frame
+        return np.zeros((size, size), dtype=np.uint8)
+    cropped = crop_wand_path(wand_path_img, padding)
+    rows = nearest_indices(cropped.shape[0], size)
+    cols = nearest_indices(cropped.shape[1], size)
+    return cropped[rows[:, None], cols]
+
+
+def rasterize_wand_path(
+    wand_path,
+    size: int = MODEL_INPUT_SIZE,
+    padding: int = 5,
+    frame_shape=FRAME_SHAPE
+) -> np.ndarray:
+    """
+    Draws a wand path into a single channel size x size image, pixel for
+    pixel the same as the pipeline the classifier was trained with: drawing
+    on a full frame, resizing it to WAND_PATH_IMAGE_SIZE, applying
+    CropWandPath and resizing to size by nearest neighbour. The path is drawn
+    on one channel of a reused frame, and only the area it covers is cleared
+    afterwards.
+    """
+    if len(wand_path) < 2:
+        return np.zeros((size, size), dtype=np.uint8)
+
+    points = [(int(x), int(y)) for x, y in wand_path]
+    thickness = get_segment_thickness(len(points))
+    frame = get_blank_frame(frame_shape)
+    for i in range(1, len(points)):
+        cv2.line(frame, points[i - 1], points[i], 255, int(thickness[i - 1]))
+    wand_path_img = cv2.resize(frame, (WAND_PATH_IMAGE_SIZE, WAND_PATH_IMAGE_SIZE))
+
+    xs, ys = zip(*points)
+    radius = int(thickness.max())
+    frame[
+        max(0, min(ys) - radius):max(ys) + radius + 1,
+        max(0, min(xs) - radius):max(xs) + radius + 1
+    ] = 0
+    return resize_wand_path_image(wand_path_img, size, padding)
@@ -1,9 +1,11 @@
+import time
 from abc import ABC, abstractmethod
 
 import cv2
 import numpy as np
 
-from .shared_buffer import SharedFrameBufferWriter
+from .metrics import Stage, record_stage
+from .shared_buffer import DEFAULT_FRAME_BUFFER_NAME, SharedFrameBufferWriter
 
 
 class WandPathVisualizer(ABC):
@@ -25,9 +27,13 @@ class CV2WandPathVisualizer(WandPathVisualizer):
         
 
 class ShmWandPathVisualizer(WandPathVisualizer):
-    def __init__(self):
-        self.shared_frame_buffer = SharedFrameBufferWriter()
+    def __init__(self, name: str = DEFAULT_FRAME_BUFFER_NAME):
+        self.shared_frame_buffer = SharedFrameBufferWriter(name)
         
     def __call__(self, frame, wand_path):
+        start = time.perf_counter()
         wand_path_img = self.draw_wand_path(frame, wand_path)
-        self.shared_frame_buffer.write(wand_path_img)
\ No newline at end of file
+        write_start = time.perf_counter()
+        record_stage(Stage.DRAWING, write_start - start)
+        self.shared_frame_buffer.write(wand_path_img)
+        record_stage(Stage.SHM_WRITE, time.perf_counter() - write_start)
@@ -1,64 +1,276 @@
-import math
-from typing import Optional
+import time
+from typing import Optional, TYPE_CHECKING
 
 import cv2
+import numpy as np
 
-from spellcaster.spell_handler import SpellHandler
+from spellcaster.constants import EARLY_SPELL_CONFIDENCE_THRESHOLD
+from spellcaster.events import EventPublisher, NullEventPublisher
+from spellcaster.utils.metrics import Stage, record_stage
+
+if TYPE_CHECKING:
+    from spellcaster.spell_handler import SpellHandler
+
+
+class WandPath:
+    """
+    Fixed capacity ring buffer of wand points. Every point is stored twice,
+    capacity apart, so the points in order are always a contiguous view of
+    the buffer and appending never shifts or copies the path.
+    """
+    def __init__(self, capacity: int):
+        self.capacity = capacity
+        self.buffer = np.zeros((2 * capacity, 2), dtype=np.int32)
+        self.start = 0
+        self.length = 0
+
+    def append(self, point):
+        idx = (self.start + self.length) % self.capacity
+        self.buffer[idx] = point
+        self.buffer[idx + self.capacity] = point
+        if self.length < self.capacity:
+            self.length += 1
+        else:
+            self.start = (self.start + 1) % self.capacity
+
+    def clear(self):
+        self.start = 0
+        self.length = 0
+
+    def array(self) -> np.ndarray:
+        return self.buffer[self.start:self.start + self.length]
+
+    def tolist(self) -> list[tuple[int, int]]:
+        return [tuple(p) for p in self.array().tolist()]
+
+    def __len__(self):
+        return self.length
+
+    def __getitem__(self, i):
+        x, y = self.array()[i].tolist()
+        return x, y
+
+    def __iter__(self):
+        return iter(self.tolist())
+
+
+class WandMotionModel:
+    """
+    Constant velocity alpha-beta filter over the wand position, in pixels per
+    frame. Predicts where the wand will be in the next frame so keypoints can
+    be gated against the prediction rather than the last seen position.
+    """
+    def __init__(self, alpha: float = 0.85, beta: float = 0.5):
+        self.alpha = alpha
+        self.beta = beta
+        self.position = np.zeros(2)
+        self.velocity = np.zeros(2)
+        self.initialized = False
+
+    def reset(self):
+        self.position[:] = 0
+        self.velocity[:] = 0
+        self.initialized = False
+
+    def predict(self) -> np.ndarray:
+        return self.position + self.velocity
+
+    def speed(self) -> float:
+        return float(np.hypot(*self.velocity))
+
+    def update(self, measurement):
+        if not self.initialized:
+            self.position[:] = measurement
+            self.initialized = True
+            return
+
+        predicted = self.predict()
+        residual = np.asarray(measurement) - predicted
+        self.position = predicted + self.alpha * residual
+        self.velocity = self.velocity + self.beta * residual
+
+    def coast(self):
+        # no measurement this frame, carry the wand along its current velocity
+        self.position = self.predict()
 
 
 class WandTracker:
     def __init__(
         self,
         blob_detector: cv2.SimpleBlobDetector,
-        spell_handler: Optional[SpellHandler] = None
+        spell_handler: Optional["SpellHandler"] = None,
+        roi_radius: Optional[int] = None,
+        detection_scale: float = 1.0,
+        event_publisher: Optional[EventPublisher] = None,
+        early_recognition_interval: Optional[int] = None,
+        early_commit_evaluations: int = 2,
+        early_confidence_threshold: float = EARLY_SPELL_CONFIDENCE_THRESHOLD
     ):
         self.blob_detector = blob_detector
         self.spell_handler = spell_handler
-        self.wand_path = []
+        self.event_publisher = event_publisher or NullEventPublisher()
+        # when set, blobs are only searched for in a window of this radius
+        # around the predicted next wand position, and the full frame is
+        # searched again as soon as a frame misses the wand
+        self.roi_radius = roi_radius
+        # detection runs on the grayscale frame resized by this factor. When
+        # shrinking, the frame is dilated first so averaging doesn't pull a
+        # small wand tip below the blob detector's threshold
+        self.detection_scale = detection_scale
+        kernel_size = max(1, round(1 / detection_scale))
+        self.detection_kernel = np.ones((kernel_size, kernel_size), dtype=np.uint8) if kernel_size > 1 else None
         self.minimum_wand_path_len = 10
         self.maximum_wand_path_len = 60
+        self.wand_path = WandPath(self.maximum_wand_path_len)
+        self.motion_model = WandMotionModel()
+        # keypoints that barely moved since the last wand point are ignored,
+        # which filters out static light sources
+        self.minimum_wand_move = 5
+        # keypoints are accepted within this distance of the predicted wand
+        # position, widened by the current wand speed
+        self.association_radius = 100
         self.patience = 10
         self.empty_frame_cnt = 0
+        # when set, the unfinished wand path is classified every this many
+        # new points, and the spell is cast without waiting for the wand to
+        # disappear once the same spell reached early_confidence_threshold
+        # this many evaluations in a row
+        self.early_recognition_interval = early_recognition_interval
+        self.early_commit_evaluations = early_commit_evaluations
+        self.early_confidence_threshold = early_confidence_threshold
+        self.points_since_evaluation = 0
+        self.early_spell_name = None
+        self.early_spell_streak = 0
+        # after casting a spell early, the rest of the gesture is ignored
+        # until the wand disappears
+        self.spell_committed = False
 
-    def set_spell_handler(self, spell_handler: SpellHandler):
+    def set_spell_handler(self, spell_handler: "SpellHandler"):
         self.spell_handler = spell_handler
 
-    def get_wand_keypoint(self, keypoints):
+    def get_gate_radius(self):
+        return self.association_radius + self.motion_model.speed()
+
+    def get_wand_keypoint(self, keypoints: np.ndarray):
         if len(keypoints) == 0:
             return None
         if len(self.wand_path) == 0:
             return keypoints[0]
-        
-        possible_wand_keypoints = []
-        for k in keypoints:
-            dist = math.dist(k, self.wand_path[-1])
-            if dist > 5 and dist < 100:
-                possible_wand_keypoints.append((k, dist))
-        
-        if len(possible_wand_keypoints) == 0:
+
+        last = self.wand_path.array()[-1]
+        dist_to_last = np.hypot(*(keypoints - last).T)
+        dist_to_predicted = np.hypot(*(keypoints - self.motion_model.predict()).T)
+        valid = (dist_to_last > self.minimum_wand_move) & (dist_to_predicted < self.get_gate_radius())
+        if not valid.any():
             return None
-        return min(possible_wand_keypoints, key=lambda t: t[1])[0]
+        return keypoints[np.argmin(np.where(valid, dist_to_predicted, np.inf))]
+
+    def get_search_window(self, frame_shape):
+        height, width = frame_shape[:2]
+        if self.roi_radius is None or len(self.wand_path) == 0 or self.empty_frame_cnt > 0:
+            return 0, 0, width, height
+
+        x, y = self.motion_model.predict()
+        radius = self.roi_radius + self.motion_model.speed()
+        x0 = int(min(max(x - radius, 0), width))
+        y0 = int(min(max(y - radius, 0), height))
+        x1 = int(min(max(x + radius, 0), width))
+        y1 = int(min(max(y + radius, 0), height))
+        return x0, y0, x1, y1
+
+    def detect_keypoints(self, frame) -> np.ndarray:
+        x0, y0, x1, y1 = self.get_search_window(frame.shape)
+        if x1 - x0 < 2 or y1 - y0 < 2:
+            return np.empty((0, 2), dtype=np.int32)
+
+        start = time.perf_counter()
+        window = cv2.cvtColor(frame[y0:y1, x0:x1], cv2.COLOR_BGR2GRAY)
+        if self.detection_kernel is not None:
+            window = cv2.dilate(window, self.detection_kernel)
+        if self.detection_scale != 1.0:
+            window = cv2.resize(
+                window,
+                None,
+                fx=self.detection_scale,
+                fy=self.detection_scale,
+                interpolation=cv2.INTER_AREA
+            )
+        detection_start = time.perf_counter()
+        record_stage(Stage.GRAYSCALE, detection_start - start)
+        keypoints = self.blob_detector.detect(window)
+        record_stage(Stage.DETECTION, time.perf_counter() - detection_start)
+        if len(keypoints) == 0:
+            return np.empty((0, 2), dtype=np.int32)
+        coords = np.array([k.pt for k in keypoints]) / self.detection_scale + (x0, y0)
+        return np.rint(coords).astype(np.int32)
+
+    def reset_path(self):
+        if len(self.wand_path) > 0:
+            self.event_publisher.path_reset()
+        self.wand_path.clear()
+        self.motion_model.reset()
+        self.points_since_evaluation = 0
+        self.early_spell_name = None
+        self.early_spell_streak = 0
+
+    def recognize_early(self):
+        self.points_since_evaluation += 1
+        if (
+            self.spell_handler is None
+            or len(self.wand_path) < self.minimum_wand_path_len
+            or self.points_since_evaluation < self.early_recognition_interval
+        ):
+            return
+
+        self.points_since_evaluation = 0
+        prediction = self.spell_handler.classify(self.wand_path.tolist())
+        if (
+            prediction is None
+            or not prediction.accepted
+            or prediction.confidence < self.early_confidence_threshold
+        ):
+            self.early_spell_name = None
+            self.early_spell_streak = 0
+            return
+        if prediction.spell_name == self.early_spell_name:
+            self.early_spell_streak += 1
+        else:
+            self.early_spell_name = prediction.spell_name
+            self.early_spell_streak = 1
+
+        if self.early_spell_streak >= self.early_commit_evaluations:
+            self.spell_handler.handle_prediction(prediction)
+            self.reset_path()
+            self.spell_committed = True
 
     def process_frame(self, frame):
-        frame = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
-        keypoints = self.blob_detector.detect(frame)
-        keypoint_coords = [[round(coord) for coord in k.pt] for k in keypoints]
+        keypoint_coords = self.detect_keypoints(frame)
+        start = time.perf_counter()
         wand_keypoint = self.get_wand_keypoint(keypoint_coords)
+        record_stage(Stage.ASSOCIATION, time.perf_counter() - start)
         if wand_keypoint is None:
             self.empty_frame_cnt += 1
+            self.motion_model.coast()
             if self.empty_frame_cnt > self.patience:
                 if len(self.wand_path) >= self.minimum_wand_path_len:
                     if self.spell_handler is not None:
-                        self.spell_handler.handle_spell(self.wand_path)
+                        self.spell_handler.handle_spell(self.wand_path.tolist())
                     else:
                         print("spell detected")
-                        
-                self.wand_path.clear()
+
+                self.reset_path()
+                self.spell_committed = False
         else:
             self.empty_frame_cnt = 0
+            if self.spell_committed:
+                # keep following the wand so the end of the gesture isn't
+                # mistaken for the start of a new one
+                self.motion_model.update(wand_keypoint)
+                return self.wand_path
             self.wand_path.append(wand_keypoint)
-            if len(self.wand_path) > self.maximum_wand_path_len:
-                self.wand_path.pop(0)
+            self.motion_model.update(wand_keypoint)
+            self.event_publisher.wand_point(*wand_keypoint)
+            if self.early_recognition_interval is not None:
+                self.recognize_early()
 
         return self.wand_path
-    
\ No newline at end of file
@@ -1,10 +1,75 @@
 // src/pages/Livestream.js
-import React from 'react';
-import { Box, Image, Text } from '@chakra-ui/react';
+import React, { useEffect, useRef, useState } from 'react';
+import { Box, Button, ButtonGroup, Image, Text } from '@chakra-ui/react';
+
+const TRAIL_LENGTH = 60;
 
 const Viewer = () => {
-  const streamUrl = `${import.meta.env.VITE_BACKEND_URL}/stream`;
-  console.log(streamUrl);
+  const eventsUrl = `${import.meta.env.VITE_BACKEND_URL.replace(/^http/, 'ws')}/events`;
+  const canvasRef = useRef(null);
+  const trailRef = useRef([]);
+  const cameraRef = useRef(null);
+  const [frameSize, setFrameSize] = useState({ width: 640, height: 480 });
+  const [cameras, setCameras] = useState([]);
+  const [camera, setCamera] = useState(null);
+  const [lastSpell, setLastSpell] = useState(null);
+  const streamUrl = `${import.meta.env.VITE_BACKEND_URL}/stream${camera === null ? '' : `?camera=${camera}`}`;
+
+  const selectCamera = (selected) => {
+    cameraRef.current = selected;
+    trailRef.current = [];
+    setCamera(selected);
+    setLastSpell(null);
+    requestAnimationFrame(drawTrail);
+  };
+
+  const drawTrail = () => {
+    const canvas = canvasRef.current;
+    if (!canvas) return;
+    const ctx = canvas.getContext('2d');
+    const trail = trailRef.current;
+    ctx.clearRect(0, 0, canvas.width, canvas.height);
+    if (trail.length < 2) return;
+
+    ctx.strokeStyle = 'rgba(255, 200, 0, 0.9)';
+    ctx.lineWidth = 4;
+    ctx.lineCap = 'round';
+    ctx.lineJoin = 'round';
+    ctx.beginPath();
+    ctx.moveTo(trail[0].x, trail[0].y);
+    trail.slice(1).forEach(({ x, y }) => ctx.lineTo(x, y));
+    ctx.stroke();
+  };
+
+  useEffect(() => {
+    const socket = new WebSocket(eventsUrl);
+    socket.onmessage = (message) => {
+      const event = JSON.parse(message.data);
+      // events of every camera arrive, only the selected one's are shown
+      if (event.camera !== undefined && event.camera !== cameraRef.current) return;
+      switch (event.type) {
+        case 'config':
+          setFrameSize({ width: event.width, height: event.height });
+          setCameras(event.cameras);
+          if (cameraRef.current === null) selectCamera(event.cameras[0]);
+          break;
+        case 'wand_point':
+          trailRef.current = [...trailRef.current, event].slice(-TRAIL_LENGTH);
+          requestAnimationFrame(drawTrail);
+          break;
+        case 'path_reset':
+          trailRef.current = [];
+          requestAnimationFrame(drawTrail);
+          break;
+        case 'spell':
+          setLastSpell(event);
+          break;
+        default:
+          break;
+      }
+    };
+    return () => socket.close();
+  }, [eventsUrl]);
 
   return (
     <Box
@@ -19,13 +84,46 @@ const Viewer = () => {
       <Text fontSize="2xl" color="white" mb={4}>
         Live Stream
       </Text>
-      <Image
-        src={streamUrl}
-        alt="Live Stream"
-        maxWidth="100%"
-        borderRadius="md"
-        boxShadow="lg"
-      />
+      {cameras.length > 1 && (
+        <ButtonGroup size="sm" mb={4}>
+          {cameras.map((index) => (
+            <Button
+              key={index}
+              colorScheme={index === camera ? 'yellow' : 'gray'}
+              onClick={() => selectCamera(index)}
+            >
+              Camera {index}
+            </Button>
+          ))}
+        </ButtonGroup>
+      )}
+      <Box position="relative" maxWidth="100%">
+        <Image
+          src={streamUrl}
+          alt="Live Stream"
+          maxWidth="100%"
+          borderRadius="md"
+          boxShadow="lg"
+        />
+        <canvas
+          ref={canvasRef}
+          width={frameSize.width}
+          height={frameSize.height}
+          style={{
+            position: 'absolute',
+            top: 0,
+            left: 0,
+            width: '100%',
+            height: '100%',
+            pointerEvents: 'none',
+          }}
+        />
+      </Box>
+      <Text fontSize="lg" color="white" mt={4}>
+        {lastSpell
+          ? `Last spell: ${lastSpell.spell} (${(lastSpell.confidence * 100).toFixed(0)}%)`
+          : 'No spell cast yet'}
+      </Text>
     </Box>
   );
 };